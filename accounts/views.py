@@ -16,6 +16,8 @@ from .utils import normalize_phone
 from .forms import ProfileForm
 from django.contrib.auth.decorators import login_required
 
+from services.mail import queue_email
+
 
 User = get_user_model()
 
@@ -169,14 +171,10 @@ def password_reset_request(request):
 
         PasswordResetCode.objects.create(user=user, code=code)
 
-        from django.core.mail import send_mail
-
-        send_mail(
+        queue_email(
+            user.email,
             'Код для сброса пароля',
             f'Ваш код для сброса пароля: {code}\nОн действует 15 минут.',
-            getattr(settings, 'DEFAULT_FROM_EMAIL', 'no-reply@citytickets.local'),
-            [user.email],
-            fail_silently=False,
         )
 
         context['sent'] = True
@@ -294,13 +292,10 @@ def profile_view(request):
         ProfileEditCode.objects.filter(user=user, is_used=False).update(is_used=True)
         ProfileEditCode.objects.create(user=user, code=code)
 
-        from django.core.mail import send_mail
-        send_mail(
+        queue_email(
+            user.email,
             'Код подтверждения для редактирования профиля',
             f'Ваш код: {code}\nОн действует {VERIFIED_TTL_MIN} минут.',
-            getattr(settings, 'DEFAULT_FROM_EMAIL', 'no-reply@citytickets.local'),
-            [user.email],
-            fail_silently=False,
         )
 
         request.session['profile_edit_code_sent'] = True
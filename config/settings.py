@@ -34,6 +34,7 @@ INSTALLED_APPS = [
     # сторонние
     'axes',              # 👈 защита от bruteforce
     'django_apscheduler',
+    'django_rq',         # фоновые задачи через Redis (см. TASKS_BACKEND)
 
     # твои приложения
     'accounts',
@@ -85,10 +86,36 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # ждём блокировку записи, а не падаем сразу "database is locked"
+        'OPTIONS': {'timeout': 20},
     }
 }
 
 
+# ========= КЭШ =========
+# Если задан REDIS_URL — общий кэш для всех воркеров (инвалидация видна сразу везде).
+# Без него — локальный кэш процесса: в каждом воркере свой, поэтому
+# CATALOG_CACHE_TIMEOUT держим небольшим.
+
+REDIS_URL = os.environ.get('REDIS_URL', '')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'citytickets',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -156,6 +183,11 @@ DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
 EMAIL_TIMEOUT = 10
 
+# очередь писем (services/mail.py): пачка на одно SMTP-соединение и повторы
+EMAIL_BATCH_SIZE = 50
+EMAIL_MAX_ATTEMPTS = 5
+EMAIL_RETRY_BASE_SECONDS = 30   # 30с, 1м, 2м, 4м...
+
 
 # ========= CORS / CSRF (оставляем как у тебя) =========
 
@@ -247,3 +279,87 @@ AXES_RESET_ON_SUCCESS = True
 # считаем только реальные провалы авторизации
 # AXES_ONLY_USER_FAILURES = True
 AXES_ONLY_AUTHENTICATION_FAILURES = True
+
+
+# ========= ФОНОВЫЕ ЗАДАЧИ (services/tasks.py) =========
+# 'rq' — очередь в Redis (воркер: python manage.py rqworker default)
+# 'thread' — пул потоков в веб-процессе, 'sync' — сразу (тесты)
+
+TASKS_BACKEND = os.environ.get('TASKS_BACKEND', 'rq' if REDIS_URL else 'thread')
+TASKS_THREADS = 4
+
+RQ_QUEUES = {
+    'default': {
+        'URL': REDIS_URL or 'redis://localhost:6379/0',
+        'DEFAULT_TIMEOUT': 600,
+    },
+}
+
+
+# ========= КАТАЛОГ СОБЫТИЙ =========
+
+# сколько карточек на одной странице /events/ (и в "Показать ещё")
+EVENTS_PAGE_SIZE = 24
+
+# сколько живут закэшированные карточки и страницы событий (сек)
+CATALOG_CACHE_TIMEOUT = 60 * 60 if REDIS_URL else 5 * 60
+
+# подсказки в поиске: индекс в памяти процесса
+AUTOCOMPLETE_REBUILD_SECONDS = 300   # полная пересборка не реже, чем раз в 5 минут
+AUTOCOMPLETE_BUDGET_MS = 5           # потолок времени на один поиск по индексу
+
+
+# ========= ПОКУПКИ =========
+
+# сколько часов помним ключ повторной отправки оплаты (Idempotency-Key)
+IDEMPOTENCY_TTL_HOURS = 24
+
+# отмена события (services/cancellation.py): билетов в пачке и темп писем
+CANCEL_CHUNK_SIZE = 500
+CANCEL_NOTIFY_PER_SECOND = 50
+
+
+# ========= QR-КОДЫ БИЛЕТОВ =========
+
+# сколько PNG держать в памяти процесса (LRU, ~1-2 КБ каждая)
+QR_LRU_SIZE = 2048
+
+# общий кэш для QR (alias из CACHES); None — только память процесса
+QR_CACHE_ALIAS = 'default'
+
+# сверка офлайн-сканов: насколько часы сканера могут спешить (сек)
+GATE_CLOCK_SKEW = 300
+
+
+# ========= PDF БИЛЕТОВ =========
+
+# TTF с кириллицей (Helvetica её не умеет); нет файла — Helvetica
+PDF_FONT_PATH = os.environ.get('PDF_FONT_PATH', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+PDF_FONT_BOLD_PATH = os.environ.get('PDF_FONT_BOLD_PATH', '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf')
+
+# сколько живёт готовый PDF в кэше (сек); ключ меняется при смене статуса/события
+PDF_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+# ========= ХРАНЕНИЕ ИСТОРИИ =========
+
+# delete_old_spectacles: события старше N дней удаляются, билеты — в архив
+RETENTION_DAYS = 90
+ARCHIVE_ROOT = os.environ.get('ARCHIVE_ROOT', os.path.join(BASE_DIR, 'archive'))
+
+
+# ========= АДМИН-АНАЛИТИКА =========
+
+# дашборд отдаётся из кэша; старше FRESH секунд — пересчёт в фоне (services/analytics.py)
+ANALYTICS_CACHE_FRESH = 60
+ANALYTICS_CACHE_TIMEOUT = 60 * 60 * 6
+# пустой кэш считает один запрос, остальные ждут его результат до N секунд
+ANALYTICS_COLD_WAIT = 10
+
+# фоновые выгрузки (services/exports.py): прогресс пишется раз в N строк
+EXPORT_PROGRESS_EVERY = 10000
+
+# готовые выгрузки — вне MEDIA_ROOT, скачиваются только через страницу выгрузок
+EXPORT_ROOT = os.environ.get('EXPORT_ROOT', os.path.join(BASE_DIR, 'exports'))
+EXPORT_KEEP_DAYS = 7        # потом файл удаляется (manage.py cleanup_exports)
+EXPORT_STALE_MINUTES = 30   # задача без отметки жизни дольше — потеряна (рестарт воркера)
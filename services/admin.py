@@ -1,8 +1,9 @@
 from django.contrib import admin, messages
-from django.utils import timezone
 
-from .models import Event, Ticket, Location
-from .views import send_refund_email  # твой хелпер
+from django.db import transaction
+
+from . import inventory, refunds
+from .models import Event, Ticket, Location, OutboundEmail, TicketScan, ExportJob
 
 @admin.register(Location)
 class LocationAdmin(admin.ModelAdmin):
@@ -13,49 +14,96 @@ class TicketAdmin(admin.ModelAdmin):
     list_display = ('id', 'event', 'user', 'price', 'status', 'created_at')
     list_filter = ('status', 'created_at')
 
+    # места удаляемых билетов возвращаем в остаток (services/inventory.py)
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            inventory.forget(Ticket.objects.filter(pk=obj.pk))
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            inventory.forget(queryset)
+            super().delete_queryset(request, queryset)
+
 @admin.register(Event)
 class EventAdmin(admin.ModelAdmin):
     list_display = ('title', 'datetime_passing', 'price', 'category')
     list_filter = ('category',)
 
+    actions = ['cancel_events', 'refund_all_tickets']
+
+    # Возвраты — services/refunds.py: один UPDATE на событие + письма в очередь
+
+    def _refund(self, request, events, statuses=refunds.REFUND_ON_DELETE):
+        total = {'tickets': 0, 'amount': 0, 'emails': 0}
+
+        def progress(event, result):
+            if not result.tickets:
+                return
+            total['tickets'] += result.tickets
+            total['amount'] += result.amount
+            total['emails'] += result.emails
+            messages.info(
+                request,
+                f'«{event.title}»: возвращено {result.tickets} билетов на {result.amount} ₸, '
+                f'писем в очереди: {result.emails} ({result.seconds:.1f} с)'
+            )
+
+        refunds.refund_events(events, progress=progress, statuses=statuses)
+        return total
+
     # 🔥 1) удаление одного события из карточки
     def delete_model(self, request, obj):
-        now = timezone.now()
-
-        # Берём ВСЕ билеты события, которые ещё не refunded
-        tickets = Ticket.objects.filter(event=obj).exclude(status='refunded')
-
-        refunded = 0
-        for t in tickets:
-            t.status = 'refunded'
-            t.refunded_at = now
-            t.save(update_fields=['status', 'refunded_at'])
-            refunded += 1
-            try:
-                send_refund_email(t)
-            except Exception:
-                pass
-
+        total = self._refund(request, [obj])
         super().delete_model(request, obj)
-        messages.success(request, f'Событие удалено. Возвратов выполнено: {refunded}')
+        messages.success(request, f'Событие удалено. Возвратов выполнено: {total["tickets"]}')
 
     # 🔥 2) массовое удаление из списка (actions delete selected)
     def delete_queryset(self, request, queryset):
-        now = timezone.now()
-
-        events_ids = list(queryset.values_list('id', flat=True))
-        tickets = Ticket.objects.filter(event_id__in=events_ids).exclude(status='refunded')
-
-        refunded = 0
-        for t in tickets.select_related('event', 'user'):
-            t.status = 'refunded'
-            t.refunded_at = now
-            t.save(update_fields=['status', 'refunded_at'])
-            refunded += 1
-            try:
-                send_refund_email(t)
-            except Exception:
-                pass
-
+        total = self._refund(request, queryset.only('id', 'title'))
         super().delete_queryset(request, queryset)
-        messages.success(request, f'События удалены. Возвратов выполнено: {refunded}')
+        messages.success(request, f'События удалены. Возвратов выполнено: {total["tickets"]}')
+
+    @admin.action(description='Отменить событие (билеты и письма — в фоне)')
+    def cancel_events(self, request, queryset):
+        cancelled = 0
+        for event in queryset.filter(is_cancelled=False):
+            event.cancel()
+            cancelled += 1
+        messages.success(
+            request,
+            f'Отменено событий: {cancelled}. Билеты аннулируются и покупатели '
+            f'получают письма в фоне.'
+        )
+
+    @admin.action(description='Вернуть деньги за все билеты (кроме использованных)')
+    def refund_all_tickets(self, request, queryset):
+        total = self._refund(request, queryset.only('id', 'title'), statuses=refunds.REFUNDABLE)
+        messages.success(
+            request,
+            f'Возвратов выполнено: {total["tickets"]} на {total["amount"]} ₸, '
+            f'писем в очереди: {total["emails"]}'
+        )
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('id', 'to_email', 'subject', 'status', 'attempts', 'created_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('to_email', 'subject')
+    readonly_fields = ('created_at', 'updated_at', 'sent_at', 'last_error')
+
+
+@admin.register(TicketScan)
+class TicketScanAdmin(admin.ModelAdmin):
+    list_display = ('ticket_ref', 'device', 'scanned_at', 'result', 'uploaded_at')
+    list_filter = ('result', 'device')
+    search_fields = ('=ticket_ref', 'device')
+    raw_id_fields = ('ticket',)
+
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'format', 'status', 'rows_done', 'rows_total', 'requested_by', 'created_at', 'finished_at')
+    list_filter = ('status', 'kind', 'format')
+    readonly_fields = ('created_at', 'started_at', 'finished_at', 'heartbeat_at', 'error')
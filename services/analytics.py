@@ -0,0 +1,419 @@
+"""
+Данные дашборда админ-аналитики и их кэш (stale-while-revalidate).
+
+build_dashboard(period, mode) считает всё, что показывает страница, —
+из дневной сводки DailySales (services/rollups.py) и пары запросов к
+Ticket. ABC, Парето, перцентили цен и выбросы считаются над массивами
+NumPy (services/stats.py). Результат — простые dict/list, его можно
+положить в кэш.
+
+get_dashboard() отдаёт последний посчитанный результат для (period, mode)
+сразу, даже если он устарел. Если ему больше ANALYTICS_CACHE_FRESH секунд —
+пересчёт уходит в фон (services/tasks.py), и следующий показ получит
+свежие данные. Пересчёт одного ключа запускает только один процесс
+(cache.add на ключ-замок), поэтому несколько менеджеров с открытым
+дашбордом во время старта продаж дают один запрос к БД на период,
+а не по запросу на каждое обновление страницы.
+
+Считаем на месте (в запросе) только когда в кэше ничего нет (первый
+показ, истёк ANALYTICS_CACHE_TIMEOUT, свежий деплой) или нажато
+"Обновить" (?refresh=1) — и тоже под замком: считает один запрос,
+остальные до ANALYTICS_COLD_WAIT секунд ждут его результат в кэше, а не
+запускают тот же расчёт сами. Не дождались — get_dashboard() отдаёт None,
+страница показывает "данные считаются" и обновляется сама.
+"""
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Exists, OuterRef, Sum
+from django.utils import timezone
+import numpy as np
+
+from accounts.models import User
+
+from . import cohorts, stats
+from .models import DailySales, Event, Ticket
+from .tasks import run_in_background
+
+PERIODS = ('all', '7', '30', '90')
+MODES = ('gross', 'net')
+
+# меняется при изменении формата данных — старые записи кэша не подхватятся
+CACHE_VERSION = 3
+
+# столбцов в матрице когорт (месяцев после первой покупки)
+COHORT_MONTHS = 12
+
+
+@dataclass
+class Dashboard:
+    data: dict
+    computed_at: datetime
+    stale: bool = False
+
+    @property
+    def age(self):
+        return int((timezone.now() - self.computed_at).total_seconds())
+
+
+def normalize(period, mode):
+    return (
+        period if period in PERIODS else '30',
+        mode if mode in MODES else 'gross',
+    )
+
+
+def _key(period, mode):
+    return f'analytics:v{CACHE_VERSION}:{period}:{mode}'
+
+
+def _lock_key(period, mode):
+    return f'{_key(period, mode)}:refreshing'
+
+
+def _fresh_seconds():
+    return getattr(settings, 'ANALYTICS_CACHE_FRESH', 60)
+
+
+def _timeout():
+    return getattr(settings, 'ANALYTICS_CACHE_TIMEOUT', 60 * 60 * 6)
+
+
+def _lock_timeout():
+    # замок живёт не дольше пары "свежих" интервалов: упавший пересчёт не заблокирует ключ навсегда
+    return _fresh_seconds() * 2
+
+
+# как часто заглядывать в кэш, пока ключ считает другой запрос (сек)
+COLD_POLL = 0.2
+
+
+def period_start(period):
+    """
+    Начало периода целыми днями (сводка DailySales — по дням):
+    -> (день, начало этого дня в TIME_ZONE) или None для 'all'.
+    Тем же началом режет строки CSV-выгрузка (services/exports.py).
+    """
+    if period == 'all':
+        return None
+    since_day = timezone.localdate() - timedelta(days=int(period))
+    return since_day, timezone.make_aware(datetime.combine(since_day, datetime.min.time()))
+
+
+# ===== Расчёт =====
+
+def build_dashboard(period, mode):
+    """
+    period: all | 7 | 30 | 90, mode: gross | net (net — только paid).
+    """
+    # Количества и суммы — из дневной сводки DailySales (services/rollups.py):
+    # строк в ней "дни × события × статусы", сколько бы ни было билетов.
+    # По Ticket остались только покупатели (distinct user) и последние покупки.
+    rollup = DailySales.objects.filter(tickets__gt=0)
+    base_qs = Ticket.objects.select_related('event', 'user').all()
+
+    # ----------------------------
+    # 1) Периоды + сравнение с предыдущим периодом
+    # ----------------------------
+    # сводка по дням — период считаем целыми днями (с даты "N дней назад")
+    if period != 'all':
+        days = int(period)
+        since_day, since = period_start(period)
+
+        rows = rollup.filter(date__gte=since_day)
+        qs = base_qs.filter(created_at__gte=since)
+
+        prev_rows = rollup.filter(date__gte=since_day - timedelta(days=days), date__lt=since_day)
+    else:
+        rows = rollup
+        qs = base_qs
+        prev_rows = None
+
+    # ✅ Gross / Net:
+    # gross: считаем всё (как было)
+    # net: выручка и продажи считаются только по paid (refund не входит)
+    paid_rows = rows.filter(status='paid')
+    rows_for_kpi = paid_rows if mode == 'net' else rows
+    prev_for_kpi = None
+    if prev_rows is not None:
+        prev_for_kpi = prev_rows.filter(status='paid') if mode == 'net' else prev_rows
+
+    def kpi(r):
+        totals = r.aggregate(tickets=Sum('tickets'), revenue=Sum('revenue'))
+        return {
+            'tickets': totals['tickets'] or 0,
+            'revenue': totals['revenue'] or 0,
+        }
+
+    cur = kpi(rows_for_kpi)
+    prev = kpi(prev_for_kpi) if prev_for_kpi is not None else None
+
+    def pct(cur_v, prev_v):
+        if prev_v is None:
+            return None
+        if prev_v == 0:
+            return None if cur_v == 0 else 100.0
+        return round((cur_v - prev_v) * 100 / prev_v, 1)
+
+    growth = {
+        'tickets_pct': pct(cur['tickets'], prev['tickets'] if prev else None),
+        'revenue_pct': pct(cur['revenue'], prev['revenue'] if prev else None),
+    }
+
+    total_tickets = cur['tickets']
+    total_revenue = cur['revenue']
+
+    # ----------------------------
+    # 2) Воронка + продуктовые метрики
+    # ----------------------------
+    total_users = User.objects.count()
+
+    # buyers и repeat считаем по "paid", иначе refunded будет считаться покупкой
+    qs_paid = qs.filter(status='paid')
+    buyers = qs_paid.values('user_id').distinct().count()
+    repeat_buyers = (
+        qs_paid.values('user_id')
+              .annotate(c=Count('id'))
+              .filter(c__gte=2)
+              .count()
+    )
+
+    paid = kpi(paid_rows) if mode != 'net' else cur
+    avg_ticket_price = (paid['revenue'] / paid['tickets']) if paid['tickets'] else 0
+    arppu = (float(paid['revenue']) / buyers) if buyers else 0
+    repeat_rate = (repeat_buyers * 100 / buyers) if buyers else 0
+
+    funnel = {
+        'total_users': total_users,
+        'buyers': buyers,
+        'tickets': total_tickets,
+        'repeat_buyers': repeat_buyers,
+        'repeat_rate': round(repeat_rate, 1),
+        'avg_ticket_price': round(float(avg_ticket_price), 1) if avg_ticket_price else 0,
+        'arppu': round(float(arppu), 1) if arppu else 0,
+    }
+
+    # ----------------------------
+    # 3) Качество (refund/used) — считаем по периоду, независимо от mode
+    # ----------------------------
+    by_status = dict(rows.values_list('status').annotate(n=Sum('tickets')).order_by())
+    refunded_count = by_status.get('refunded', 0)
+    used_count = by_status.get('used', 0)
+
+    denom = sum(by_status.values())  # чтобы проценты были адекватны по "факту"
+    refund_rate = (refunded_count * 100 / denom) if denom else 0
+    used_rate = (used_count * 100 / denom) if denom else 0
+
+    quality = {
+        'refunded_count': refunded_count,
+        'used_count': used_count,
+        'refund_rate': round(refund_rate, 1),
+        'used_rate': round(used_rate, 1),
+    }
+
+    # ----------------------------
+    # 4) Продажи по событиям/категориям/последние покупки
+    # ----------------------------
+    # Для таблиц продаж логичнее показывать "paid" (иначе refunded будет портить картину)
+    sales_rows = paid_rows if mode == 'net' else rows
+
+    sales_by_event = (
+        sales_rows.values('event__id', 'event__title')
+                  .annotate(tickets=Sum('tickets'), revenue=Sum('revenue'))
+                  .order_by('-tickets', '-revenue')
+    )
+    sales_by_event = list(sales_by_event)
+    top_events = sales_by_event[:5]
+
+    sales_by_category_raw = (
+        sales_rows.values('event__category')
+                  .annotate(tickets=Sum('tickets'), revenue=Sum('revenue'))
+                  .order_by('-tickets', '-revenue')
+    )
+
+    category_map = dict(Event.CATEGORY_CHOICES)
+    sales_by_category = [
+        {
+            'code': row['event__category'],
+            'name': category_map.get(row['event__category'], row['event__category']),
+            'tickets': row['tickets'],
+            'revenue': row['revenue'],
+        }
+        for row in sales_by_category_raw
+    ]
+
+    recent_purchases = [
+        {
+            'created_at': t.created_at,
+            'user': {'email': t.user.email, 'phone_number': t.user.phone_number},
+            'event': {'title': t.event.title},
+            'price': t.price,
+            'get_status_display': t.get_status_display(),
+        }
+        for t in qs.order_by('-created_at')[:50]
+    ]
+
+    # ----------------------------
+    # 5) График (по дням) — тоже по sales_rows, чтобы net реально был net
+    # ----------------------------
+    series = (
+        sales_rows.values('date')
+                  .annotate(revenue=Sum('revenue'), tickets=Sum('tickets'))
+                  .order_by('date')
+    )
+    chart_labels = [str(x['date']) for x in series]
+    chart_revenue = [float(x['revenue'] or 0) for x in series]
+    chart_tickets = [int(x['tickets'] or 0) for x in series]
+
+    # ----------------------------
+    # 6) ABC-анализ и Парето (по выручке) — тоже по sales_rows, NumPy
+    # ----------------------------
+    cols = stats.rollup_columns(sales_rows)
+    event_ids, event_tickets, event_revenue = stats.by_event(cols)
+    cum_share, classes = stats.abc(event_revenue)
+
+    titles = {row['event__id']: row['event__title'] for row in sales_by_event}
+    abc_rows = [
+        {
+            'event__id': int(pk),
+            'event__title': titles.get(int(pk), ''),
+            'revenue': int(revenue),
+            'tickets': int(tickets),
+            'abc': str(cls),
+            'cum_share': round(float(share) * 100, 1),
+        }
+        for pk, tickets, revenue, cls, share in zip(
+            event_ids[:50], event_tickets[:50], event_revenue[:50], classes[:50], cum_share[:50],
+        )
+    ]
+    abc_summary = {cls: int((classes == cls).sum()) for cls in ('A', 'B', 'C')}
+    pareto = stats.pareto(event_revenue)
+
+    # цена проданного билета: строка сводки = tickets билетов по revenue / tickets
+    price_stats = stats.percentiles(cols.revenue / np.maximum(cols.tickets, 1), weights=cols.tickets)
+
+    # ----------------------------
+    # 7) Алерты/мониторинг
+    # ----------------------------
+    upcoming_no_sales = list(
+        Event.objects.filter(datetime_passing__gte=timezone.now())
+             .exclude(Exists(rollup.filter(event=OuterRef('pk'))))
+             .order_by('datetime_passing')
+             .values('id', 'title', 'datetime_passing')[:10]
+    )
+
+    # цены событий — одним запросом, выбросы по IQR (services/stats.py)
+    event_prices = list(Event.objects.values_list('id', 'title', 'price'))
+    price_alerts = []
+    price_fences = (None, None)
+    if event_prices:
+        prices = np.fromiter((p for _, _, p in event_prices), dtype=np.float64, count=len(event_prices))
+        mask, price_fences = stats.iqr_outliers(prices)
+        flagged = np.flatnonzero(mask)
+        flagged = flagged[np.argsort(-prices[flagged], kind='stable')][:10]
+        price_alerts = [
+            {'id': event_prices[i][0], 'title': event_prices[i][1], 'price': event_prices[i][2]}
+            for i in flagged
+        ]
+
+    # ----------------------------
+    # 8) Когорты (удержание по месяцам первой покупки) — готовая таблица, без периода
+    # ----------------------------
+    cohort_rows = cohorts.retention_matrix(COHORT_MONTHS)
+
+    refunds_by_event = list(
+        rows.filter(status='refunded')
+            .values('event__id', 'event__title')
+            .annotate(refunds=Sum('tickets'))
+            .order_by('-refunds')[:10]
+    )
+
+    return {
+        'total_tickets': total_tickets,
+        'total_revenue': total_revenue,
+        'growth': growth,
+
+        'funnel': funnel,
+        'quality': quality,
+
+        'top_events': top_events,
+        'sales_by_event': sales_by_event,
+        'sales_by_category': sales_by_category,
+        'recent_purchases': recent_purchases,
+
+        'chart_labels': chart_labels,
+        'chart_revenue': chart_revenue,
+        'chart_tickets': chart_tickets,
+
+        'abc_rows': abc_rows,
+        'abc_summary': abc_summary,
+        'pareto': pareto,
+        'price_stats': price_stats,
+        'price_fences': price_fences,
+
+        'upcoming_no_sales': upcoming_no_sales,
+        'price_alerts': price_alerts,
+        'refunds_by_event': refunds_by_event,
+
+        'cohort_rows': cohort_rows,
+        'cohort_offsets': list(range(COHORT_MONTHS)),
+    }
+
+
+# ===== Кэш =====
+
+def _store(period, mode):
+    entry = {'data': build_dashboard(period, mode), 'computed_at': timezone.now()}
+    cache.set(_key(period, mode), entry, timeout=_timeout())
+    return entry
+
+
+def refresh(period, mode):
+    """
+    Фоновый пересчёт устаревшего ключа (аргументы — строки, годится и для rq).
+    """
+    try:
+        _store(period, mode)
+    finally:
+        cache.delete(_lock_key(period, mode))
+
+
+def _wait_for(period, mode):
+    """
+    Ключ считает другой запрос: ждём его результат. -> запись кэша или None.
+    """
+    deadline = time.monotonic() + getattr(settings, 'ANALYTICS_COLD_WAIT', 10)
+    while True:
+        entry = cache.get(_key(period, mode))
+        if entry is not None or time.monotonic() >= deadline:
+            return entry
+        time.sleep(COLD_POLL)
+
+
+def get_dashboard(period, mode, force=False):
+    """
+    -> Dashboard или None (ключа нет, его считает другой запрос и не успел
+    за ANALYTICS_COLD_WAIT секунд).
+    """
+    period, mode = normalize(period, mode)
+    entry = None if force else cache.get(_key(period, mode))
+
+    if entry is None:
+        if cache.add(_lock_key(period, mode), 1, timeout=_lock_timeout()):
+            try:
+                entry = _store(period, mode)
+            finally:
+                cache.delete(_lock_key(period, mode))
+            return Dashboard(entry['data'], entry['computed_at'])
+        # "Обновить" при идущем пересчёте отдаст то, что уже лежит в кэше
+        entry = _wait_for(period, mode)
+        if entry is None:
+            return None
+
+    stale = timezone.now() - entry['computed_at'] > timedelta(seconds=_fresh_seconds())
+    if stale and cache.add(_lock_key(period, mode), 1, timeout=_lock_timeout()):
+        run_in_background(refresh, period, mode)
+    return Dashboard(entry['data'], entry['computed_at'], stale=stale)
@@ -0,0 +1,208 @@
+"""
+Подсказки для строки поиска: индекс в памяти процесса.
+
+Храним отсортированный список ключей (нормализованный текст) и ищем
+префикс через bisect — это O(log n) + несколько шагов вперёд, без БД.
+В индекс попадают только будущие неотменённые события:
+  - название (и каждое слово названия, чтобы "димаш" находил "Концерт Димаша")
+  - организатор
+  - площадка и город
+
+Индекс строится лениво при первом запросе, дальше обновляется по сигналам
+(services/signals.py) и раз в AUTOCOMPLETE_REBUILD_SECONDS пересобирается
+целиком — чтобы подтянуть изменения из других воркеров.
+"""
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .models import Event
+
+KIND_TITLE = 'title'
+KIND_ORGANIZER = 'organizer'
+KIND_LOCATION = 'location'
+
+MIN_PREFIX = 2
+
+
+def normalize(text: str) -> str:
+    return ' '.join(re.findall(r'\w+', (text or '').lower().replace('ё', 'е')))
+
+
+def _event_entries(event):
+    """
+    Ключи индекса для одного события: (key, kind, label, event_id, timestamp).
+    """
+    if event.is_cancelled or event.datetime_passing <= timezone.now():
+        return []
+
+    ts = event.datetime_passing.timestamp()
+    entries = []
+
+    title_key = normalize(event.title)
+    words = title_key.split()
+    for i in range(len(words)):
+        entries.append((' '.join(words[i:]), KIND_TITLE, event.title, event.pk, ts))
+
+    if event.organizer:
+        entries.append((normalize(event.organizer), KIND_ORGANIZER, event.organizer, event.pk, ts))
+
+    loc = event.location
+    if loc:
+        entries.append((normalize(loc.name), KIND_LOCATION, loc.name, event.pk, ts))
+        if loc.city:
+            entries.append((normalize(loc.city), KIND_LOCATION, loc.city, event.pk, ts))
+
+    return [e for e in entries if e[0]]
+
+
+class PrefixIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = []     # отсортированный список кортежей
+        self._by_event = {}    # event_id -> его кортежи (для точечного удаления)
+        self.built_at = None
+
+    # ----- построение -----
+
+    def rebuild(self):
+        events = (
+            Event.objects
+            .filter(datetime_passing__gt=timezone.now(), is_cancelled=False)
+            .select_related('location')
+            .only('id', 'title', 'organizer', 'datetime_passing', 'is_cancelled',
+                  'location__name', 'location__city')
+        )
+
+        entries = []
+        by_event = {}
+        for event in events.iterator(chunk_size=2000):
+            ev_entries = _event_entries(event)
+            if ev_entries:
+                by_event[event.pk] = ev_entries
+                entries.extend(ev_entries)
+        entries.sort()
+
+        with self._lock:
+            self._entries = entries
+            self._by_event = by_event
+            self.built_at = time.monotonic()
+
+    def is_stale(self) -> bool:
+        max_age = getattr(settings, 'AUTOCOMPLETE_REBUILD_SECONDS', 300)
+        return self.built_at is None or time.monotonic() - self.built_at > max_age
+
+    # ----- инкрементальные обновления -----
+
+    def _remove_locked(self, event_id):
+        for entry in self._by_event.pop(event_id, []):
+            i = bisect_left(self._entries, entry)
+            if i < len(self._entries) and self._entries[i] == entry:
+                del self._entries[i]
+
+    def update_event(self, event):
+        if self.built_at is None:
+            return  # индекс ещё не строился — соберётся при первом запросе
+        new_entries = _event_entries(event)
+        with self._lock:
+            self._remove_locked(event.pk)
+            if new_entries:
+                self._by_event[event.pk] = new_entries
+                for entry in new_entries:
+                    insort(self._entries, entry)
+
+    def remove_event(self, event_id):
+        if self.built_at is None:
+            return
+        with self._lock:
+            self._remove_locked(event_id)
+
+    # ----- поиск -----
+
+    def lookup(self, query: str, limit: int = 8):
+        prefix = normalize(query)
+        if len(prefix) < MIN_PREFIX:
+            return []
+
+        budget = getattr(settings, 'AUTOCOMPLETE_BUDGET_MS', 5) / 1000
+        deadline = time.perf_counter() + budget
+        now_ts = timezone.now().timestamp()
+
+        results = []
+        seen = set()
+        with self._lock:
+            entries = self._entries
+            i = bisect_left(entries, (prefix,))
+            while i < len(entries) and len(results) < limit:
+                key, kind, label, event_id, ts = entries[i]
+                if not key.startswith(prefix):
+                    break
+                i += 1
+                if ts <= now_ts:
+                    continue  # событие уже прошло, уйдёт при пересборке
+                dedupe = (kind, event_id) if kind == KIND_TITLE else (kind, label)
+                if dedupe in seen:
+                    continue
+                seen.add(dedupe)
+                results.append({
+                    'kind': kind,
+                    'text': label,
+                    'event_id': event_id if kind == KIND_TITLE else None,
+                })
+                if time.perf_counter() > deadline:
+                    break
+
+        return results
+
+
+_index = PrefixIndex()
+
+
+_refreshing = threading.Event()
+
+
+def _background_rebuild():
+    try:
+        _index.rebuild()
+    finally:
+        connection.close()
+        _refreshing.clear()
+
+
+def suggest(query: str, limit: int = 8):
+    if _index.built_at is None:
+        _index.rebuild()
+    elif _index.is_stale() and not _refreshing.is_set():
+        # отдаём текущий индекс, а свежий собираем в фоне
+        _refreshing.set()
+        threading.Thread(target=_background_rebuild, daemon=True).start()
+    return _index.lookup(query, limit)
+
+
+def update_event(event):
+    _index.update_event(event)
+
+
+def remove_event(event_id):
+    _index.remove_event(event_id)
+
+
+def update_location(location):
+    if _index.built_at is None:
+        return
+    events = (
+        location.events
+        .filter(datetime_passing__gt=timezone.now())
+        .select_related('location')
+    )
+    for event in events:
+        _index.update_event(event)
+
+
+def invalidate():
+    _index.built_at = None
@@ -0,0 +1,97 @@
+"""
+Отмена события: что происходит с билетами.
+
+Event.cancel() только ставит флаг (вход сразу закрыт — verify смотрит на
+event.is_cancelled) и после коммита запускает cancel_tickets() в фоне.
+
+cancel_tickets() идёт по оплаченным билетам пачками по id:
+  - один UPDATE paid -> cancelled на пачку (короткая транзакция),
+  - места возвращаются в остаток, QR пачки выкидываются из кэша,
+  - письма покупателям пачки — в очередь (services/mail.py).
+Между пачками пауза: не больше CANCEL_NOTIFY_PER_SECOND писем в секунду,
+чтобы десятки тысяч писем не упёрлись в лимиты SMTP разом.
+Повторный запуск безопасен — берутся только билеты, ещё оставшиеся 'paid'.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from . import cohorts, inventory, mail, qr, rollups
+from .models import Event, OutboundEmail, Ticket
+
+logger = logging.getLogger(__name__)
+
+
+def cancel_email(ticket_id, event, price, to_email):
+    subject = f'Событие отменено — билет №{ticket_id}'
+    text = (
+        f"Здравствуйте!\n\n"
+        f"К сожалению, событие «{event.title}» отменено.\n"
+        f"Ваш билет №{ticket_id} аннулирован, сумма {price} ₸ будет возвращена.\n\n"
+        f"CityTickets"
+    )
+    return OutboundEmail(to_email=to_email, subject=subject, body=text)
+
+
+def _cancel_chunk(event, ids):
+    with transaction.atomic():
+        rows = list(
+            Ticket.objects
+            .select_for_update(of=('self',))
+            .filter(pk__in=ids, status='paid')
+            .values_list('id', 'price', 'user__email')
+        )
+        if not rows:
+            return 0, 0
+        cancelled = Ticket.objects.filter(pk__in=[r[0] for r in rows], status='paid').update(status='cancelled')
+        inventory.release(event.pk, cancelled)
+        rollups.move([r[0] for r in rows], 'paid', 'cancelled')
+        cohorts.move([r[0] for r in rows], 'paid', 'cancelled')
+        emails = mail.queue_many([
+            cancel_email(ticket_id, event, price, email)
+            for ticket_id, price, email in rows
+            if email
+        ])
+
+    qr.invalidate([r[0] for r in rows])
+    return cancelled, emails
+
+
+def cancel_tickets(event_id):
+    """
+    Фоновая часть Event.cancel(). Возвращает (отменено билетов, писем).
+    """
+    event = Event.objects.filter(pk=event_id, is_cancelled=True).only('id', 'title').first()
+    if event is None:
+        return 0, 0
+
+    chunk_size = getattr(settings, 'CANCEL_CHUNK_SIZE', 500)
+    per_second = getattr(settings, 'CANCEL_NOTIFY_PER_SECOND', 50)
+
+    total = emails = 0
+    last_id = 0
+    while True:
+        ids = list(
+            Ticket.objects
+            .filter(event_id=event_id, status='paid', pk__gt=last_id)
+            .order_by('id')
+            .values_list('id', flat=True)[:chunk_size]
+        )
+        if not ids:
+            break
+        last_id = ids[-1]
+
+        started = time.monotonic()
+        cancelled, queued = _cancel_chunk(event, ids)
+        total += cancelled
+        emails += queued
+
+        if per_second and queued:
+            pause = queued / per_second - (time.monotonic() - started)
+            if pause > 0:
+                time.sleep(pause)
+
+    logger.info('Event %s cancelled: %s tickets, %s emails queued', event_id, total, emails)
+    return total, emails
@@ -0,0 +1,117 @@
+"""
+Кэш отрендеренных кусков каталога: карточки событий и страница события.
+
+Ключ = id события + его версия. Версия лежит в кэше и меняется при любом
+изменении события/площадки (сигналы в services/signals.py и Event.cancel()),
+поэтому старые фрагменты просто перестают находиться и вытесняются сами.
+
+В кэш кладём только то, что одинаково для всех пользователей.
+Персональное (избранное, корзина, csrf) дорисовывается поверх в шаблонах.
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+
+def _timeout():
+    return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 60)
+
+
+def _version_key(event_id):
+    return f'catalog:v:{event_id}'
+
+
+def _new_version():
+    return uuid.uuid4().hex[:12]
+
+
+# ===== Версии =====
+
+def get_versions(event_ids):
+    """
+    {event_id: version}. Если версии нет (первый раз или вытеснена) —
+    заводим новую, так что старый фрагмент точно не подхватится.
+    """
+    keys = {_version_key(pk): pk for pk in event_ids}
+    found = cache.get_many(list(keys))
+    versions = {keys[k]: v for k, v in found.items()}
+
+    missing = {_version_key(pk): _new_version() for pk in event_ids if pk not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update({keys[k]: v for k, v in missing.items()})
+    return versions
+
+
+def invalidate_events(event_ids):
+    if not event_ids:
+        return
+    cache.set_many({_version_key(pk): _new_version() for pk in event_ids}, timeout=None)
+
+
+def invalidate_event(event_id):
+    invalidate_events([event_id])
+
+
+# ===== Карточки в списке событий =====
+
+def _card_key(event_id, version):
+    return f'catalog:card:{event_id}:{version}'
+
+
+def render_cards(events):
+    """
+    Список карточек для _event_cards.html: {'event_id', 'front', 'back'}.
+    Всё, что есть в кэше, берём оттуда, остальное рендерим и докладываем.
+    """
+    versions = get_versions([e.pk for e in events])
+    keys = {e.pk: _card_key(e.pk, versions[e.pk]) for e in events}
+    cached = cache.get_many(list(keys.values()))
+
+    fresh = {}
+    cards = []
+    for event in events:
+        key = keys[event.pk]
+        parts = cached.get(key)
+        if parts is None:
+            ctx = {'event': event}
+            parts = (
+                render_to_string('services/_event_card_front.html', ctx),
+                render_to_string('services/_event_card_back.html', ctx),
+            )
+            fresh[key] = parts
+
+        cards.append({
+            'event_id': event.pk,
+            'front': mark_safe(parts[0]),
+            'back': mark_safe(parts[1]),
+        })
+
+    if fresh:
+        cache.set_many(fresh, timeout=_timeout())
+    return cards
+
+
+# ===== Страница события =====
+
+def _detail_key(event_id, version, is_authenticated):
+    return f'catalog:detail:{event_id}:{version}:{int(bool(is_authenticated))}'
+
+
+def get_detail(event_id, is_authenticated):
+    version = get_versions([event_id])[event_id]
+    html = cache.get(_detail_key(event_id, version, is_authenticated))
+    return mark_safe(html) if html is not None else None
+
+
+def render_detail(event, is_authenticated):
+    version = get_versions([event.pk])[event.pk]
+    html = render_to_string('services/_event_detail.html', {
+        'event': event,
+        'is_authenticated': is_authenticated,
+    })
+    cache.set(_detail_key(event.pk, version, is_authenticated), html, timeout=_timeout())
+    return mark_safe(html)
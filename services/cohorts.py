@@ -0,0 +1,281 @@
+"""
+Когорты покупателей и матрица удержания для админ-аналитики.
+
+Когорта — месяц первой покупки. Клетка CohortCell(cohort, offset) —
+сколько покупателей когорты купили что-то через offset месяцев после
+первой покупки, сколько билетов и на какую сумму. Покупка — билет в
+статусе PURCHASE_STATUSES (возвращённые и отменённые не считаются).
+
+Таблицы правятся приращениями вместе с билетами, как дневная сводка
+(services/rollups.py):
+  - record_sale(tickets) — новые билеты (post_save, checkout);
+  - move(ids, старый, новый) — смена статуса, если она меняет "покупка /
+    не покупка" (возврат, отмена); paid -> used ничего не меняет. id и
+    старые статусы — из строк, заблокированных до UPDATE (массовый
+    возврат — move на каждую группу статусов), в той же транзакции.
+
+На покупателя: BuyerMonth (его билеты/выручка по месяцам) + приращение ->
+новые месяцы; из клеток вычитается старый вклад, добавляется новый.
+Сдвиг когорты (первую покупку вернули, нашлась более ранняя) так
+пересчитывается сам. Строка пользователя блокируется (select_for_update),
+параллельные изменения одного покупателя идут по очереди.
+
+Матрица не пересчитывается из Ticket, поэтому не теряет историю после
+удаления старых событий (services/retention.py). rebuild() /
+manage.py rebuild_cohorts строит всё заново по билетам, которые есть в БД.
+"""
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DateField, F, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from accounts.models import User
+
+from .models import BuyerCohort, BuyerMonth, CohortCell, Ticket
+
+# билеты, которые считаются покупкой
+PURCHASE_STATUSES = ('paid', 'refreq', 'used')
+
+# id билетов на один запрос в move()
+MOVE_CHUNK = 500
+
+
+def month_offset(cohort, month):
+    return (month.year - cohort.year) * 12 + month.month - cohort.month
+
+
+def _deltas():
+    return defaultdict(lambda: [0, 0])
+
+
+def _by_user_month(qs, *extra):
+    return (
+        qs.annotate(month=TruncMonth('created_at', output_field=DateField()))
+        .values_list('user_id', 'month', *extra)
+        .annotate(n=Count('id'), revenue=Sum('price'))
+        .order_by()
+    )
+
+
+# ===== Клетки и покупатели =====
+
+def _add_cell(cohort, offset, buyers, tickets, revenue):
+    cell = CohortCell.objects.filter(cohort=cohort, offset=offset)
+    changes = dict(
+        buyers=F('buyers') + buyers,
+        tickets=F('tickets') + tickets,
+        revenue=F('revenue') + revenue,
+    )
+    if cell.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            CohortCell.objects.create(cohort=cohort, offset=offset, buyers=buyers, tickets=tickets, revenue=revenue)
+    except IntegrityError:
+        # клетку успела создать параллельная транзакция
+        cell.update(**changes)
+
+
+def _cells(months):
+    """
+    {месяц: (билеты, выручка)} одного покупателя -> {(когорта, offset): [1, билеты, выручка]}.
+    """
+    if not months:
+        return {}
+    cohort = min(months)
+    return {
+        (cohort, month_offset(cohort, month)): [1, tickets, revenue]
+        for month, (tickets, revenue) in months.items()
+    }
+
+
+def _apply_user(user_id, changes):
+    """
+    changes: {месяц: [билеты, выручка]} (приращения) или None — убрать покупателя целиком.
+    """
+    # блокировка строки пользователя: изменения одного покупателя идут по очереди
+    if not User.objects.select_for_update().filter(pk=user_id).exists():
+        return
+
+    old = {
+        month: (tickets, revenue)
+        for month, tickets, revenue in BuyerMonth.objects.filter(user_id=user_id).values_list('month', 'tickets', 'revenue')
+    }
+    new = {}
+    if changes is not None:
+        new = dict(old)
+        for month, (tickets, revenue) in changes.items():
+            t, r = new.get(month, (0, 0))
+            if t + tickets > 0:
+                new[month] = (t + tickets, r + revenue)
+            else:
+                new.pop(month, None)
+    if new == old:
+        return
+
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for key, values in _cells(old).items():
+        deltas[key] = [-v for v in values]
+    for key, values in _cells(new).items():
+        deltas[key] = [d + v for d, v in zip(deltas[key], values)]
+    for (cohort, offset), values in sorted(deltas.items()):
+        if any(values):
+            _add_cell(cohort, offset, *values)
+
+    for month in old.keys() - new.keys():
+        BuyerMonth.objects.filter(user_id=user_id, month=month).delete()
+    for month, (tickets, revenue) in new.items():
+        if old.get(month) != (tickets, revenue):
+            BuyerMonth.objects.update_or_create(
+                user_id=user_id, month=month, defaults={'tickets': tickets, 'revenue': revenue},
+            )
+
+    if new:
+        BuyerCohort.objects.update_or_create(user_id=user_id, defaults={'month': min(new)})
+    else:
+        BuyerCohort.objects.filter(user_id=user_id).delete()
+
+
+def apply(deltas):
+    """
+    {(user_id, месяц): [билеты, выручка]} -> таблицы когорт.
+    Пользователи по возрастанию id: блокировки берутся в одном порядке.
+    """
+    by_user = defaultdict(dict)
+    for (user_id, month), values in deltas.items():
+        if any(values):
+            by_user[user_id][month] = values
+    for user_id in sorted(by_user):
+        with transaction.atomic():
+            _apply_user(user_id, by_user[user_id])
+
+
+def forget_user(user_id):
+    """
+    Убрать вклад покупателя (перед удалением пользователя).
+    """
+    with transaction.atomic():
+        _apply_user(user_id, None)
+
+
+# ===== Изменения билетов =====
+
+def record_sale(tickets):
+    """
+    Новые билеты (объекты после create / bulk_create).
+    """
+    deltas = _deltas()
+    for ticket in tickets:
+        if ticket.status in PURCHASE_STATUSES:
+            key = (ticket.user_id, timezone.localdate(ticket.created_at).replace(day=1))
+            deltas[key][0] += 1
+            deltas[key][1] += ticket.price
+    apply(deltas)
+
+
+def move(ticket_ids, old_status, new_status):
+    """
+    Билеты ticket_ids уже переведены из old_status в new_status
+    (после UPDATE, в той же транзакции).
+    """
+    was, now = old_status in PURCHASE_STATUSES, new_status in PURCHASE_STATUSES
+    ticket_ids = list(ticket_ids)
+    if was == now or not ticket_ids:
+        return
+    sign = 1 if now else -1
+    deltas = _deltas()
+    for i in range(0, len(ticket_ids), MOVE_CHUNK):
+        for user_id, month, n, revenue in _by_user_month(Ticket.objects.filter(pk__in=ticket_ids[i:i + MOVE_CHUNK])):
+            deltas[(user_id, month)][0] += sign * n
+            deltas[(user_id, month)][1] += sign * revenue
+    apply(deltas)
+
+
+# ===== Пересборка и чтение =====
+
+def rebuild():
+    """
+    Пересчитать все три таблицы из Ticket одним проходом. -> (покупателей, клеток).
+    """
+    rows = (
+        Ticket.objects
+        .filter(status__in=PURCHASE_STATUSES)
+        .annotate(month=TruncMonth('created_at', output_field=DateField()))
+        .values_list('user_id', 'month')
+        .annotate(n=Count('id'), revenue=Sum('price'))
+        .order_by('user_id', 'month')
+    )
+
+    months, cohorts = [], []
+    cells = defaultdict(lambda: [0, 0, 0])
+    current_user, cohort = None, None
+    for user_id, month, tickets, revenue in rows.iterator(chunk_size=5000):
+        if user_id != current_user:
+            # строки пользователя идут по возрастанию месяца: первая — когорта
+            current_user, cohort = user_id, month
+            cohorts.append(BuyerCohort(user_id=user_id, month=month))
+        months.append(BuyerMonth(user_id=user_id, month=month, tickets=tickets, revenue=revenue))
+        cell = cells[(cohort, month_offset(cohort, month))]
+        cell[0] += 1
+        cell[1] += tickets
+        cell[2] += revenue
+
+    with transaction.atomic():
+        CohortCell.objects.all().delete()
+        BuyerMonth.objects.all().delete()
+        BuyerCohort.objects.all().delete()
+        BuyerCohort.objects.bulk_create(cohorts, batch_size=1000)
+        BuyerMonth.objects.bulk_create(months, batch_size=1000)
+        CohortCell.objects.bulk_create([
+            CohortCell(cohort=c, offset=o, buyers=b, tickets=t, revenue=r)
+            for (c, o), (b, t, r) in cells.items()
+        ], batch_size=1000)
+    return len(cohorts), len(cells)
+
+
+def retention_matrix(months=12):
+    """
+    Последние months когорт для дашборда:
+    [{'cohort', 'size', 'revenue', 'cells': [{'offset', 'buyers', 'pct'} | None, ...]}],
+    offset от 0 до months - 1; клетки, до которых когорта ещё не дожила, — None.
+    """
+    cohort_months = list(
+        CohortCell.objects.filter(offset=0, buyers__gt=0)
+        .order_by('-cohort')
+        .values_list('cohort', flat=True)[:months]
+    )
+    if not cohort_months:
+        return []
+
+    grid = defaultdict(dict)
+    for cohort, offset, buyers, revenue in (
+        CohortCell.objects
+        .filter(cohort__in=cohort_months, offset__lt=months)
+        .values_list('cohort', 'offset', 'buyers', 'revenue')
+    ):
+        grid[cohort][offset] = (buyers, revenue)
+
+    current = timezone.localdate().replace(day=1)
+    rows = []
+    for cohort in sorted(cohort_months):
+        size = grid[cohort].get(0, (0, 0))[0]
+        cells = []
+        for offset in range(months):
+            if offset > month_offset(cohort, current):
+                cells.append(None)
+                continue
+            buyers = grid[cohort].get(offset, (0, 0))[0]
+            cells.append({
+                'offset': offset,
+                'buyers': buyers,
+                'pct': round(buyers * 100 / size, 1) if size else 0,
+            })
+        rows.append({
+            'cohort': cohort,
+            'size': size,
+            'revenue': sum(revenue for _, revenue in grid[cohort].values()),
+            'cells': cells,
+        })
+    return rows
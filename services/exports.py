@@ -0,0 +1,272 @@
+"""
+Выгрузки билетов: CSV для админ-аналитики и фоновые выгрузки (ExportJob).
+
+Строки читаются курсором пачками (iterator(chunk_size=...)) как кортежи
+values_list — без моделей и select_related-объектов — и сразу уходят
+дальше кусками по ROWS_PER_CHUNK строк. Память не зависит от числа
+строк: в каждый момент в ней одна пачка курсора и один кусок файла.
+
+  - stream_tickets_csv() — ответ admin_analytics_export_csv (gzip=True —
+    сжатие на лету, файл .csv.gz);
+  - start_job() / run_job() — то же (и список гостей события) в воркере
+    (services/tasks.py): gzip CSV или JSONL пишется во временный файл,
+    прогресс — в ExportJob.rows_done, готовый файл уходит в закрытое
+    хранилище (models.export_storage, EXPORT_ROOT вне MEDIA_ROOT), staff
+    скачивает его со страницы выгрузок;
+  - recover_stale() — задачи, потерянные при рестарте (пул потоков живёт
+    в памяти процесса): queued без отметки жизни ставятся в очередь
+    снова, running — помечаются failed;
+  - expire_old() — файлы старше EXPORT_KEEP_DAYS удаляются (статус
+    expired), вместе с файлами, на которые не ссылается ни одна выгрузка.
+    Обе — из manage.py cleanup_exports (cron).
+"""
+import csv
+import io
+import json
+import logging
+import os
+import tempfile
+import uuid
+import zlib
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+from django.utils import timezone
+
+from . import analytics
+from .models import ExportJob, Ticket, export_storage
+from .tasks import run_after_commit
+
+logger = logging.getLogger(__name__)
+
+HEADER = ['Дата', 'Пользователь email', 'Телефон', 'Событие', 'Цена', 'Статус']
+FIELDS = ('created_at', 'user__email', 'user__phone_number', 'event__title', 'price', 'status')
+
+ATTENDEE_HEADER = ['Билет', 'Email', 'Телефон', 'Цена', 'Статус', 'Куплен', 'Прошёл']
+ATTENDEE_FIELDS = ('id', 'user__email', 'user__phone_number', 'price', 'status', 'created_at', 'used_at')
+
+CURSOR_CHUNK = 2000
+ROWS_PER_CHUNK = 1000
+
+
+# ===== Запросы =====
+
+def tickets_for_export(period='30', mode='gross'):
+    """
+    Те же period / mode, что у дашборда. -> queryset кортежей FIELDS.
+    """
+    qs = Ticket.objects.order_by('-created_at')
+    start = analytics.period_start(period)
+    if start is not None:
+        qs = qs.filter(created_at__gte=start[1])
+    if mode == 'net':
+        qs = qs.filter(status='paid')
+    return qs.values_list(*FIELDS)
+
+
+def attendees_for_export(event_id):
+    return Ticket.objects.filter(event_id=event_id).order_by('id').values_list(*ATTENDEE_FIELDS)
+
+
+def _job_source(job):
+    """
+    -> (queryset кортежей, заголовок CSV, ключи JSONL).
+    """
+    params = job.params or {}
+    if job.kind == 'attendees':
+        return attendees_for_export(params['event']), ATTENDEE_HEADER, ATTENDEE_FIELDS
+    return tickets_for_export(params.get('period', '30'), params.get('mode', 'gross')), HEADER, FIELDS
+
+
+# ===== Форматы =====
+
+def _cell(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M')
+    return '' if value is None else value
+
+
+def csv_chunks(rows, header=HEADER, bom=True):
+    """
+    Кортежи -> куски CSV в байтах (utf-8).
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    if bom:
+        buffer.write('\ufeff')  # Excel UTF-8
+    writer.writerow(header)
+
+    count = 0
+    for row in rows:
+        writer.writerow([_cell(value) for value in row])
+        count += 1
+        if count % ROWS_PER_CHUNK == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+
+    tail = buffer.getvalue()
+    if tail:
+        yield tail.encode('utf-8')
+
+
+def jsonl_chunks(rows, keys):
+    """
+    Кортежи -> куски JSON Lines (по объекту {ключ: значение} на строку).
+    """
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(keys, row)), cls=DjangoJSONEncoder, ensure_ascii=False))
+        if len(lines) >= ROWS_PER_CHUNK:
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+            lines = []
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def gzip_chunks(chunks, level=6):
+    """
+    Поток байтов -> поток gzip (один gzip-member, читается gzip/zcat/7-Zip).
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_tickets_csv(period='30', mode='gross', gzip=False):
+    rows = tickets_for_export(period, mode).iterator(chunk_size=CURSOR_CHUNK)
+    chunks = csv_chunks(rows)
+    return gzip_chunks(chunks) if gzip else chunks
+
+
+# ===== Фоновые выгрузки =====
+
+def start_job(kind, fmt, params, user=None):
+    """
+    Создать ExportJob и после коммита отдать его воркеру.
+    """
+    job = ExportJob.objects.create(
+        kind=kind, format=fmt, params=params, requested_by=user, heartbeat_at=timezone.now(),
+    )
+    run_after_commit(run_job, job.pk)
+    return job
+
+
+def _counted(rows, job_id, every):
+    """
+    Пропускает строки насквозь, раз в every строк пишет прогресс в БД.
+    """
+    done = 0
+    for row in rows:
+        yield row
+        done += 1
+        if done % every == 0:
+            ExportJob.objects.filter(pk=job_id).update(rows_done=done, heartbeat_at=timezone.now())
+    ExportJob.objects.filter(pk=job_id).update(rows_done=done, heartbeat_at=timezone.now())
+
+
+def run_job(job_id):
+    """
+    Выполнить выгрузку. Берём только job в статусе queued (условный UPDATE),
+    так что повторная постановка в очередь не запустит её дважды.
+    """
+    now = timezone.now()
+    claimed = ExportJob.objects.filter(pk=job_id, status='queued').update(
+        status='running', started_at=now, heartbeat_at=now, rows_done=0, error='',
+    )
+    if not claimed:
+        return None
+
+    job = ExportJob.objects.get(pk=job_id)
+    every = getattr(settings, 'EXPORT_PROGRESS_EVERY', 10000)
+    tmp = tempfile.NamedTemporaryFile(prefix='export-', suffix='.gz', delete=False)
+    try:
+        qs, header, keys = _job_source(job)
+        ExportJob.objects.filter(pk=job_id).update(rows_total=qs.count())
+
+        rows = _counted(qs.iterator(chunk_size=CURSOR_CHUNK), job_id, every)
+        chunks = csv_chunks(rows, header) if job.format == 'csv' else jsonl_chunks(rows, keys)
+        with tmp:
+            for data in gzip_chunks(chunks):
+                tmp.write(data)
+
+        name = f'{job.kind}-{job.pk}-{timezone.localdate():%Y%m%d}-{uuid.uuid4().hex[:12]}.{job.format}.gz'
+        with open(tmp.name, 'rb') as f:
+            job.file.save(name, File(f), save=False)
+
+        ExportJob.objects.filter(pk=job_id).update(
+            status='done',
+            file=job.file.name,
+            file_size=job.file.size,
+            rows_total=F('rows_done'),
+            finished_at=timezone.now(),
+        )
+    except Exception as exc:
+        logger.exception('Export job %s failed', job_id)
+        ExportJob.objects.filter(pk=job_id).update(
+            status='failed', error=str(exc)[:2000], finished_at=timezone.now(),
+        )
+    finally:
+        try:
+            os.unlink(tmp.name)
+        except OSError:
+            pass
+    return job_id
+
+
+# ===== Зависшие задачи и старые файлы =====
+
+def recover_stale(now=None):
+    """
+    -> (снова в очереди, помечено failed).
+    """
+    now = now or timezone.now()
+    stale = now - timedelta(minutes=getattr(settings, 'EXPORT_STALE_MINUTES', 30))
+
+    requeued = []
+    for job_id in ExportJob.objects.filter(status='queued', heartbeat_at__lt=stale).values_list('id', flat=True):
+        # условный UPDATE: две страницы выгрузок не поставят задачу дважды
+        if ExportJob.objects.filter(pk=job_id, status='queued', heartbeat_at__lt=stale).update(heartbeat_at=now):
+            requeued.append(job_id)
+            run_after_commit(run_job, job_id)
+
+    failed = ExportJob.objects.filter(status='running', heartbeat_at__lt=stale).update(
+        status='failed',
+        error='Выгрузка прервалась (перезапуск воркера?). Запустите её заново.',
+        finished_at=now,
+    )
+    if requeued or failed:
+        logger.warning('Export jobs: %s requeued, %s stale running marked failed', len(requeued), failed)
+    return len(requeued), failed
+
+
+def expire_old(now=None):
+    """
+    Удалить файлы старше EXPORT_KEEP_DAYS и файлы без выгрузки. -> (выгрузок, файлов).
+    """
+    now = now or timezone.now()
+    cutoff = now - timedelta(days=getattr(settings, 'EXPORT_KEEP_DAYS', 7))
+
+    expired = 0
+    for job in ExportJob.objects.filter(status='done', finished_at__lt=cutoff):
+        if job.file:
+            job.file.delete(save=False)
+        expired += ExportJob.objects.filter(pk=job.pk, status='done').update(status='expired', file='')
+
+    # файл сохранился, а ExportJob не обновился (воркер упал между ними)
+    storage = export_storage()
+    known = set(ExportJob.objects.exclude(file='').values_list('file', flat=True))
+    orphans = 0
+    if os.path.isdir(storage.location):
+        for name in storage.listdir('')[1]:
+            if name not in known and storage.get_modified_time(name) < cutoff:
+                storage.delete(name)
+                orphans += 1
+    return expired, orphans
@@ -0,0 +1,300 @@
+"""
+Офлайн-режим сканеров на входе.
+
+Перед открытием дверей сканер скачивает манифест события (build_manifest):
+
+    {
+      "event": 12, "starts_at": "...", "generated_at": "...",
+      "valid":   [id, delta, delta, ...],   # оплаченные билеты
+      "used":    [...],                     # уже прошли (онлайн-сканом)
+      "revoked": [...],                     # возвращены / отменены
+      "signing": {"version": 2, "algorithm": "sha256", "gate_bytes": 5,
+                  "keys": ["<base64 ключа события>", ...]}
+    }
+
+Списки id отсортированы и записаны разностями (первый id, затем шаги) —
+подряд идущие билеты занимают по 1-2 символа. Токен проверяется на
+устройстве без сервера (образец — verify_offline()): в коротком токене
+версии 2 (services/tokens.py) есть метка входа — HMAC-SHA256 от первых
+5 байт ключом события из "keys".
+
+Онлайн-ключей (SECRET_KEY и выведенных из него ключей токенов) в
+манифесте нет: ключ события — HMAC от id события, по нему не подделать
+ни подпись старой ссылки verify, ни HMAC короткого токена, которые
+проверяют verify_ticket и api_scan. Утёкший манифест позволяет выпустить
+метку только для билетов этого события, и такой токен принимает лишь
+офлайн-сканер — с проверкой по списку valid и сверкой после смены.
+Старые ссылки и короткие токены версии 1 (без метки) офлайн не
+проверяются — сканер отправляет их в api_scan.
+
+Манифест всё равно отдаём только staff.
+
+После смены сканер загружает лог проходов (reconcile) с id события из
+манифеста: первый проход билета ставит used_at — условный UPDATE с теми
+же условиями, что у онлайн-скана (scanning.admissible: 'paid', событие
+не отменено и на момент прохода ещё не началось) плюс билет этого
+события. Остальные проходы сохраняются как конфликты — TicketScan с
+result duplicate / revoked / wrong_event / event_cancelled / event_over.
+"""
+import base64
+import hashlib
+import hmac
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import rollups, tokens
+from .models import Ticket, TicketScan
+from .scanning import admissible, parse_code
+
+VALID_STATUSES = ('paid',)
+USED_STATUSES = ('used',)
+REVOKED_STATUSES = ('refunded', 'cancelled')
+
+# билетов на один UPDATE ... CASE при сверке
+ADMIT_CHUNK = 500
+
+# верхняя граница id (BigAutoField) — больше в запрос к БД не пускаем
+MAX_ID = 2 ** 63 - 1
+
+
+# ===== ключ и проверка токена без БД =====
+
+def event_keys(event_id):
+    # по ключу на SECRET_KEY и SECRET_KEY_FALLBACKS — на время смены секрета
+    secrets = [settings.SECRET_KEY, *getattr(settings, 'SECRET_KEY_FALLBACKS', [])]
+    return [base64.b64encode(tokens.event_key(event_id, s)).decode() for s in secrets]
+
+
+def verify_offline(token, signing):
+    """
+    Образец проверки на сканере: только manifest["signing"], без БД и
+    SECRET_KEY. Понимает короткий токен версии 2 (32 символа base32);
+    остальные офлайн не проверяются — None, сканер отправляет их в api_scan.
+    -> ticket_id или None.
+    """
+    try:
+        if len(token) != tokens.TOKEN_LENGTH:
+            return None
+        raw = base64.b32decode(token.upper())
+        body, tag = raw[:5], raw[-signing['gate_bytes']:]
+        if body[0] != signing['version']:
+            return None
+        for key in signing['keys']:
+            expected = hmac.new(base64.b64decode(key), body, hashlib.sha256).digest()[:len(tag)]
+            if hmac.compare_digest(tag, expected):
+                return int.from_bytes(body[1:], 'big')
+        return None
+    except (ValueError, KeyError, TypeError, IndexError):
+        return None
+
+
+# ===== манифест =====
+
+def delta_encode(ids):
+    out, prev = [], 0
+    for pk in ids:
+        out.append(pk - prev)
+        prev = pk
+    return out
+
+
+def delta_decode(deltas):
+    out, acc = [], 0
+    for d in deltas:
+        acc += d
+        out.append(acc)
+    return out
+
+
+def build_manifest(event):
+    groups = {'valid': [], 'used': [], 'revoked': []}
+    rows = (
+        Ticket.objects
+        .filter(event=event)
+        .order_by('id')
+        .values_list('id', 'status')
+        .iterator(chunk_size=5000)
+    )
+    for pk, status in rows:
+        if status in VALID_STATUSES:
+            groups['valid'].append(pk)
+        elif status in USED_STATUSES:
+            groups['used'].append(pk)
+        elif status in REVOKED_STATUSES:
+            groups['revoked'].append(pk)
+
+    return {
+        'event': event.pk,
+        'title': event.title,
+        'starts_at': event.datetime_passing.isoformat(),
+        'is_cancelled': event.is_cancelled,
+        'generated_at': timezone.now().isoformat(),
+        'encoding': 'delta',
+        **{name: delta_encode(ids) for name, ids in groups.items()},
+        'signing': {
+            'version': tokens.TOKEN_VERSION,
+            'algorithm': 'sha256',
+            'gate_bytes': tokens.GATE_MAC_BYTES,
+            'keys': event_keys(event.pk),
+        },
+    }
+
+
+# ===== сверка загруженного лога =====
+
+def _clock_skew():
+    return timedelta(seconds=getattr(settings, 'GATE_CLOCK_SKEW', 300))
+
+
+def _parse_scans(scans):
+    """
+    [{"code", "scanned_at"}] -> [(ticket_id, scanned_at)], ошибки.
+
+    code — то, что сканер прочитал из QR, с подписью: голый id билета не
+    принимаем, иначе лог мог бы отметить любой билет события, не видя его
+    QR. Время прохода из будущего (дальше GATE_CLOCK_SKEW секунд) — ошибка:
+    иначе оно обгонит настоящие проходы при выборе первого.
+    """
+    latest = timezone.now() + _clock_skew()
+    parsed, errors = [], 0
+    for scan in scans:
+        if not isinstance(scan, dict) or not scan.get('code'):
+            errors += 1
+            continue
+        ticket_id = parse_code(str(scan['code']))
+        try:
+            scanned_at = parse_datetime(str(scan.get('scanned_at') or ''))
+        except ValueError:
+            scanned_at = None
+        if ticket_id is None or not 0 < ticket_id <= MAX_ID or scanned_at is None:
+            errors += 1
+            continue
+        if timezone.is_naive(scanned_at):
+            scanned_at = timezone.make_aware(scanned_at)
+        if scanned_at > latest:
+            errors += 1
+            continue
+        parsed.append((ticket_id, scanned_at))
+    return parsed, errors
+
+
+def _result(ticket, scanned_at, event):
+    """
+    Итог прохода, который не засчитан этой загрузкой.
+    """
+    event_id, status, used_at = ticket
+    if event_id != event.pk:
+        return 'wrong_event'
+    if status == 'used':
+        return 'admitted' if used_at == scanned_at else 'duplicate'  # admitted — засчитан раньше
+    if status != 'paid':
+        return 'revoked'
+    if event.is_cancelled:
+        return 'event_cancelled'
+    if scanned_at >= event.datetime_passing:
+        return 'event_over'
+    return 'duplicate'
+
+
+def reconcile(event, device, scans):
+    """
+    Загрузка лога проходов одного устройства на событии event. Повторная
+    загрузка того же лога безопасна (уникальность ticket_ref + device +
+    scanned_at).
+    """
+    parsed, errors = _parse_scans(scans)
+    parsed.sort(key=lambda s: s[1])
+
+    # первый (по времени) проход каждого билета в этом логе
+    first = {}
+    for ticket_id, scanned_at in parsed:
+        first.setdefault(ticket_id, scanned_at)
+
+    known = set(
+        TicketScan.objects
+        .filter(device=device, ticket_ref__in=list(first))
+        .values_list('ticket_ref', 'scanned_at')
+    )
+
+    with transaction.atomic():
+        tickets = dict(
+            (row[0], row[1:])
+            for row in Ticket.objects.filter(pk__in=list(first)).values_list('id', 'event_id', 'status', 'used_at')
+        )
+
+        to_admit = {
+            pk: at for pk, at in first.items()
+            if pk in tickets
+            and tickets[pk][:2] == (event.pk, 'paid')
+            and not event.is_cancelled
+            and at < event.datetime_passing
+        }
+        admitted = set()
+        items = list(to_admit.items())
+        for i in range(0, len(items), ADMIT_CHUNK):
+            chunk = items[i:i + ADMIT_CHUNK]
+            # условия онлайн-скана на момент самого позднего прохода пачки
+            admissible(max(at for _, at in chunk)).filter(
+                pk__in=[pk for pk, _ in chunk], event=event,
+            ).update(
+                status='used',
+                used_at=Case(
+                    *[When(pk=pk, then=Value(at)) for pk, at in chunk],
+                    output_field=DateTimeField(),
+                ),
+            )
+        if to_admit:
+            # наши — те, кому проставили именно наше время (параллельный скан даст другое)
+            for pk, used_at in Ticket.objects.filter(pk__in=list(to_admit)).values_list('id', 'used_at'):
+                if used_at == to_admit[pk]:
+                    admitted.add(pk)
+                tickets[pk] = (event.pk, 'used', used_at)
+            rollups.move(admitted, 'paid', 'used')
+
+        records, conflicts = [], []
+        for ticket_id, scanned_at in parsed:
+            if (ticket_id, scanned_at) in known:
+                continue
+            known.add((ticket_id, scanned_at))
+
+            if ticket_id not in tickets:
+                result = 'not_found'
+            elif ticket_id in admitted and scanned_at == to_admit[ticket_id]:
+                result = 'admitted'
+            else:
+                result = _result(tickets[ticket_id], scanned_at, event)
+
+            records.append(TicketScan(
+                ticket_id=ticket_id if ticket_id in tickets else None,
+                ticket_ref=ticket_id,
+                device=device,
+                scanned_at=scanned_at,
+                result=result,
+            ))
+            if result != 'admitted':
+                conflicts.append({
+                    'ticket': ticket_id,
+                    'result': result,
+                    'scanned_at': scanned_at.isoformat(),
+                    'first_used_at': tickets[ticket_id][2].isoformat() if ticket_id in tickets and tickets[ticket_id][2] else None,
+                })
+
+        try:
+            with transaction.atomic():
+                TicketScan.objects.bulk_create(records, batch_size=1000)
+        except IntegrityError:
+            # параллельная загрузка того же лога — пишем то, чего ещё нет
+            TicketScan.objects.bulk_create(records, batch_size=1000, ignore_conflicts=True)
+
+    return {
+        'received': len(scans),
+        'invalid': errors,
+        'recorded': len(records),
+        'admitted': sum(1 for r in records if r.result == 'admitted'),
+        'conflicts': conflicts,
+    }
@@ -0,0 +1,61 @@
+"""
+Идемпотентные покупки: один и тот же ключ -> одна покупка.
+
+Ключ берём из заголовка Idempotency-Key или скрытого поля idempotency_key
+(его кладёт в форму GET страницы оплаты). Запись с ключом создаётся в той же
+транзакции, что и билеты: если покупка упала, ключ не "сгорает" и повтор
+честно попробует ещё раз. Параллельный дубль упирается в unique (user, key)
+и получает сохранённый результат.
+"""
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+FORM_FIELD = 'idempotency_key'
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 64
+
+
+def new_key() -> str:
+    return uuid.uuid4().hex
+
+
+def get_key(request) -> str:
+    key = request.META.get(HEADER) or request.POST.get(FORM_FIELD) or ''
+    return key.strip()[:MAX_KEY_LENGTH]
+
+
+def _ttl():
+    return timedelta(hours=getattr(settings, 'IDEMPOTENCY_TTL_HOURS', 24))
+
+
+def run_once(user, key, func):
+    """
+    Выполнить func() один раз для (user, key).
+    func возвращает JSON-совместимый результат (например {'ticket_ids': [...]}).
+    Возвращает (result, replayed): replayed=True — это повтор, func не вызывалась.
+    """
+    if not key:
+        return func(), False
+
+    with transaction.atomic():
+        # просроченные ключи пользователя чистим здесь же — индекс по user есть
+        IdempotencyKey.objects.filter(user=user, created_at__lt=timezone.now() - _ttl()).delete()
+
+        try:
+            with transaction.atomic():
+                record = IdempotencyKey.objects.create(user=user, key=key)
+        except IntegrityError:
+            existing = IdempotencyKey.objects.filter(user=user, key=key).first()
+            return (existing.result if existing else {}), True
+
+        result = func()
+        record.result = result
+        record.save(update_fields=['result'])
+
+    return result, False
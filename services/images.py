@@ -0,0 +1,123 @@
+"""
+Производные картинки для Event.image: несколько ширин в WebP + JPEG.
+
+Файлы называются по хэшу содержимого исходника
+(media/img/events/derived/<hash>-<size>.<ext>), поэтому их можно кэшировать
+навсегда: новая картинка -> новое имя. Результат пишется в Event.image_variants:
+
+    {
+        "source": "<имя исходного файла>",
+        "sizes": [
+            {"name": "thumb", "width": 360, "webp": "<path>", "jpeg": "<path>"},
+            ...
+        ]
+    }
+
+Генерация идёт в фоне (services/tasks.py), сохранение в админке не ждёт Pillow.
+"""
+import hashlib
+import logging
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from . import catalog_cache
+from .models import Event
+
+logger = logging.getLogger(__name__)
+
+DERIVED_DIR = 'media/img/events/derived'
+
+# карточка в каталоге 180px (x2 для retina), страница события до 400px
+IMAGE_SIZES = [
+    ('thumb', 360),
+    ('medium', 720),
+    ('large', 1280),
+]
+
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+
+
+def _encode(img, fmt):
+    buf = BytesIO()
+    if fmt == 'webp':
+        img.save(buf, format='WEBP', quality=WEBP_QUALITY, method=4)
+    else:
+        img.save(buf, format='JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return buf.getvalue()
+
+
+def _save_once(name, data_func):
+    # имя зависит от содержимого — если файл уже есть, он точно такой же
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(data_func()))
+    return name
+
+
+def build_variants(event_id: int, force: bool = False):
+    event = Event.objects.filter(pk=event_id).only('id', 'image', 'image_variants').first()
+    if event is None or not event.image:
+        return None
+
+    source_name = event.image.name
+    if not force and (event.image_variants or {}).get('source') == source_name:
+        return event.image_variants
+
+    with event.image.open('rb') as f:
+        raw = f.read()
+    digest = hashlib.sha1(raw).hexdigest()[:16]
+
+    img = Image.open(BytesIO(raw))
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+
+    sizes = []
+    for size_name, width in IMAGE_SIZES:
+        if sizes and img.width <= sizes[-1]['width']:
+            break  # не растягиваем маленькие исходники
+
+        variant = img.copy()
+        variant.thumbnail((width, width * 4), Image.LANCZOS)
+
+        base = f'{DERIVED_DIR}/{digest}-{size_name}'
+        sizes.append({
+            'name': size_name,
+            'width': variant.width,
+            'webp': _save_once(f'{base}.webp', lambda: _encode(variant, 'webp')),
+            'jpeg': _save_once(f'{base}.jpg', lambda: _encode(variant, 'jpeg')),
+        })
+
+    variants = {'source': source_name, 'sizes': sizes}
+
+    # update() без сигналов; фильтр по image — если картинку успели поменять,
+    # не затираем: для новой уже поставлена своя задача
+    updated = (
+        Event.objects
+        .filter(pk=event_id, image=source_name)
+        .update(image_variants=variants, updated_at=timezone.now())
+    )
+    if updated:
+        catalog_cache.invalidate_event(event_id)
+    return variants
+
+
+def schedule_variants(event):
+    """
+    Вызывается из post_save: ставит генерацию в фон, если картинка новая.
+    """
+    from .tasks import run_after_commit
+
+    variants = event.image_variants or {}
+
+    if not event.image:
+        if variants:
+            Event.objects.filter(pk=event.pk).update(image_variants={})
+        return
+
+    if variants.get('source') != event.image.name:
+        run_after_commit(build_variants, event.pk)
@@ -0,0 +1,173 @@
+"""
+Остатки билетов (EventInventory).
+
+Все изменения — одним условным UPDATE:
+
+    UPDATE ... SET sold = sold + n
+    WHERE event_id = ? AND (total IS NULL OR total >= sold + n)
+
+Если строка не обновилась — мест нет. Две параллельные покупки последнего
+билета не пройдут обе: вторая увидит уже увеличенный sold.
+Вызывать внутри transaction.atomic() вместе с созданием билетов —
+тогда при ошибке откатится и списание. Отдельного "придержать на время
+оплаты" нет: оплата идёт в той же транзакции, что и создание билета.
+
+sold правят покупка, возврат и отмена, а также:
+  - смена статуса билета через save() (админка) — post_save (signals.py);
+  - удаление билетов в админке и удаление пользователя — forget();
+  - удаление события — строка остатков уходит каскадом.
+Если остатки разошлись с билетами — rebuild() / manage.py rebuild_inventory.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import Event, EventInventory, Ticket
+
+# статусы билета, которые занимают место в зале
+SOLD_STATUSES = ('paid', 'refreq', 'used')
+
+
+class SoldOut(Exception):
+    pass
+
+
+def event_total(event):
+    if event.ticket_limit is not None:
+        return event.ticket_limit
+    if event.location_id:
+        return event.location.capacity
+    return None
+
+
+def ensure_inventory(event):
+    if EventInventory.objects.filter(pk=event.pk).exists():
+        return
+    try:
+        EventInventory.objects.create(event_id=event.pk, total=event_total(event))
+    except IntegrityError:
+        pass  # параллельно уже создали
+
+
+def sync_total(event):
+    """
+    Пересчитать total после изменения лимита события или вместимости площадки.
+    Если новый total меньше уже проданного — новые продажи просто не пройдут.
+    """
+    updated = EventInventory.objects.filter(pk=event.pk).update(total=event_total(event))
+    if not updated:
+        ensure_inventory(event)
+
+
+def _has_room(qty):
+    return Q(total__isnull=True) | Q(total__gte=F('sold') + qty)
+
+
+def _take(event, qty, **changes):
+    """
+    Условный UPDATE "если хватает мест". Сначала сразу пишем (горячий путь —
+    один запрос), строку остатков создаём, только если её ещё нет.
+    """
+    for _ in range(2):
+        updated = (
+            EventInventory.objects
+            .filter(_has_room(qty), pk=event.pk)
+            .update(**changes)
+        )
+        if updated:
+            return
+        if EventInventory.objects.filter(pk=event.pk).exists():
+            break
+        ensure_inventory(event)
+    raise SoldOut(event.pk)
+
+
+def reserve(event, qty=1):
+    """
+    Списать qty билетов сразу в sold. Бросает SoldOut, если мест нет.
+    """
+    _take(event, qty, sold=F('sold') + qty)
+
+
+def release(event_id, qty=1):
+    """
+    Вернуть места после возврата/отмены билетов.
+    """
+    if qty <= 0:
+        return
+    EventInventory.objects.filter(pk=event_id, sold__gte=qty).update(sold=F('sold') - qty)
+
+
+def add_sold(event_id, qty=1):
+    """
+    Билет снова занимает место (админ вернул статус paid/used) — без
+    проверки total: решение уже принято человеком.
+    """
+    if qty <= 0:
+        return
+    EventInventory.objects.filter(pk=event_id).update(sold=F('sold') + qty)
+
+
+def forget(tickets):
+    """
+    Вернуть места билетов из queryset tickets (вызывать перед их удалением,
+    в той же транзакции).
+    """
+    rows = (
+        tickets
+        .filter(status__in=SOLD_STATUSES)
+        .values_list('event_id')
+        .annotate(n=Count('id'))
+        .order_by('event_id')
+    )
+    for event_id, n in rows:
+        release(event_id, n)
+
+
+def available(event):
+    """
+    Сколько билетов ещё можно купить (None — без лимита).
+    """
+    inv = EventInventory.objects.filter(pk=event.pk).first()
+    if inv is None:
+        return event_total(event)
+    return inv.available
+
+
+def sync_location(location, capacity=None):
+    """
+    Вместимость площадки поменялась (или площадку удалили — capacity=None):
+    обновляем total у событий без собственного лимита.
+    """
+    EventInventory.objects.filter(
+        event__location=location,
+        event__ticket_limit__isnull=True,
+    ).update(total=capacity)
+
+
+def rebuild(event_ids=None):
+    """
+    Пересчитать total и sold из событий и билетов (все события или
+    event_ids). -> строк остатков.
+    """
+    events = Event.objects.select_related('location')
+    if event_ids:
+        events = events.filter(pk__in=event_ids)
+
+    sold = (
+        Ticket.objects
+        .filter(event_id=OuterRef('pk'), status__in=SOLD_STATUSES)
+        .values('event_id')
+        .annotate(n=Count('id'))
+        .values('n')
+    )
+    count = 0
+    with transaction.atomic():
+        for event in events.iterator(chunk_size=2000):
+            ensure_inventory(event)
+            count += EventInventory.objects.filter(pk=event.pk).update(total=event_total(event))
+        rows = EventInventory.objects.all()
+        if event_ids:
+            rows = rows.filter(pk__in=event_ids)
+        rows.update(sold=Coalesce(Subquery(sold), Value(0)))
+    return count
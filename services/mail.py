@@ -0,0 +1,185 @@
+"""
+Очередь исходящих писем (OutboundEmail).
+
+queue_email() только пишет строку в БД — в той же транзакции, что и сама
+операция (покупка, возврат), — и после коммита будит фоновую отправку
+(services/tasks.py: rq / поток / сразу в тестах).
+
+send_pending() забирает готовые к отправке письма пачками и шлёт их через
+одно SMTP-соединение. Ошибка — повтор с экспоненциальной задержкой
+(EMAIL_RETRY_BASE_SECONDS * 2^попытка), после EMAIL_MAX_ATTEMPTS — 'failed'.
+Повторы, время которых пришло, подбирает следующий send_pending()
+(и manage.py send_queued_emails — для cron / отдельного воркера).
+"""
+import logging
+import uuid
+from datetime import timedelta
+from email.mime.image import MIMEImage
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.utils import timezone
+
+from . import qr
+from .models import OutboundEmail
+from .tasks import run_after_commit
+
+logger = logging.getLogger(__name__)
+
+# 'sending' дольше этого — воркер умер посреди пачки, возвращаем в очередь
+STALE_SENDING = timedelta(minutes=10)
+
+
+def _from_email():
+    return getattr(settings, 'DEFAULT_FROM_EMAIL', 'no-reply@citytickets.local')
+
+
+def queue_email(to_email, subject, body, html_body='', qr_ticket_ids=None):
+    """
+    Поставить письмо в очередь. Отправка начнётся после коммита.
+    """
+    if not to_email:
+        return None
+    email = OutboundEmail.objects.create(
+        to_email=to_email,
+        subject=subject,
+        body=body,
+        html_body=html_body or '',
+        qr_ticket_ids=list(qr_ticket_ids or []),
+    )
+    run_after_commit(send_pending)
+    return email
+
+
+def queue_many(emails):
+    """
+    Пачка писем одним INSERT (массовые возвраты/отмены).
+    emails — несохранённые OutboundEmail.
+    """
+    emails = [e for e in emails if e.to_email]
+    if not emails:
+        return 0
+    batch_size = getattr(settings, 'EMAIL_BATCH_SIZE', 50) * 10
+    OutboundEmail.objects.bulk_create(emails, batch_size=batch_size)
+    run_after_commit(send_pending)
+    return len(emails)
+
+
+def _build_message(email, connection):
+    message = EmailMultiAlternatives(
+        subject=email.subject,
+        body=email.body,
+        from_email=_from_email(),
+        to=[email.to_email],
+        connection=connection,
+    )
+    if email.html_body:
+        message.attach_alternative(email.html_body, 'text/html')
+
+    # QR — inline-картинки, в html на них ссылаются через cid:qr_ticket_<id>
+    if email.qr_ticket_ids:
+        message.mixed_subtype = 'related'
+        for ticket_id in email.qr_ticket_ids:
+            try:
+                image = MIMEImage(qr.ticket_qr_png(ticket_id), 'png')
+                image.add_header('Content-ID', f'<qr_ticket_{ticket_id}>')
+                image.add_header('Content-Disposition', 'inline', filename=f'qr_ticket_{ticket_id}.png')
+                message.attach(image)
+            except Exception:
+                logger.exception('Attach QR failed for ticket %s', ticket_id)
+    return message
+
+
+def _claim(batch_size):
+    """
+    Забрать пачку: помечаем строки своим lock_id условным UPDATE, чтобы
+    два воркера не отправили одно письмо дважды.
+    """
+    now = timezone.now()
+
+    OutboundEmail.objects.filter(
+        status='sending',
+        updated_at__lt=now - STALE_SENDING,
+    ).update(status='queued', lock_id='')
+
+    due_ids = list(
+        OutboundEmail.objects
+        .filter(status='queued', next_attempt_at__lte=now)
+        .order_by('next_attempt_at', 'id')
+        .values_list('id', flat=True)[:batch_size]
+    )
+    if not due_ids:
+        return []
+
+    lock_id = uuid.uuid4().hex
+    OutboundEmail.objects.filter(pk__in=due_ids, status='queued').update(
+        status='sending',
+        lock_id=lock_id,
+        updated_at=now,
+    )
+    return list(OutboundEmail.objects.filter(lock_id=lock_id, status='sending').order_by('id'))
+
+
+def _mark_failed(email, error):
+    max_attempts = getattr(settings, 'EMAIL_MAX_ATTEMPTS', 5)
+    base = getattr(settings, 'EMAIL_RETRY_BASE_SECONDS', 30)
+
+    email.attempts += 1
+    email.last_error = str(error)[:2000]
+    email.lock_id = ''
+    if email.attempts >= max_attempts:
+        email.status = 'failed'
+    else:
+        email.status = 'queued'
+        email.next_attempt_at = timezone.now() + timedelta(seconds=base * 2 ** (email.attempts - 1))
+    email.save(update_fields=['attempts', 'last_error', 'lock_id', 'status', 'next_attempt_at', 'updated_at'])
+
+
+def send_pending(max_batches=None):
+    """
+    Отправить всё, что готово к отправке. Одно SMTP-соединение на весь
+    проход; если сервер оборвал соединение — переоткрываем.
+    Возвращает (отправлено, ошибок).
+    """
+    batch_size = getattr(settings, 'EMAIL_BATCH_SIZE', 50)
+    connection = get_connection(timeout=getattr(settings, 'EMAIL_TIMEOUT', 10))
+
+    sent = failed = batches = 0
+    try:
+        while max_batches is None or batches < max_batches:
+            emails = _claim(batch_size)
+            if not emails:
+                break
+            batches += 1
+
+            sent_ids = []
+            for email in emails:
+                try:
+                    connection.open()
+                    _build_message(email, connection).send(fail_silently=False)
+                    sent_ids.append(email.pk)
+                except Exception as e:
+                    logger.warning('Email %s to %s failed: %s', email.pk, email.to_email, e)
+                    _mark_failed(email, e)
+                    failed += 1
+                    # соединение могло умереть — следующее письмо откроет новое
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+
+            if sent_ids:
+                OutboundEmail.objects.filter(pk__in=sent_ids).update(
+                    status='sent',
+                    sent_at=timezone.now(),
+                    lock_id='',
+                    last_error='',
+                )
+                sent += len(sent_ids)
+    finally:
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    return sent, failed
@@ -0,0 +1,82 @@
+import resource
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import User
+from services import exports
+from services.models import Event, Ticket
+
+
+def _rss_mb():
+    # пиковый RSS процесса (Linux отдаёт в КБ)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Command(BaseCommand):
+    help = (
+        'CSV export benchmark: inserts a temporary event with many tickets '
+        '(1M by default) and streams the "all" export, plain and gzip, '
+        'reporting rows/second, output size and peak memory. Bench data is '
+        'removed afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tickets', type=int, default=1_000_000)
+        parser.add_argument('--insert-batch', type=int, default=5000)
+
+    def _run(self, label, total, gzip):
+        rss_before = _rss_mb()
+        started = time.perf_counter()
+        size = 0
+        for chunk in exports.stream_tickets_csv('all', 'gross', gzip=gzip):
+            size += len(chunk)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'{label:<10} {total:>9} rows  {elapsed:7.2f}s  {total / elapsed:9.0f} rows/s  '
+            f'{size / 1024 / 1024:8.1f} MB  peak RSS +{_rss_mb() - rss_before:.0f} MB'
+        )
+
+    def handle(self, *args, **options):
+        total = options['tickets']
+        batch = options['insert_batch']
+
+        stamp = int(time.time())
+        user = User.objects.create_user(
+            phone_number=f'+7997{stamp % 10_000_000:07d}',
+            email=f'bench-export-{stamp}@citytickets.local',
+            password=None,
+        )
+        event = Event.objects.create(
+            title=f'bench-export-{stamp}',
+            description='export benchmark',
+            price=1000,
+            duration=120,
+            datetime_passing=timezone.now() + timezone.timedelta(days=30),
+            organizer='bench',
+        )
+
+        try:
+            started = time.perf_counter()
+            for i in range(0, total, batch):
+                with transaction.atomic():
+                    Ticket.objects.bulk_create(
+                        [Ticket(event=event, user=user, price=1000) for _ in range(min(batch, total - i))],
+                        batch_size=batch,
+                    )
+            self.stdout.write(f'inserted {total} tickets in {time.perf_counter() - started:.1f}s')
+
+            rows = Ticket.objects.count()
+            self.stdout.write(f'peak RSS before export: {_rss_mb():.0f} MB')
+            self._run('csv', rows, gzip=False)
+            self._run('csv.gz', rows, gzip=True)
+        finally:
+            while True:
+                ids = list(Ticket.objects.filter(event=event).values_list('id', flat=True)[:10000])
+                if not ids:
+                    break
+                Ticket.objects.filter(pk__in=ids).delete()
+            event.delete()
+            user.delete()
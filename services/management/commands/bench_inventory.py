@@ -0,0 +1,86 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from accounts.models import User
+from services import inventory
+from services.models import Event, EventInventory, Ticket
+from services.purchases import purchase_ticket
+
+
+class Command(BaseCommand):
+    help = (
+        'Concurrency benchmark: fire many parallel purchases at one event '
+        'and check that tickets are never oversold. Creates temporary '
+        'bench data and removes it afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--purchases', type=int, default=300)
+        parser.add_argument('--capacity', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=32)
+
+    def handle(self, *args, **options):
+        purchases = options['purchases']
+        capacity = options['capacity']
+        workers = options['workers']
+
+        stamp = int(time.time())
+        user = User.objects.create_user(
+            phone_number=f'+7999{stamp % 10_000_000:07d}',
+            email=f'bench-{stamp}@citytickets.local',
+            password=None,
+        )
+        event = Event.objects.create(
+            title=f'bench-{stamp}',
+            description='inventory benchmark',
+            price=1000,
+            duration=60,
+            datetime_passing=timezone.now() + timezone.timedelta(days=30),
+            organizer='bench',
+            ticket_limit=capacity,
+        )
+
+        results = {'ok': 0, 'sold_out': 0, 'error': 0}
+        lock = threading.Lock()
+
+        def buy(_):
+            try:
+                purchase_ticket(event, user)
+                key = 'ok'
+            except inventory.SoldOut:
+                key = 'sold_out'
+            except Exception as e:
+                self.stderr.write(f'purchase failed: {e}')
+                key = 'error'
+            finally:
+                connection.close()
+            with lock:
+                results[key] += 1
+
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(buy, range(purchases)))
+            elapsed = time.perf_counter() - started
+
+            tickets = Ticket.objects.filter(event=event).count()
+            sold = EventInventory.objects.get(pk=event.pk).sold
+        finally:
+            event.delete()
+            user.delete()
+
+        self.stdout.write(
+            f'purchases: {purchases}, workers: {workers}, capacity: {capacity}\n'
+            f'ok: {results["ok"]}, sold out: {results["sold_out"]}, errors: {results["error"]}\n'
+            f'tickets created: {tickets}, inventory sold: {sold}\n'
+            f'elapsed: {elapsed:.2f}s, throughput: {purchases / elapsed:.0f} purchases/s'
+        )
+
+        if tickets > capacity or tickets != sold:
+            raise CommandError('OVERSOLD or inventory out of sync!')
+        self.stdout.write(self.style.SUCCESS('No oversell.'))
@@ -0,0 +1,103 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from services import rollups, scanning
+from services.models import Event, Ticket
+
+
+class Command(BaseCommand):
+    help = (
+        'Gate scanner benchmark: creates a temporary event with many paid '
+        'tickets and measures scans/second for the JSON scan API (single and '
+        'batch). Bench data is removed afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tickets', type=int, default=20000)
+        parser.add_argument('--batch', type=int, default=100, help='Codes per batch request')
+
+    def _rate(self, label, count, elapsed):
+        self.stdout.write(f'{label:<28} {count:>7} scans  {elapsed:6.2f}s  {count / elapsed:8.0f} scans/s')
+
+    def handle(self, *args, **options):
+        total = options['tickets']
+        batch = options['batch']
+
+        stamp = int(time.time())
+        staff = User.objects.create_user(
+            phone_number=f'+7998{stamp % 10_000_000:07d}',
+            email=f'bench-scan-{stamp}@citytickets.local',
+            password=None,
+        )
+        staff.is_staff = True
+        staff.save(update_fields=['is_staff'])
+
+        event = Event.objects.create(
+            title=f'bench-scan-{stamp}',
+            description='scan benchmark',
+            price=1000,
+            duration=120,
+            datetime_passing=timezone.now() + timezone.timedelta(hours=2),
+            organizer='bench',
+        )
+
+        try:
+            tickets = Ticket.objects.bulk_create(
+                [Ticket(event=event, user=staff, price=1000) for _ in range(total)],
+                batch_size=1000,
+            )
+            rollups.record_sale(tickets)
+            codes = [Ticket.build_verify_url(t.pk, t.event_id) for t in tickets]
+            quarter = len(codes) // 4
+
+            client = Client()
+            client.force_login(staff)
+
+            started = time.perf_counter()
+            for code in codes:
+                scanning.parse_code(code)
+            self._rate('signature check only', len(codes), time.perf_counter() - started)
+
+            part = codes[:quarter]
+            started = time.perf_counter()
+            for code in part:
+                scanning.scan(code)
+            self._rate('scan() in-process', len(part), time.perf_counter() - started)
+
+            part = codes[quarter:2 * quarter]
+            url = reverse('api_scan')
+            started = time.perf_counter()
+            for code in part:
+                client.post(url, json.dumps({'code': code}), content_type='application/json')
+            self._rate('POST /api/scan/', len(part), time.perf_counter() - started)
+
+            part = codes[2 * quarter:3 * quarter]
+            url = reverse('api_scan_batch')
+            started = time.perf_counter()
+            for i in range(0, len(part), batch):
+                client.post(url, json.dumps({'codes': part[i:i + batch]}), content_type='application/json')
+            self._rate(f'POST /api/scan/batch/ x{batch}', len(part), time.perf_counter() - started)
+
+            # повторный проход: все уже использованы — путь отказа
+            part = codes[:quarter]
+            started = time.perf_counter()
+            results = scanning.scan_many(part)
+            self._rate('re-scan (rejections)', len(part), time.perf_counter() - started)
+
+            admitted = Ticket.objects.filter(event=event, status='used').count()
+            double = sum(1 for r in results if r['ok'])
+        finally:
+            event.delete()
+            staff.delete()
+
+        self.stdout.write(f'tickets: {total}, marked used: {admitted}, re-admitted: {double}')
+        if double:
+            self.stderr.write(self.style.ERROR('Tickets were admitted twice!'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No double entries.'))
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from services.images import build_variants
+from services.models import Event
+
+
+class Command(BaseCommand):
+    help = 'Generate responsive image variants (WebP + JPEG) for events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Rebuild even if variants are up to date')
+        parser.add_argument('--event', type=int, help='Only this event id')
+
+    def handle(self, *args, **options):
+        events = Event.objects.exclude(image='').exclude(image__isnull=True).order_by('id')
+        if options['event']:
+            events = events.filter(pk=options['event'])
+
+        started = time.perf_counter()
+        done = failed = 0
+        for event_id in events.values_list('id', flat=True).iterator():
+            try:
+                build_variants(event_id, force=options['force'])
+                done += 1
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f'Event {event_id}: {e}')
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {done} events in {elapsed:.1f}s, failed: {failed}.'
+        ))
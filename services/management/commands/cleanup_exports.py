@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from services import exports
+
+
+class Command(BaseCommand):
+    help = (
+        'Housekeeping for background exports: requeue queued jobs that were '
+        'lost on restart, mark stale running jobs as failed, and delete '
+        'export files older than EXPORT_KEEP_DAYS. Run from cron.'
+    )
+
+    def handle(self, *args, **options):
+        requeued, failed = exports.recover_stale()
+        expired, orphans = exports.expire_old()
+        self.stdout.write(
+            f'Requeued {requeued}, failed {failed} stale jobs; '
+            f'deleted {expired} expired and {orphans} orphaned files.'
+        )
@@ -1,16 +1,69 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from ...models import Event
 from django.utils import timezone
 
+from services import retention
+
+
+def _size(n):
+    if n < 1024 * 1024:
+        return f'{n / 1024:.1f} KB ({n} bytes)'
+    return f'{n / 1024 / 1024:.1f} MB ({n} bytes)'
+
 
 class Command(BaseCommand):
-    help = 'Delete event that have already passed'
-
-    def handle(self, *args, **kwargs):
-        events = Event.objects.all()
-        deleted_count = 0
-        for event in events:
-            if event.datetime_passing < timezone.now():
-                event.delete_related_data()
-                deleted_count += 1
-        self.stdout.write(self.style.SUCCESS(f'Successfully deleted {deleted_count} old events.'))
+    help = (
+        'Archive tickets of events that have already passed (gzip JSONL, '
+        'one file per month, appended by each batch), delete those events in batches and remove '
+        'orphaned QR/image files from media storage. Archive files left by an '
+        'interrupted run are recovered first.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=getattr(settings, 'RETENTION_DAYS', 90),
+            help='Only events that finished more than this many days ago',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help='Tickets deleted per transaction')
+        parser.add_argument('--events-per-batch', type=int, default=50)
+        parser.add_argument('--skip-media', action='store_true', help='Do not sweep orphaned media files')
+        parser.add_argument('--dry-run', action='store_true', help='Only count rows and bytes, change nothing')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        started = time.perf_counter()
+
+        event_ids = retention.past_event_ids(cutoff)
+        self.stdout.write(f'{len(event_ids)} events before {cutoff:%Y-%m-%d %H:%M}' + (' (dry run)' if dry_run else ''))
+
+        stats = retention.purge_events(
+            event_ids,
+            batch_size=options['batch_size'],
+            events_per_batch=options['events_per_batch'],
+            dry_run=dry_run,
+            log=self.stdout.write,
+        )
+
+        orphans = None
+        if not options['skip_media']:
+            orphans = retention.purge_orphan_media(dry_run=dry_run)
+
+        verb = 'Would delete' if dry_run else 'Deleted'
+        self.stdout.write(
+            f'{verb}: events {stats.events}, tickets {stats.tickets}, '
+            f'favorites {stats.favorites}, cart items {stats.cart_items}'
+        )
+        self.stdout.write(
+            f'Archive: {_size(stats.archive_bytes)} uncompressed in {len(stats.archive_files)} file(s)'
+            + ('' if dry_run else ': ' + ', '.join(sorted(stats.archive_files)))
+        )
+        self.stdout.write(f'Media of deleted events/tickets: {stats.media_files} files, {_size(stats.media_bytes)}')
+        if orphans is not None:
+            self.stdout.write(f'Orphaned media: {orphans.media_files} files, {_size(orphans.media_bytes)}')
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'{"Dry run" if dry_run else "Done"} in {elapsed:.1f}s.'))
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from services import rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the DailySales rollup used by admin analytics from the Ticket table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event', type=int, action='append', help='Rebuild only these event ids (repeatable)')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = rollups.rebuild(options['event'])
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(f'Wrote {count} rollup rows in {elapsed:.2f}s.'))
@@ -0,0 +1,19 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from services import inventory
+
+
+class Command(BaseCommand):
+    help = 'Recompute EventInventory totals and sold counts from events and their tickets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event', type=int, action='append', help='Rebuild only these event ids (repeatable)')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = inventory.rebuild(options['event'])
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} inventory rows in {elapsed:.2f}s.'))
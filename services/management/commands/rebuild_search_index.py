@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from services import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild full-text search index for events'
+
+    def handle(self, *args, **kwargs):
+        if not search.is_supported():
+            self.stdout.write(self.style.WARNING('Full-text search is not supported for this database.'))
+            return
+
+        started = time.perf_counter()
+        count = search.rebuild_index()
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} events in {elapsed:.2f}s.'))
@@ -0,0 +1,115 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time as dtime
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+
+from services.models import Ticket
+from services.utils import generate_qr_png
+
+
+def _parse_day(value, end=False):
+    try:
+        day = datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise CommandError(f'Bad date "{value}", expected YYYY-MM-DD')
+    return timezone.make_aware(datetime.combine(day, dtime.max if end else dtime.min))
+
+
+class Command(BaseCommand):
+    help = (
+        'Regenerate stored QR images (Ticket.qr_code) in parallel. '
+        'Ticket ids are streamed in chunks, PNGs are rendered in a process pool, '
+        'files are written and qr_code is updated per chunk. '
+        'Progress is checkpointed so an interrupted run can be resumed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event', type=int, action='append', help='Only tickets of this event id (repeatable)')
+        parser.add_argument('--since', help='Tickets created on/after YYYY-MM-DD')
+        parser.add_argument('--until', help='Tickets created on/before YYYY-MM-DD')
+        parser.add_argument('--missing', action='store_true', help='Only tickets without a stored QR file')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--after-id', type=int, default=0, help='Skip tickets with id <= this')
+        parser.add_argument('--checkpoint', help='File with the last processed ticket id (read on start, updated per chunk)')
+
+    def handle(self, *args, **options):
+        chunk_size = max(1, options['chunk_size'])
+        workers = max(1, options['workers'])
+        checkpoint = options['checkpoint']
+
+        after_id = options['after_id']
+        if checkpoint and os.path.exists(checkpoint):
+            with open(checkpoint) as f:
+                saved = f.read().strip()
+            if saved:
+                after_id = max(after_id, int(saved))
+                self.stdout.write(f'Resuming after ticket {after_id}')
+
+        tickets = Ticket.objects.filter(pk__gt=after_id)
+        if options['event']:
+            tickets = tickets.filter(event_id__in=options['event'])
+        if options['since']:
+            tickets = tickets.filter(created_at__gte=_parse_day(options['since']))
+        if options['until']:
+            tickets = tickets.filter(created_at__lte=_parse_day(options['until'], end=True))
+        if options['missing']:
+            tickets = tickets.filter(Q(qr_code__isnull=True) | Q(qr_code=''))
+
+        total = tickets.count()
+        if not total:
+            self.stdout.write('Nothing to do.')
+            return
+        self.stdout.write(f'{total} tickets, {workers} workers, chunk {chunk_size}')
+
+        rows = tickets.order_by('id').values_list('id', 'event_id').iterator(chunk_size=chunk_size)
+
+        started = time.perf_counter()
+        done = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) >= chunk_size:
+                    done += self._process_chunk(pool, chunk, workers, checkpoint)
+                    self._progress(done, total, started)
+                    chunk = []
+            if chunk:
+                done += self._process_chunk(pool, chunk, workers, checkpoint)
+                self._progress(done, total, started)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Regenerated {done} QR codes in {elapsed:.1f}s ({done / elapsed:.0f}/s).'
+        ))
+
+    def _process_chunk(self, pool, chunk, workers, checkpoint):
+        # ссылки (с подписью SECRET_KEY) собираем здесь, в процессах — только PNG
+        urls = [Ticket.build_verify_url(pk, event_id) for pk, event_id in chunk]
+        pngs = pool.map(generate_qr_png, urls, chunksize=max(1, len(urls) // (workers * 4)))
+
+        updated = []
+        for (pk, _), png in zip(chunk, pngs):
+            name = f'qr_codes/qr_ticket_{pk}.png'
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            updated.append(Ticket(pk=pk, qr_code=default_storage.save(name, ContentFile(png))))
+
+        Ticket.objects.bulk_update(updated, ['qr_code'])
+
+        if checkpoint:
+            with open(checkpoint, 'w') as f:
+                f.write(str(chunk[-1][0]))
+        return len(updated)
+
+    def _progress(self, done, total, started):
+        elapsed = time.perf_counter() - started
+        rate = done / elapsed if elapsed else 0
+        eta = (total - done) / rate if rate else 0
+        self.stdout.write(f'{done}/{total} ({done * 100 // total}%), {rate:.0f}/s, eta {eta:.0f}s')
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from services.mail import send_pending
+
+
+class Command(BaseCommand):
+    help = (
+        'Send queued outbound emails (including retries that are due). '
+        'Run from cron, or with --loop as a standalone mail worker.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep polling the queue')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            sent, failed = send_pending()
+            if sent or failed or not options['loop']:
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f'Sent {sent}, failed {failed} in {elapsed:.2f}s.')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
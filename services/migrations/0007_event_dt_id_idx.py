@@ -0,0 +1,17 @@
+# Generated by Django 5.0.4 on 2026-10-17 22:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0006_event_cancelled_at_event_is_cancelled'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['datetime_passing', 'id'], name='event_dt_id_idx'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+from django.db import migrations
+
+
+# SQLite: FTS5 (основная таблица + trigram для поиска по подстроке)
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS services_event_fts USING fts5("
+    "title, description, organizer, "
+    "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS services_event_fts_tri USING fts5("
+    "title, description, organizer, tokenize = 'trigram')",
+    "INSERT INTO services_event_fts (rowid, title, description, organizer) "
+    "SELECT id, title, description, organizer FROM services_event",
+    "INSERT INTO services_event_fts_tri (rowid, title, description, organizer) "
+    "SELECT id, title, description, organizer FROM services_event",
+]
+
+SQLITE_BACKWARD = [
+    "DROP TABLE IF EXISTS services_event_fts",
+    "DROP TABLE IF EXISTS services_event_fts_tri",
+]
+
+# Postgres: GIN по tsvector (то же выражение, что search.PG_VECTOR) + pg_trgm
+PG_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS event_search_gin ON services_event USING GIN (("
+    "setweight(to_tsvector('russian', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(organizer, '')), 'B') || "
+    "setweight(to_tsvector('russian', coalesce(description, '')), 'C')))",
+    "CREATE INDEX IF NOT EXISTS event_title_trgm ON services_event USING GIN (title gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS event_description_trgm ON services_event USING GIN (description gin_trgm_ops)",
+]
+
+PG_BACKWARD = [
+    "DROP INDEX IF EXISTS event_search_gin",
+    "DROP INDEX IF EXISTS event_title_trgm",
+    "DROP INDEX IF EXISTS event_description_trgm",
+]
+
+
+def _run(statements):
+    def run(apps, schema_editor):
+        vendor = schema_editor.connection.vendor
+        if vendor not in statements:
+            return
+        for sql in statements[vendor]:
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0007_event_dt_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'sqlite': SQLITE_FORWARD, 'postgresql': PG_FORWARD}),
+            _run({'sqlite': SQLITE_BACKWARD, 'postgresql': PG_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.0.4 on 2026-10-17 22:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+# статусы, которые занимают место в зале
+SOLD_STATUSES = ('paid', 'refreq', 'used')
+
+
+def fill_inventory(apps, schema_editor):
+    Event = apps.get_model('services', 'Event')
+    EventInventory = apps.get_model('services', 'EventInventory')
+
+    events = (
+        Event.objects
+        .select_related('location')
+        .annotate(sold=Count('ticket', filter=Q(ticket__status__in=SOLD_STATUSES)))
+    )
+    EventInventory.objects.bulk_create([
+        EventInventory(
+            event_id=e.pk,
+            total=e.location.capacity if e.location else None,
+            sold=e.sold,
+        )
+        for e in events.iterator(chunk_size=2000)
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0010_event_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventInventory',
+            fields=[
+                ('event', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='inventory', serialize=False, to='services.event')),
+                ('total', models.PositiveIntegerField(blank=True, null=True)),
+                ('sold', models.PositiveIntegerField(default=0)),
+                ('held', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Остаток билетов',
+                'verbose_name_plural': 'Остатки билетов',
+            },
+        ),
+        migrations.AddField(
+            model_name='event',
+            name='ticket_limit',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Лимит билетов'),
+        ),
+        migrations.RunPython(fill_inventory, migrations.RunPython.noop),
+    ]
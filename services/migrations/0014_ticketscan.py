@@ -0,0 +1,34 @@
+# Generated by Django 5.0.4 on 2026-10-17 22:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0013_outboundemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketScan',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ticket_ref', models.PositiveBigIntegerField()),
+                ('device', models.CharField(max_length=64)),
+                ('scanned_at', models.DateTimeField()),
+                ('uploaded_at', models.DateTimeField(auto_now_add=True)),
+                ('result', models.CharField(choices=[('admitted', 'Проход засчитан'), ('duplicate', 'Повторный проход'), ('revoked', 'Билет недействителен'), ('not_found', 'Билет не найден')], max_length=12)),
+                ('ticket', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='scans', to='services.ticket')),
+            ],
+            options={
+                'verbose_name': 'Проход (офлайн)',
+                'verbose_name_plural': 'Проходы (офлайн)',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='ticketscan',
+            constraint=models.UniqueConstraint(fields=('ticket_ref', 'device', 'scanned_at'), name='ticket_scan_unique'),
+        ),
+    ]
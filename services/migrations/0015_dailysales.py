@@ -0,0 +1,63 @@
+# Generated by Django 5.0.4 on 2026-10-17 22:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def fill_daily_sales(apps, schema_editor):
+    Ticket = apps.get_model('services', 'Ticket')
+    DailySales = apps.get_model('services', 'DailySales')
+
+    rows = (
+        Ticket.objects
+        .annotate(day=TruncDate('created_at'))
+        .values_list('day', 'event_id', 'status')
+        .annotate(n=Count('id'), revenue=Sum('price'))
+        .order_by()
+    )
+    DailySales.objects.bulk_create([
+        DailySales(date=day, event_id=event_id, status=status, tickets=n, revenue=revenue)
+        for day, event_id, status, n, revenue in rows.iterator(chunk_size=5000)
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0014_ticketscan'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('status', models.CharField(choices=[('paid', 'Оплачен'), ('refreq', 'Запрошен возврат'), ('refunded', 'Возвращён'), ('cancelled', 'Отменён'), ('used', 'Использован')], max_length=12)),
+                ('tickets', models.IntegerField(default=0)),
+                ('revenue', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Продажи за день',
+                'verbose_name_plural': 'Продажи по дням',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='ticket',
+            index=models.Index(fields=['created_at'], name='ticket_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='dailysales',
+            name='event',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='services.event'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailysales',
+            constraint=models.UniqueConstraint(fields=('date', 'event', 'status'), name='daily_sales_unique'),
+        ),
+        migrations.RunPython(fill_daily_sales, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,107 @@
+# Generated by Django 5.0.4 on 2026-10-17 22:45
+
+import django.db.models.deletion
+from django.conf import settings
+from collections import defaultdict
+
+from django.db import migrations, models
+from django.db.models import Count, DateField, Sum
+from django.db.models.functions import TruncMonth
+
+
+def fill_cohorts(apps, schema_editor):
+    Ticket = apps.get_model('services', 'Ticket')
+    BuyerCohort = apps.get_model('services', 'BuyerCohort')
+    BuyerMonth = apps.get_model('services', 'BuyerMonth')
+    CohortCell = apps.get_model('services', 'CohortCell')
+
+    rows = (
+        Ticket.objects
+        .filter(status__in=('paid', 'refreq', 'used'))
+        .annotate(month=TruncMonth('created_at', output_field=DateField()))
+        .values_list('user_id', 'month')
+        .annotate(n=Count('id'), revenue=Sum('price'))
+        .order_by('user_id', 'month')
+    )
+
+    cohorts, months = [], []
+    cells = defaultdict(lambda: [0, 0, 0])
+    current_user, cohort = None, None
+    for user_id, month, n, revenue in rows.iterator(chunk_size=5000):
+        if user_id != current_user:
+            current_user, cohort = user_id, month
+            cohorts.append(BuyerCohort(user_id=user_id, month=month))
+        months.append(BuyerMonth(user_id=user_id, month=month, tickets=n, revenue=revenue))
+        cell = cells[(cohort, (month.year - cohort.year) * 12 + month.month - cohort.month)]
+        cell[0] += 1
+        cell[1] += n
+        cell[2] += revenue
+
+    BuyerCohort.objects.bulk_create(cohorts, batch_size=1000)
+    BuyerMonth.objects.bulk_create(months, batch_size=1000)
+    CohortCell.objects.bulk_create([
+        CohortCell(cohort=c, offset=o, buyers=b, tickets=t, revenue=r)
+        for (c, o), (b, t, r) in cells.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_profileeditcode'),
+        ('services', '0016_exportjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CohortCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cohort', models.DateField()),
+                ('offset', models.PositiveSmallIntegerField()),
+                ('buyers', models.IntegerField(default=0)),
+                ('tickets', models.IntegerField(default=0)),
+                ('revenue', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Клетка когорты',
+                'verbose_name_plural': 'Матрица когорт',
+            },
+        ),
+        migrations.CreateModel(
+            name='BuyerCohort',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='cohort', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('month', models.DateField()),
+            ],
+            options={
+                'verbose_name': 'Когорта покупателя',
+                'verbose_name_plural': 'Когорты покупателей',
+                'indexes': [models.Index(fields=['month'], name='buyer_cohort_month_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='BuyerMonth',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField()),
+                ('tickets', models.PositiveIntegerField(default=0)),
+                ('revenue', models.BigIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='buyer_months', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Покупки за месяц',
+                'verbose_name_plural': 'Покупки по месяцам',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='cohortcell',
+            constraint=models.UniqueConstraint(fields=('cohort', 'offset'), name='cohort_cell_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='buyermonth',
+            constraint=models.UniqueConstraint(fields=('user', 'month'), name='buyer_month_unique'),
+        ),
+        migrations.RunPython(fill_cohorts, migrations.RunPython.noop),
+    ]
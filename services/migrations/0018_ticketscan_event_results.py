@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-17 22:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0017_cohorts'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ticketscan',
+            name='result',
+            field=models.CharField(choices=[('admitted', 'Проход засчитан'), ('duplicate', 'Повторный проход'), ('revoked', 'Билет недействителен'), ('not_found', 'Билет не найден'), ('wrong_event', 'Билет на другое событие'), ('event_cancelled', 'Событие отменено'), ('event_over', 'Событие уже началось')], max_length=16),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.0.4 on 2026-10-17 23:02
+
+import os
+
+import services.models
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+
+def move_to_private_storage(apps, schema_editor):
+    # готовые выгрузки лежали в MEDIA_ROOT/exports (открыт по /media/)
+    ExportJob = apps.get_model('services', 'ExportJob')
+    storage = services.models.export_storage()
+    for job_id, name in ExportJob.objects.exclude(file='').values_list('id', 'file'):
+        if not default_storage.exists(name):
+            continue
+        with default_storage.open(name, 'rb') as f:
+            new_name = storage.save(os.path.basename(name), f)
+        default_storage.delete(name)
+        ExportJob.objects.filter(pk=job_id).update(file=new_name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0018_ticketscan_event_results'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='exportjob',
+            name='file',
+            field=models.FileField(blank=True, storage=services.models.export_storage, upload_to=''),
+        ),
+        migrations.AlterField(
+            model_name='exportjob',
+            name='status',
+            field=models.CharField(choices=[('queued', 'В очереди'), ('running', 'Выполняется'), ('done', 'Готово'), ('failed', 'Ошибка'), ('expired', 'Файл удалён')], default='queued', max_length=10),
+        ),
+        migrations.RunPython(move_to_private_storage, migrations.RunPython.noop),
+    ]
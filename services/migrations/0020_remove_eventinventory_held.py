@@ -0,0 +1,17 @@
+# Generated by Django 5.0.4 on 2026-10-17 23:15
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0019_exportjob_private_storage'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='eventinventory',
+            name='held',
+        ),
+    ]
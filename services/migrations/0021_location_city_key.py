@@ -0,0 +1,27 @@
+# Generated by Django 5.0.4 on 2026-10-17 23:19
+
+from django.db import migrations, models
+
+from services.models import city_key
+
+
+def fill_city_key(apps, schema_editor):
+    Location = apps.get_model('services', 'Location')
+    for pk, city in Location.objects.values_list('id', 'city'):
+        Location.objects.filter(pk=pk).update(city_key=city_key(city))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0020_remove_eventinventory_held'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='city_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=80),
+        ),
+        migrations.RunPython(fill_city_key, migrations.RunPython.noop),
+    ]
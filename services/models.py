@@ -4,16 +4,30 @@ from django.utils import timezone
 
 from accounts.models import User
 from services.utils import generate_qr_code
+from services import catalog_cache, tokens
 from django.conf import settings 
 from django.core import signing
+from django.core.files.storage import FileSystemStorage, default_storage
 
 
 
+def city_key(city):
+    """
+    Город для сравнения без учёта регистра. lower()/LIKE в SQLite складывают
+    только ASCII — "алматы" и "Алматы" для него разные, поэтому ключ
+    считаем в Python и храним рядом (Location.city_key).
+    """
+    return ' '.join((city or '').split()).casefold().replace('ё', 'е')
+
+
 class Location(models.Model):
     name = models.CharField(max_length=120, verbose_name='Площадка')
     address = models.CharField(max_length=255, blank=True, verbose_name='Адрес')
     city = models.CharField(max_length=80, blank=True, verbose_name='Город')
+    # city_key(city) — по нему фильтр ?city= в каталоге и API
+    city_key = models.CharField(max_length=80, blank=True, db_index=True, editable=False)
     capacity = models.PositiveIntegerField(null=True, blank=True, verbose_name='Вместимость')
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = 'Площадка'
@@ -22,6 +36,13 @@ class Location(models.Model):
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.city_key = city_key(self.city)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'city' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'city_key'}
+        super().save(*args, **kwargs)
+
 
 class Event(models.Model):
     title = models.CharField(max_length=60)
@@ -62,17 +83,92 @@ class Event(models.Model):
         verbose_name='Тип события'
     )
 
+    # если пусто — лимитом считается вместимость площадки
+    ticket_limit = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        verbose_name='Лимит билетов',
+    )
+
     is_cancelled = models.BooleanField(default=False)
     cancelled_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # уменьшенные копии картинки (заполняет services/images.py в фоне)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    class Meta:
+        # keyset-пагинация каталога идёт по (datetime_passing, id)
+        indexes = [
+            models.Index(fields=['datetime_passing', 'id'], name='event_dt_id_idx'),
+        ]
 
     def cancel(self):
+        """
+        Отменить событие. Билеты (paid -> cancelled) и письма покупателям —
+        в фоне, пачками (services/cancellation.py).
+        """
+        from services.cancellation import cancel_tickets
+        from services.tasks import run_after_commit
+
         self.is_cancelled = True
         self.cancelled_at = timezone.now()
-        self.save(update_fields=['is_cancelled', 'cancelled_at'])
+        self.save(update_fields=['is_cancelled', 'cancelled_at', 'updated_at'])
+        catalog_cache.invalidate_event(self.pk)
+        run_after_commit(cancel_tickets, self.pk)
 
     def __str__(self):
         return self.title
 
+    # ----- картинки для <picture>/srcset -----
+
+    def _image_srcset(self, fmt):
+        sizes = (self.image_variants or {}).get('sizes') or []
+        return ', '.join(
+            f"{default_storage.url(v[fmt])} {v['width']}w" for v in sizes
+        )
+
+    @property
+    def has_image_variants(self):
+        return bool((self.image_variants or {}).get('sizes'))
+
+    @property
+    def image_srcset_webp(self):
+        return self._image_srcset('webp')
+
+    @property
+    def image_srcset_jpeg(self):
+        return self._image_srcset('jpeg')
+
+
+class EventInventory(models.Model):
+    """
+    Остатки билетов по событию. Меняется только атомарными условными
+    UPDATE из services/inventory.py — без чтения и записи в Python,
+    поэтому параллельные покупки не могут продать больше total.
+    """
+    event = models.OneToOneField(
+        Event,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='inventory',
+    )
+    total = models.PositiveIntegerField(null=True, blank=True)  # None — без лимита
+    sold = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Остаток билетов'
+        verbose_name_plural = 'Остатки билетов'
+
+    def __str__(self):
+        return f'{self.event_id}: {self.sold}/{self.total or "∞"}'
+
+    @property
+    def available(self):
+        if self.total is None:
+            return None
+        return max(0, self.total - self.sold)
+
 
 QR_SALT = "citytickets-qr-v1" 
 
@@ -100,41 +196,141 @@ class Ticket(models.Model):
     class Meta:
         verbose_name = 'Билет'
         verbose_name_plural = 'Билеты'
+        indexes = [
+            models.Index(fields=['created_at'], name='ticket_created_idx'),
+        ]
 
     def __str__(self):
         return f'Билет на "{self.event.title}" для {self.user}'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # статус на момент загрузки: по нему post_save правит сводку (services/rollups.py)
+        instance._loaded_status = instance.__dict__.get('status')
+        return instance
+
+    @staticmethod
+    def build_verify_url(ticket_id: int, event_id: int = None) -> str:
+        # короткая ссылка для QR (services/tokens.py); в токене метка события
+        if event_id is None:
+            event_id = Ticket.objects.values_list('event_id', flat=True).get(pk=ticket_id)
+        return tokens.build_url(ticket_id, event_id)
+
     @staticmethod
-    def build_verify_url(ticket_id: int) -> str:
+    def build_signed_verify_url(ticket_id: int) -> str:
+        # старый формат (signing.dumps) — такие ссылки уже напечатаны и по-прежнему принимаются
         base = getattr(settings, "SITE_URL", "").rstrip("/")
         token = signing.dumps({"ticket_id": ticket_id}, salt=QR_SALT)
         return f"{base}/tickets/verify/{ticket_id}/{token}/"
 
     def ensure_qr(self, force: bool = False) -> None:
         """
-        Генерит QR если его нет.
+        Генерит QR-файл в qr_code, если его нет. При покупке больше не
+        вызывается — картинку рисует services/qr.py по запросу.
         force=True пересоздаст даже если уже есть (для фикса старых билетов).
         """
         if not force and self.qr_code:
             return
 
-        verify_url = self.build_verify_url(self.pk)
+        verify_url = self.build_verify_url(self.pk, self.event_id)
         img = generate_qr_code(verify_url)
         filename = f"qr_ticket_{self.pk}.png"
 
         # save=False чтобы не уйти в рекурсию save()
         self.qr_code.save(filename, img, save=False)
 
-    def save(self, *args, **kwargs):
-        is_new = self.pk is None
-        super().save(*args, **kwargs)
-
-        # QR только после того как есть pk
-        if is_new and not self.qr_code:
-            self.ensure_qr(force=False)
-            super().save(update_fields=["qr_code"])
+    @property
+    def qr_version(self):
+        # для ?v= в ссылке на картинку: новая версия токена -> новый URL
+        from .qr import QR_TOKEN_VERSION
+        return QR_TOKEN_VERSION
 
             
+class DailySales(models.Model):
+    """
+    Сводка продаж для админ-аналитики (services/rollups.py): сколько
+    билетов на event продано в date (дата created_at) и сейчас находятся
+    в status, и на какую сумму. Правится вместе с билетами, а не считается
+    по всей таблице Ticket на каждый показ дашборда.
+    """
+    date = models.DateField()
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='daily_sales')
+    status = models.CharField(max_length=12, choices=Ticket.STATUS_CHOICES)
+    tickets = models.IntegerField(default=0)
+    revenue = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Продажи за день'
+        verbose_name_plural = 'Продажи по дням'
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'event', 'status'], name='daily_sales_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.date} {self.event_id} {self.status}: {self.tickets} / {self.revenue}'
+
+
+class BuyerCohort(models.Model):
+    """
+    Когорта покупателя — месяц его первой покупки (services/cohorts.py).
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='cohort')
+    month = models.DateField()  # первое число месяца
+
+    class Meta:
+        verbose_name = 'Когорта покупателя'
+        verbose_name_plural = 'Когорты покупателей'
+        indexes = [
+            models.Index(fields=['month'], name='buyer_cohort_month_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id}: {self.month:%Y-%m}'
+
+
+class BuyerMonth(models.Model):
+    """
+    Покупки одного покупателя за месяц (без возвращённых и отменённых).
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='buyer_months')
+    month = models.DateField()
+    tickets = models.PositiveIntegerField(default=0)
+    revenue = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Покупки за месяц'
+        verbose_name_plural = 'Покупки по месяцам'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'month'], name='buyer_month_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} {self.month:%Y-%m}: {self.tickets}'
+
+
+class CohortCell(models.Model):
+    """
+    Клетка матрицы удержания: покупатели когорты cohort, купившие что-то
+    через offset месяцев после первой покупки, и их билеты / выручка.
+    """
+    cohort = models.DateField()
+    offset = models.PositiveSmallIntegerField()
+    buyers = models.IntegerField(default=0)
+    tickets = models.IntegerField(default=0)
+    revenue = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Клетка когорты'
+        verbose_name_plural = 'Матрица когорт'
+        constraints = [
+            models.UniqueConstraint(fields=['cohort', 'offset'], name='cohort_cell_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.cohort:%Y-%m} +{self.offset}: {self.buyers}'
+
+
 class Favorite(models.Model):
     user = models.ForeignKey( # бумажка для начальника user
         User,
@@ -174,3 +370,167 @@ class CartItem(models.Model):
 
     def __str__(self):
         return f'{self.user} — {self.event} x{self.quantity}'
+
+
+class IdempotencyKey(models.Model):
+    """
+    Ключ повторной отправки оплаты (скрытое поле формы или заголовок
+    Idempotency-Key). Первый POST с ключом выполняет покупку и сохраняет
+    результат, повторы (двойной клик, ретрай балансировщика) получают его же.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    key = models.CharField(max_length=64)
+    result = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Ключ идемпотентности'
+        verbose_name_plural = 'Ключи идемпотентности'
+        unique_together = ('user', 'key')
+
+    def __str__(self):
+        return f'{self.user} — {self.key}'
+
+
+class OutboundEmail(models.Model):
+    """
+    Письмо в очереди отправки (services/mail.py). Запрос только добавляет
+    строку, SMTP — в фоне, пачками через одно соединение, с повторами.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'В очереди'),
+        ('sending', 'Отправляется'),
+        ('sent', 'Отправлено'),
+        ('failed', 'Ошибка'),
+    ]
+
+    to_email = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    # билеты, чьи QR прикрепить к письму (рисуются при отправке, services/qr.py)
+    qr_ticket_ids = models.JSONField(default=list, blank=True)
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    lock_id = models.CharField(max_length=32, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Исходящее письмо'
+        verbose_name_plural = 'Исходящие письма'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='email_due_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.to_email} — {self.subject}'
+
+
+class TicketScan(models.Model):
+    """
+    Проход, отсканированный сканером в офлайн-режиме и загруженный позже
+    (services/gate.py). Первый проход билета ставит used_at, остальные
+    остаются здесь как конфликты (двойной вход, вход по возвращённому билету).
+    """
+    RESULT_CHOICES = [
+        ('admitted', 'Проход засчитан'),
+        ('duplicate', 'Повторный проход'),
+        ('revoked', 'Билет недействителен'),
+        ('not_found', 'Билет не найден'),
+        ('wrong_event', 'Билет на другое событие'),
+        ('event_cancelled', 'Событие отменено'),
+        ('event_over', 'Событие уже началось'),
+    ]
+
+    ticket = models.ForeignKey(Ticket, on_delete=models.SET_NULL, related_name='scans', null=True, blank=True)
+    ticket_ref = models.PositiveBigIntegerField()  # id из QR (строки билета может уже не быть)
+    device = models.CharField(max_length=64)
+    scanned_at = models.DateTimeField()
+    uploaded_at = models.DateTimeField(auto_now_add=True)
+    result = models.CharField(max_length=16, choices=RESULT_CHOICES)
+
+    class Meta:
+        verbose_name = 'Проход (офлайн)'
+        verbose_name_plural = 'Проходы (офлайн)'
+        constraints = [
+            # повторная загрузка того же лога ничего не дублирует
+            models.UniqueConstraint(fields=['ticket_ref', 'device', 'scanned_at'], name='ticket_scan_unique'),
+        ]
+
+    def __str__(self):
+        return f'{self.ticket_ref} @ {self.device} — {self.result}'
+
+
+def export_storage():
+    # выгрузки с email и телефонами — не в MEDIA_ROOT (он открыт по /media/):
+    # отдельная папка без base_url, файл отдаёт только export_job_download
+    return FileSystemStorage(location=getattr(settings, 'EXPORT_ROOT', settings.BASE_DIR / 'exports'), base_url=None)
+
+
+class ExportJob(models.Model):
+    """
+    Большая выгрузка в фоне (services/exports.py): воркер пишет сжатый
+    файл пачками и обновляет прогресс, staff скачивает готовый файл потом.
+    """
+    KIND_CHOICES = [
+        ('tickets', 'Билеты (как в аналитике)'),
+        ('attendees', 'Список гостей события'),
+    ]
+    FORMAT_CHOICES = [
+        ('csv', 'CSV (gzip)'),
+        ('jsonl', 'JSON Lines (gzip)'),
+    ]
+    STATUS_CHOICES = [
+        ('queued', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('done', 'Готово'),
+        ('failed', 'Ошибка'),
+        ('expired', 'Файл удалён'),
+    ]
+
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    format = models.CharField(max_length=8, choices=FORMAT_CHOICES, default='csv')
+    # фильтры: period / mode (как у admin_analytics_export_csv) или event
+    params = models.JSONField(default=dict, blank=True)
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='export_jobs')
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    rows_total = models.PositiveIntegerField(null=True, blank=True)
+    rows_done = models.PositiveIntegerField(default=0)
+    file = models.FileField(storage=export_storage, blank=True)
+    file_size = models.PositiveBigIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # последняя отметка жизни: постановка в очередь, прогресс воркера
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Выгрузка'
+        verbose_name_plural = 'Выгрузки'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f'#{self.pk} {self.kind}.{self.format} — {self.status}'
+
+    @property
+    def expires_at(self):
+        if self.status != 'done' or not self.finished_at:
+            return None
+        return self.finished_at + timezone.timedelta(days=getattr(settings, 'EXPORT_KEEP_DAYS', 7))
+
+    @property
+    def progress(self):
+        if self.status == 'done':
+            return 100
+        if not self.rows_total:
+            return 0
+        return min(99, self.rows_done * 100 // self.rows_total)
@@ -0,0 +1,167 @@
+"""
+PDF билетов (ReportLab).
+
+Один билет — одна страница A4. Несколько билетов рисуются на одном canvas
+(одна страница на билет), шрифты регистрируются один раз на процесс.
+
+Готовые PDF кэшируются: ключ зависит от id и статуса билетов и от
+updated_at события/площадки, так что повторное скачивание ничего не рисует,
+а после изменения события или возврата билета PDF пересобирается.
+"""
+import hashlib
+import logging
+import os
+from functools import lru_cache
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.timezone import localtime
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+from . import qr
+
+logger = logging.getLogger(__name__)
+
+QR_SIZE = 200
+
+
+@lru_cache(maxsize=1)
+def _fonts():
+    """
+    (обычный, жирный). Helvetica не умеет кириллицу — если есть TTF
+    (PDF_FONT_PATH / PDF_FONT_BOLD_PATH), регистрируем его.
+    """
+    regular_path = getattr(settings, 'PDF_FONT_PATH', None)
+    bold_path = getattr(settings, 'PDF_FONT_BOLD_PATH', None) or regular_path
+
+    if not regular_path or not os.path.exists(regular_path):
+        return 'Helvetica', 'Helvetica-Bold'
+
+    try:
+        pdfmetrics.registerFont(TTFont('TicketFont', regular_path))
+        bold = 'TicketFont'
+        if bold_path != regular_path and os.path.exists(bold_path):
+            pdfmetrics.registerFont(TTFont('TicketFont-Bold', bold_path))
+            bold = 'TicketFont-Bold'
+        return 'TicketFont', bold
+    except Exception:
+        logger.exception('PDF font registration failed')
+        return 'Helvetica', 'Helvetica-Bold'
+
+
+def _draw_ticket(c, ticket):
+    regular, bold = _fonts()
+    width, height = A4
+
+    y = height - 50
+
+    # Заголовок
+    c.setFont(bold, 20)
+    c.drawString(50, y, "CityTickets — Электронный билет")
+    y -= 40
+
+    c.setFont(regular, 12)
+    c.drawString(50, y, f"Билет № {ticket.id}")
+    y -= 20
+
+    user_label = ticket.user.email or ticket.user.phone_number or str(ticket.user_id)
+    c.drawString(50, y, f"Покупатель: {user_label}")
+    y -= 20
+
+    # Дата/время
+    dt = localtime(ticket.event.datetime_passing)
+    c.drawString(50, y, f"Событие: {ticket.event.title}")
+    y -= 20
+    c.drawString(50, y, f"Дата: {dt.strftime('%d.%m.%Y')}")
+    y -= 20
+    c.drawString(50, y, f"Время: {dt.strftime('%H:%M')}")
+    y -= 20
+
+    # Локация
+    if ticket.event.location:
+        loc = ticket.event.location
+        loc_parts = [loc.name]
+        if loc.city:
+            loc_parts.append(loc.city)
+        if loc.address:
+            loc_parts.append(loc.address)
+        loc_str = ", ".join(loc_parts)
+        c.drawString(50, y, f"Место: {loc_str}")
+        y -= 20
+
+    c.drawString(50, y, f"Цена: {ticket.price} ₸")
+    y -= 20
+
+    if ticket.status != 'paid':
+        c.drawString(50, y, f"Статус: {ticket.get_status_display()}")
+        y -= 20
+
+    # QR-код (из кэша services/qr.py)
+    try:
+        qr_img = ImageReader(BytesIO(qr.ticket_qr_png(ticket.id)))
+        c.drawImage(
+            qr_img,
+            width - QR_SIZE - 50,
+            height - QR_SIZE - 80,
+            QR_SIZE,
+            QR_SIZE
+        )
+    except Exception:
+        logger.exception("QR for PDF failed")
+
+    c.showPage()
+
+
+def render_tickets(tickets) -> bytes:
+    """
+    Рисует PDF (страница на билет) без кэша.
+    Билетам нужны select_related('event', 'event__location', 'user').
+    """
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=A4)
+    for ticket in tickets:
+        _draw_ticket(c, ticket)
+    c.save()
+    return buffer.getvalue()
+
+
+def _ticket_state(ticket):
+    event = ticket.event
+    # контакты покупателя напечатаны на билете: поменял профиль — новый PDF
+    # (в ключ попадает только sha1 от этой строки)
+    parts = [
+        str(ticket.id), ticket.status, str(event.updated_at.timestamp()),
+        ticket.user.email or '', ticket.user.phone_number or '',
+    ]
+    if event.location:
+        parts.append(str(event.location.updated_at.timestamp()))
+    return ':'.join(parts)
+
+
+def _cache_key(tickets):
+    state = '|'.join(_ticket_state(t) for t in tickets)
+    digest = hashlib.sha1(f'{state}|qr{qr.QR_TOKEN_VERSION}'.encode()).hexdigest()
+    return f'pdf:{digest}'
+
+
+def tickets_pdf(tickets) -> bytes:
+    """
+    PDF для одного или нескольких билетов, из кэша если уже рисовали.
+    """
+    tickets = list(tickets)
+    key = _cache_key(tickets)
+
+    pdf = cache.get(key)
+    if pdf is None:
+        pdf = render_tickets(tickets)
+        cache.set(key, pdf, timeout=getattr(settings, 'PDF_CACHE_TIMEOUT', 60 * 60 * 24))
+    return pdf
+
+
+def build_ticket_pdf(ticket) -> bytes:
+    return tickets_pdf([ticket])
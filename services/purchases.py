@@ -0,0 +1,125 @@
+"""
+Покупка билетов. Списание остатка и создание билетов — в одной транзакции:
+если что-то упало, места возвращаются автоматически.
+
+Письмо с билетами только ставится в очередь (services/mail.py),
+отправляется после коммита, в фоне.
+"""
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.html import strip_tags
+
+from . import cohorts, inventory, mail, rollups
+from .models import CartItem, Event, Ticket
+
+class CartEmpty(Exception):
+    pass
+
+
+class EventUnavailable(Exception):
+    def __init__(self, event):
+        super().__init__(event.pk)
+        self.event = event
+
+
+def purchase_ticket(event, user):
+    """
+    Купить один билет. Бросает inventory.SoldOut, если мест нет, и
+    EventUnavailable, если событие отменено или уже прошло.
+    """
+    now = timezone.now()
+
+    with transaction.atomic():
+        # строка события под блокировкой (как в checkout_cart): Event.cancel()
+        # не закоммитится между проверкой и созданием билета, и фоновая отмена
+        # увидит этот билет
+        current = (
+            Event.objects
+            .select_for_update()
+            .filter(pk=event.pk)
+            .values_list('is_cancelled', 'datetime_passing')
+            .first()
+        )
+        if current is None or current[0] or current[1] <= now:
+            raise EventUnavailable(event)
+        inventory.reserve(event, 1)
+        ticket = Ticket.objects.create(
+            event=event,
+            user=user,
+            price=event.price,
+        )
+    return ticket
+
+
+def checkout_cart(user):
+    """
+    Все позиции корзины (с учётом quantity) -> билеты, одной транзакцией:
+    остатки списываются, билеты вставляются одним bulk_create, корзина чистится.
+    Любая ошибка (SoldOut, EventUnavailable) откатывает всё целиком.
+    """
+    now = timezone.now()
+
+    with transaction.atomic():
+        # order_by(event_id): строки остатков всегда блокируются в одном порядке
+        items = list(
+            CartItem.objects
+            .select_for_update()
+            .filter(user=user)
+            .select_related('event', 'event__location')
+            .order_by('event_id')
+        )
+        if not items:
+            raise CartEmpty()
+
+        for item in items:
+            event = item.event
+            if event.is_cancelled or event.datetime_passing <= now:
+                raise EventUnavailable(event)
+            inventory.reserve(event, item.quantity)
+
+        tickets = Ticket.objects.bulk_create([
+            Ticket(event=item.event, user=user, price=item.event.price)
+            for item in items
+            for _ in range(item.quantity)
+        ])
+        # bulk_create не шлёт post_save — сводку продаж правим сами
+        rollups.record_sale(tickets)
+        cohorts.record_sale(tickets)
+
+        CartItem.objects.filter(pk__in=[item.pk for item in items]).delete()
+
+        # письмо в очереди в той же транзакции: откат заказа — нет и письма
+        send_tickets_email(user, tickets)
+
+    return tickets
+
+
+# ===== Письмо с билетами =====
+
+def send_tickets_email(user, tickets):
+    """
+    Одно письмо со всеми билетами заказа (+ QR inline) — в очередь
+    services/mail.py. SMTP в запросе не участвует.
+    """
+    if not user.email or not tickets:
+        return
+
+    if len(tickets) == 1:
+        subject = f'Ваш билет №{tickets[0].id} — {tickets[0].event.title}'
+    else:
+        subject = f'Ваши билеты ({len(tickets)} шт.) — CityTickets'
+
+    html_content = render_to_string('services/ticket-email.html', {
+        'tickets': tickets,
+        'user': user,
+        'purchase_time': timezone.now(),
+    })
+
+    mail.queue_email(
+        user.email,
+        subject,
+        strip_tags(html_content),
+        html_body=html_content,
+        qr_ticket_ids=[t.id for t in tickets],
+    )
@@ -0,0 +1,98 @@
+"""
+QR-коды билетов: рисуем лениво, при первом запросе, и кэшируем PNG.
+
+Уровни кэша:
+  1) LRU в памяти процесса (QR_LRU_SIZE картинок, ~1-2 КБ каждая)
+  2) общий кэш Django (QR_CACHE_ALIAS, например Redis) — чтобы воркеры
+     не рисовали одно и то же по очереди; None — выключен
+
+Ключ — id билета + QR_TOKEN_VERSION. Поменяли формат токена/ссылки —
+увеличиваем версию, старые картинки перестают находиться.
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .utils import generate_qr_png
+
+QR_TOKEN_VERSION = 4   # 2 — короткие ссылки /T/<токен>, 3 — с меткой события для офлайн-входа, 4 — путь SITE_URL без upper()
+
+# картинка не меняется, пока не поменялась версия — можно кэшировать надолго
+QR_MAX_AGE = 60 * 60 * 24 * 365
+
+
+class _LRU:
+    def __init__(self):
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        max_size = getattr(settings, 'QR_LRU_SIZE', 1024)
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > max_size:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+_lru = _LRU()
+
+
+def _shared_cache():
+    alias = getattr(settings, 'QR_CACHE_ALIAS', 'default')
+    return caches[alias] if alias else None
+
+
+def _key(ticket_id):
+    return f'qr:{ticket_id}:v{QR_TOKEN_VERSION}'
+
+
+def etag(ticket_id):
+    return f'"{_key(ticket_id)}"'
+
+
+def ticket_qr_png(ticket_id: int) -> bytes:
+    """
+    PNG с QR для билета (внутри ссылка на verify с подписанным токеном).
+    """
+    from .models import Ticket
+
+    key = _key(ticket_id)
+
+    png = _lru.get(key)
+    if png is not None:
+        return png
+
+    shared = _shared_cache()
+    if shared is not None:
+        png = shared.get(key)
+
+    if png is None:
+        png = generate_qr_png(Ticket.build_verify_url(ticket_id))
+        if shared is not None:
+            shared.set(key, png, timeout=QR_MAX_AGE)
+
+    _lru.set(key, png)
+    return png
+
+
+def invalidate(ticket_ids):
+    keys = [_key(pk) for pk in ticket_ids]
+    for key in keys:
+        _lru.discard(key)
+    shared = _shared_cache()
+    if shared is not None:
+        shared.delete_many(keys)
@@ -0,0 +1,141 @@
+"""
+Массовые возвраты (удаление события / действие в админке).
+
+На событие: строка события блокируется (покупки берут ту же блокировку —
+новых билетов не появится), невозвращённые билеты — тоже (SELECT ... FOR
+UPDATE, id и статус), затем один UPDATE "билеты события в этих статусах
+-> refunded" с общей отметкой refunded_at. Сводка и когорты сдвигаются по
+группам заблокированных строк: параллельный refund_now или скан не
+изменит билет между чтением статуса и UPDATE. По отметке refunded_at
+потом читаем ровно те билеты, которые только что вернули, и пачками
+кладём письма в очередь (services/mail.py). Ни save() на каждый билет,
+ни SMTP в запросе.
+
+Отменённые билеты (cancelled) не возвращаются второй раз — деньги по ним
+уже обещаны письмом об отмене (services/cancellation.py).
+"""
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from . import cohorts, inventory, mail, rollups
+from .models import Event, OutboundEmail, Ticket
+
+# удаление события: возвращаем всё, за что заплачено, включая прошедшие билеты
+REFUND_ON_DELETE = ('paid', 'refreq', 'used')
+# "Вернуть деньги за все билеты": по использованным билетам человек уже сходил
+REFUNDABLE = ('paid', 'refreq')
+
+
+@dataclass
+class RefundResult:
+    event_id: int
+    tickets: int = 0
+    amount: int = 0
+    emails: int = 0
+    seconds: float = 0.0
+
+
+def refund_email(ticket_id, event_title, price, to_email):
+    """
+    Несохранённое письмо о возврате (для mail.queue_email / queue_many).
+    """
+    subject = f'Возврат оформлен — билет №{ticket_id}'
+    text = (
+        f"Здравствуйте!\n\n"
+        f"Мы оформили возврат по билету №{ticket_id}.\n"
+        f"Событие: {event_title}\n"
+        f"Сумма: {price} ₸\n"
+        f"Статус: Возвращён\n\n"
+        f"CityTickets"
+    )
+    return OutboundEmail(to_email=to_email, subject=subject, body=text)
+
+
+def send_refund_email(ticket):
+    user = ticket.user
+    if not user.email:
+        return
+    mail.queue_many([refund_email(ticket.id, ticket.event.title, ticket.price, user.email)])
+
+
+def refund_event(event_id, event_title, statuses=REFUND_ON_DELETE):
+    """
+    Вернуть билеты события в статусах statuses. Статусы, остатки и письма —
+    в одной транзакции: если что-то упало, не останется ни полу-возврата,
+    ни писем о нём.
+    """
+    chunk_size = getattr(settings, 'REFUND_EMAIL_CHUNK', 1000)
+    started = time.perf_counter()
+    result = RefundResult(event_id=event_id)
+
+    with transaction.atomic():
+        now = timezone.now()
+        # порядок как у покупки: сначала событие, потом билеты
+        list(Event.objects.select_for_update().filter(pk=event_id).values_list('id'))
+        to_refund = Ticket.objects.filter(event_id=event_id, status__in=statuses)
+        locked = list(
+            to_refund
+            .select_for_update(of=('self',))
+            .order_by('id')
+            .values_list('id', 'status')
+        )
+        if not locked:
+            return result
+
+        result.tickets = to_refund.update(status='refunded', refunded_at=now)
+
+        # старые статусы у билетов разные — сводку и когорты сдвигаем по группам
+        by_status = defaultdict(list)
+        for ticket_id, status in locked:
+            by_status[status].append(ticket_id)
+        for status, status_ids in by_status.items():
+            rollups.move(status_ids, status, 'refunded')
+            cohorts.move(status_ids, status, 'refunded')
+
+        # все возвращаемые статусы занимали место в зале
+        inventory.release(event_id, result.tickets)
+
+        refunded = Ticket.objects.filter(event_id=event_id, status='refunded', refunded_at=now)
+        result.amount = refunded.aggregate(total=Sum('price'))['total'] or 0
+
+        chunk = []
+        rows = (
+            refunded
+            .exclude(user__email='')
+            .values_list('id', 'price', 'user__email')
+            .order_by('id')
+            .iterator(chunk_size=chunk_size)
+        )
+        for ticket_id, price, email in rows:
+            if not email:
+                continue
+            chunk.append(refund_email(ticket_id, event_title, price, email))
+            if len(chunk) >= chunk_size:
+                result.emails += mail.queue_many(chunk)
+                chunk = []
+        if chunk:
+            result.emails += mail.queue_many(chunk)
+
+    result.seconds = time.perf_counter() - started
+    return result
+
+
+def refund_events(events, progress=None, statuses=REFUND_ON_DELETE):
+    """
+    Возвраты по нескольким событиям, каждое — своей транзакцией.
+    progress(event, result) вызывается после каждого события.
+    """
+    results = []
+    for event in events:
+        result = refund_event(event.pk, event.title, statuses)
+        results.append(result)
+        if progress:
+            progress(event, result)
+    return results
+
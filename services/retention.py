@@ -0,0 +1,367 @@
+"""
+Удаление прошедших событий с архивом билетов для бухгалтерии.
+
+  1) события, прошедшие раньше cutoff, — по индексу (datetime_passing, id);
+  2) билеты пачки событий построчно пишутся в gzip JSONL — открытый
+     писатель на месяц события, во временный файл пачки
+     <ARCHIVE_ROOT>/.parts/tickets-YYYY-MM.<запуск>-<пачка>.jsonl.gz.part;
+     в памяти только текущая строка;
+  3) билеты удаляются пачками по batch_size строк, затем сами события
+     (избранное, корзины и остатки уходят каскадом) — короткие транзакции,
+     без долгих блокировок;
+  4) после коммита удаления временные файлы дописываются в конец архива
+     месяца <ARCHIVE_ROOT>/tickets-YYYY-MM.jsonl.gz (ещё один gzip-член:
+     zcat и gzip.open читают файл целиком) — один файл на месяц, сколько
+     бы ни было запусков и пачек;
+  5) файлы удалённых событий/билетов и "осиротевшие" файлы в qr_codes/ и
+     папке картинок событий удаляются из хранилища.
+
+Дописывание повторяемо: перед ним рядом с временным файлом сохраняется
+размер архива (<файл>.part.offset); повтор сначала обрезает архив до
+этого размера. Временный файл удаляется только после дописывания.
+
+Если запуск упал между 2) и 4), в .parts остаются временные файлы. Их
+разбирает следующий запуск (recover_parts): строки билетов, которые ещё
+есть в БД, выбрасываются (их заархивирует этот запуск заново), остальные
+— уже удалённые — дописываются в архив. Так билет не теряется и не
+попадает в архив дважды.
+
+dry_run=True ничего не пишет и не удаляет — только считает строки и байты.
+"""
+import gzip
+import json
+import os
+import shutil
+import uuid
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.timezone import localtime
+
+from .models import CartItem, Event, Favorite, Ticket
+
+# файлы моложе этого не трогаем: возможно, строку с ними ещё не сохранили
+ORPHAN_MIN_AGE = timedelta(hours=1)
+
+# строк временного файла на один запрос "какие билеты ещё есть" при разборе
+RECOVER_BATCH = 2000
+
+ARCHIVE_FIELDS = (
+    'id', 'event_id', 'event__title', 'event__datetime_passing',
+    'user_id', 'user__email', 'price', 'status',
+    'created_at', 'refunded_at', 'used_at', 'qr_code',
+)
+
+
+@dataclass
+class RetentionStats:
+    events: int = 0
+    tickets: int = 0
+    favorites: int = 0
+    cart_items: int = 0
+    archive_bytes: int = 0   # до сжатия
+    media_files: int = 0
+    media_bytes: int = 0
+    archive_files: set = field(default_factory=set)
+
+
+def past_event_ids(cutoff):
+    return list(
+        Event.objects
+        .filter(datetime_passing__lt=cutoff)
+        .order_by('datetime_passing', 'id')
+        .values_list('id', flat=True)
+    )
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _archive_root():
+    return getattr(settings, 'ARCHIVE_ROOT', os.path.join(settings.BASE_DIR, 'archive'))
+
+
+def _parts_dir():
+    return os.path.join(_archive_root(), '.parts')
+
+
+def _final_path(part):
+    # .parts/tickets-YYYY-MM.<запуск>-<пачка>.jsonl.gz.part -> <ARCHIVE_ROOT>/tickets-YYYY-MM.jsonl.gz
+    return os.path.join(_archive_root(), os.path.basename(part).split('.', 1)[0] + '.jsonl.gz')
+
+
+def _archive_tickets(event_ids, stats, dry_run, tag):
+    """
+    Билеты пачки событий -> временные gzip JSONL по месяцам (tag — имя
+    пачки в имени файла). -> (временные файлы, имена QR-файлов билетов).
+    """
+    writers = {}
+    qr_files = []
+
+    rows = (
+        Ticket.objects
+        .filter(event_id__in=event_ids)
+        .order_by('id')
+        .values(*ARCHIVE_FIELDS)
+        .iterator(chunk_size=2000)
+    )
+    try:
+        for row in rows:
+            if row['qr_code']:
+                qr_files.append(row['qr_code'])
+            month = localtime(row['event__datetime_passing']).strftime('%Y-%m')
+            line = (json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n').encode('utf-8')
+            stats.archive_bytes += len(line)
+            path = os.path.join(_parts_dir(), f'tickets-{month}.{tag}.jsonl.gz.part')
+            if dry_run:
+                stats.archive_files.add(_final_path(path))
+                continue
+            if month not in writers:
+                os.makedirs(_parts_dir(), exist_ok=True)
+                writers[month] = (path, gzip.open(path, 'wb'))
+            writers[month][1].write(line)
+    finally:
+        for _, writer in writers.values():
+            writer.close()
+
+    return [path for path, _ in writers.values()], qr_files
+
+
+def _append_part(part, stats):
+    """
+    Дописать временный файл в архив месяца и удалить его. Повторный вызов
+    после падения посередине даёт тот же архив.
+    """
+    final = _final_path(part)
+    offset_path = part + '.offset'
+    if os.path.exists(offset_path):
+        # прошлое дописывание не закончилось — начинаем с того же места
+        with open(offset_path) as f:
+            offset = int(f.read())
+    else:
+        offset = os.path.getsize(final) if os.path.exists(final) else 0
+        with open(offset_path + '.tmp', 'w') as f:
+            f.write(str(offset))
+        os.replace(offset_path + '.tmp', offset_path)
+
+    with open(final, 'ab') as out, open(part, 'rb') as src:
+        out.truncate(offset)
+        shutil.copyfileobj(src, out)
+        out.flush()
+        os.fsync(out.fileno())
+
+    os.remove(part)
+    os.remove(offset_path)
+    stats.archive_files.add(final)
+
+
+def _finish_parts(parts, stats):
+    for part in parts:
+        _append_part(part, stats)
+
+
+def _read_lines(path):
+    # недописанный файл (запуск упал при записи) читаем до обрыва
+    try:
+        with gzip.open(path, 'rb') as f:
+            for line in f:
+                if line.endswith(b'\n'):
+                    yield line
+    except (EOFError, OSError):
+        return
+
+
+def _still_there(batch):
+    ids = [json.loads(line)['id'] for line in batch]
+    return set(Ticket.objects.filter(pk__in=ids).values_list('id', flat=True))
+
+
+def recover_parts(stats=None):
+    """
+    Временные файлы упавшего запуска -> архив месяца (только уже удалённые билеты).
+    """
+    stats = stats or RetentionStats()
+    directory = _parts_dir()
+    if not os.path.isdir(directory):
+        return stats
+
+    for name in sorted(os.listdir(directory)):
+        part = os.path.join(directory, name)
+        if name.endswith('.part.offset'):
+            # временный файл уже дописан и удалён, осталась только отметка
+            if os.path.exists(part) and not os.path.exists(part[:-len('.offset')]):
+                os.remove(part)
+            continue
+        if not name.endswith('.part'):
+            continue
+        if os.path.exists(part + '.offset'):
+            # упали при дописывании: строки уже отобраны, повторяем его
+            _append_part(part, stats)
+            continue
+
+        kept = part + '.kept'
+        written = 0
+        with gzip.open(kept, 'wb') as out:
+            batch = []
+            for line in _read_lines(part):
+                batch.append(line)
+                if len(batch) >= RECOVER_BATCH:
+                    written += _write_deleted(out, batch, stats)
+                    batch = []
+            if batch:
+                written += _write_deleted(out, batch, stats)
+        if written:
+            # упадём после replace — следующий разбор отберёт те же строки ещё раз
+            os.replace(kept, part)
+            _append_part(part, stats)
+        else:
+            os.remove(kept)
+            os.remove(part)
+    return stats
+
+
+def _write_deleted(out, batch, stats):
+    present = _still_there(batch)
+    written = 0
+    for line in batch:
+        if json.loads(line)['id'] not in present:
+            out.write(line)
+            stats.archive_bytes += len(line)
+            written += 1
+    return written
+
+
+def _event_files(event_ids):
+    files = []
+    for image, variants in Event.objects.filter(pk__in=event_ids).values_list('image', 'image_variants'):
+        if image:
+            files.append(image)
+        for size in (variants or {}).get('sizes') or []:
+            files.extend([size['webp'], size['jpeg']])
+    return files
+
+
+def _delete_files(names, stats, dry_run):
+    for name in names:
+        try:
+            if not default_storage.exists(name):
+                continue
+            stats.media_files += 1
+            stats.media_bytes += default_storage.size(name)
+            if not dry_run:
+                default_storage.delete(name)
+        except (OSError, NotImplementedError):
+            continue
+
+
+def purge_events(event_ids, batch_size=1000, events_per_batch=50, dry_run=False, log=None):
+    """
+    Архив + удаление событий по пачкам. log(str) — для прогресса.
+    """
+    stats = RetentionStats()
+    if not dry_run:
+        recover_parts(stats)
+    run = f'{timezone.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:6]}'
+
+    for number, chunk in enumerate(_chunks(event_ids, events_per_batch), 1):
+        parts, qr_files = _archive_tickets(chunk, stats, dry_run, tag=f'{run}-{number:04d}')
+
+        # одна картинка (и её уменьшенные копии — имя по хэшу содержимого)
+        # может быть у нескольких событий: удаляем только те файлы, на
+        # которые не ссылается ни одно событие вне этой пачки
+        event_files = [
+            name for name in set(_event_files(chunk))
+            if not Event.objects.exclude(pk__in=chunk).filter(
+                Q(image=name) | Q(image_variants__icontains=name)
+            ).exists()
+        ]
+
+        stats.favorites += Favorite.objects.filter(event_id__in=chunk).count()
+        stats.cart_items += CartItem.objects.filter(event_id__in=chunk).count()
+
+        if dry_run:
+            stats.tickets += Ticket.objects.filter(event_id__in=chunk).count()
+        else:
+            while True:
+                ids = list(Ticket.objects.filter(event_id__in=chunk).values_list('id', flat=True)[:batch_size])
+                if not ids:
+                    break
+                with transaction.atomic():
+                    Ticket.objects.filter(pk__in=ids).delete()
+                stats.tickets += len(ids)
+
+            with transaction.atomic():
+                Event.objects.filter(pk__in=chunk).delete()
+            # удаление закоммичено — архив пачки становится постоянным
+            _finish_parts(parts, stats)
+
+        stats.events += len(chunk)
+        _delete_files(qr_files + event_files, stats, dry_run)
+
+        if log:
+            log(f'{stats.events}/{len(event_ids)} events, {stats.tickets} tickets')
+
+    return stats
+
+
+def _walk(directory):
+    try:
+        dirs, files = default_storage.listdir(directory)
+    except (OSError, NotImplementedError):
+        return
+    for name in files:
+        yield f'{directory}/{name}'
+    for sub in dirs:
+        yield from _walk(f'{directory}/{sub}')
+
+
+def referenced_files():
+    names = set(
+        Ticket.objects
+        .exclude(qr_code='').exclude(qr_code__isnull=True)
+        .values_list('qr_code', flat=True)
+        .iterator(chunk_size=5000)
+    )
+    for image, variants in Event.objects.values_list('image', 'image_variants').iterator(chunk_size=2000):
+        if image:
+            names.add(image)
+        for size in (variants or {}).get('sizes') or []:
+            names.update([size['webp'], size['jpeg']])
+    return names
+
+
+def purge_orphan_media(dry_run=False):
+    """
+    Файлы в qr_codes/ и папке картинок событий, на которые не ссылается ни
+    одна строка в БД.
+    """
+    stats = RetentionStats()
+    referenced = referenced_files()
+    too_new = timezone.now() - ORPHAN_MIN_AGE
+
+    directories = {
+        Ticket._meta.get_field('qr_code').upload_to,
+        Event._meta.get_field('image').upload_to,
+    }
+    orphans = []
+    for directory in directories:
+        for name in _walk(directory):
+            if name in referenced:
+                continue
+            try:
+                if default_storage.get_modified_time(name) > too_new:
+                    continue
+            except (OSError, NotImplementedError):
+                pass
+            orphans.append(name)
+
+    _delete_files(orphans, stats, dry_run)
+    return stats
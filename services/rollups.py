@@ -0,0 +1,159 @@
+"""
+Дневная сводка продаж (DailySales) для админ-аналитики.
+
+Строка — (день продажи, событие, текущий статус) -> билетов, выручка.
+День — дата created_at в TIME_ZONE проекта (как TruncDate в запросах
+дашборда). При смене статуса билет переезжает из строки старого статуса
+в строку нового; день и событие у него не меняются.
+
+Сводку правит тот же код, что меняет билеты, в той же транзакции:
+  - новый билет — post_save (signals.py) или record_sale() после bulk_create;
+  - смена статуса через save() — post_save по Ticket._loaded_status;
+  - UPDATE статуса пачкой — move(ids, старый, новый) после UPDATE; id и
+    старые статусы берутся из строк, заблокированных select_for_update до
+    UPDATE (если статусы разные — move на каждую группу), иначе
+    параллельная смена статуса сдвинет билет в сводке дважды;
+  - удаление события — строки сводки уходят каскадом;
+  - удаление пользователя (его билеты уходят каскадом, без сигналов
+    Ticket) — forget_user() из pre_delete (signals.py).
+Каждое изменение — UPDATE ... SET tickets = tickets + n (или INSERT, если
+строки ещё нет), без чтения в Python.
+
+Если сводка разошлась с билетами (правки в обход этих функций, удаление
+отдельных билетов) — rebuild() / manage.py rebuild_daily_sales.
+"""
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailySales, Ticket
+
+# id билетов на один запрос в move()
+MOVE_CHUNK = 500
+
+
+def _deltas():
+    return defaultdict(lambda: [0, 0])
+
+
+def _add(day, event_id, status, tickets, revenue):
+    updated = DailySales.objects.filter(date=day, event_id=event_id, status=status).update(
+        tickets=F('tickets') + tickets,
+        revenue=F('revenue') + revenue,
+    )
+    if updated:
+        return
+    try:
+        with transaction.atomic():
+            DailySales.objects.create(
+                date=day, event_id=event_id, status=status,
+                tickets=tickets, revenue=revenue,
+            )
+    except IntegrityError:
+        # строку успела создать параллельная транзакция
+        DailySales.objects.filter(date=day, event_id=event_id, status=status).update(
+            tickets=F('tickets') + tickets,
+            revenue=F('revenue') + revenue,
+        )
+
+
+def apply(deltas):
+    """
+    {(день, event_id, статус): [билетов, выручка]} -> сводка.
+    Ключи сортируются: параллельные транзакции блокируют строки в одном порядке.
+    """
+    for (day, event_id, status), (tickets, revenue) in sorted(deltas.items()):
+        if tickets or revenue:
+            _add(day, event_id, status, tickets, revenue)
+
+
+def _groups(qs):
+    return (
+        qs.annotate(day=TruncDate('created_at'))
+        .values_list('day', 'event_id', 'status')
+        .annotate(n=Count('id'), revenue=Sum('price'))
+        .order_by()
+    )
+
+
+def record_sale(tickets):
+    """
+    Новые билеты (объекты после create / bulk_create).
+    """
+    deltas = _deltas()
+    for ticket in tickets:
+        key = (timezone.localdate(ticket.created_at), ticket.event_id, ticket.status)
+        deltas[key][0] += 1
+        deltas[key][1] += ticket.price
+    apply(deltas)
+
+
+def move(ticket_ids, old_status, new_status):
+    """
+    Билеты ticket_ids уже переведены из old_status в new_status
+    (вызывать после UPDATE, в той же транзакции).
+    """
+    ticket_ids = list(ticket_ids)
+    if not ticket_ids or old_status == new_status:
+        return
+    deltas = _deltas()
+    for i in range(0, len(ticket_ids), MOVE_CHUNK):
+        rows = (
+            Ticket.objects
+            .filter(pk__in=ticket_ids[i:i + MOVE_CHUNK])
+            .annotate(day=TruncDate('created_at'))
+            .values_list('day', 'event_id')
+            .annotate(n=Count('id'), revenue=Sum('price'))
+            .order_by()
+        )
+        for day, event_id, n, revenue in rows:
+            deltas[(day, event_id, old_status)][0] -= n
+            deltas[(day, event_id, old_status)][1] -= revenue
+            deltas[(day, event_id, new_status)][0] += n
+            deltas[(day, event_id, new_status)][1] += revenue
+    apply(deltas)
+
+
+def forget_user(user_id):
+    """
+    Вычесть из сводки билеты пользователя (перед его удалением, в той же
+    транзакции). Строки блокируются: их статус не сменится до DELETE.
+    """
+    ticket_ids = list(
+        Ticket.objects
+        .select_for_update(of=('self',))
+        .filter(user_id=user_id)
+        .order_by('id')
+        .values_list('id', flat=True)
+    )
+    deltas = _deltas()
+    for i in range(0, len(ticket_ids), MOVE_CHUNK):
+        for day, event_id, status, n, revenue in _groups(Ticket.objects.filter(pk__in=ticket_ids[i:i + MOVE_CHUNK])):
+            deltas[(day, event_id, status)][0] -= n
+            deltas[(day, event_id, status)][1] -= revenue
+    apply(deltas)
+
+
+def rebuild(event_ids=None):
+    """
+    Пересчитать сводку из Ticket (целиком или по событиям). -> строк сводки.
+    """
+    tickets = Ticket.objects.all()
+    rollup = DailySales.objects.all()
+    if event_ids:
+        tickets = tickets.filter(event_id__in=event_ids)
+        rollup = rollup.filter(event_id__in=event_ids)
+
+    with transaction.atomic():
+        rollup.delete()
+        rows = DailySales.objects.bulk_create(
+            [
+                DailySales(date=day, event_id=event_id, status=status, tickets=n, revenue=revenue)
+                for day, event_id, status, n, revenue in _groups(tickets).iterator(chunk_size=5000)
+            ],
+            batch_size=1000,
+        )
+    return len(rows)
@@ -0,0 +1,164 @@
+"""
+Проход по билету на входе (сканеры контролёров).
+
+Код из QR — короткая ссылка (.../T/<токен>, services/tokens.py), старая
+ссылка verify (.../tickets/verify/<id>/<token>/) или сам токен.
+Подпись проверяется без БД, отметка "использован" — один условный UPDATE:
+
+    UPDATE ticket SET status='used', used_at=now
+    WHERE id = ? AND status = 'paid' AND <событие не отменено и не прошло>
+
+Обновилась строка — пропускаем. Нет — второй запрос выясняет причину
+(уже использован, возвращён, ...). Два контролёра, сканирующие один билет
+одновременно, не пропустят его оба.
+"""
+import re
+
+from django.core import signing
+from django.db import transaction
+from django.utils import timezone
+
+from . import rollups, tokens
+from .models import QR_SALT, Ticket
+
+TOKEN_MAX_AGE = 60 * 60 * 24 * 365  # 1 год, как в verify_ticket
+
+ADMITTED = 'admitted'
+ALREADY_USED = 'already_used'
+REFUNDED = 'refunded'
+REFUND_REQUESTED = 'refund_requested'
+CANCELLED = 'cancelled'
+EVENT_CANCELLED = 'event_cancelled'
+EVENT_OVER = 'event_over'
+NOT_FOUND = 'not_found'
+RETRY = 'retry'
+BAD_SIGNATURE = 'bad_signature'
+
+_VERIFY_URL_RE = re.compile(r'/tickets/verify/(\d+)/([^/]+)/?$')
+_COMPACT_URL_RE = re.compile(r'/T/([A-Za-z2-7]+)/?$')
+
+
+def parse_code(code):
+    """
+    -> ticket_id или None (подпись не сошлась / мусор).
+    """
+    code = (code or '').strip()
+
+    match = _COMPACT_URL_RE.search(code)
+    compact = match.group(1) if match else code
+    if len(compact) in tokens.TOKEN_LENGTHS:
+        return tokens.read_token(compact)
+
+    url_id = None
+    match = _VERIFY_URL_RE.search(code)
+    if match:
+        url_id, code = int(match.group(1)), match.group(2)
+
+    try:
+        payload = signing.loads(code, salt=QR_SALT, max_age=TOKEN_MAX_AGE)
+        ticket_id = int(payload.get('ticket_id'))
+    except (signing.BadSignature, TypeError, ValueError, AttributeError):
+        return None
+
+    if url_id is not None and url_id != ticket_id:
+        return None
+    return ticket_id
+
+
+def admissible(now):
+    return Ticket.objects.filter(
+        status='paid',
+        event__is_cancelled=False,
+        event__datetime_passing__gt=now,
+    )
+
+
+def _reason(row, now):
+    status, used_at, is_cancelled, starts_at = row
+    if status == 'refunded':
+        return REFUNDED
+    if status == 'cancelled':
+        return CANCELLED
+    if status == 'refreq':
+        return REFUND_REQUESTED
+    if used_at or status == 'used':
+        return ALREADY_USED
+    if is_cancelled:
+        return EVENT_CANCELLED
+    if starts_at <= now:
+        return EVENT_OVER
+    # снова 'paid' и допустим: статус менялся во время скана (например,
+    # отклонили запрос возврата) — отметки не было, можно сканировать ещё раз
+    return RETRY
+
+
+def _reasons(ticket_ids, now):
+    rows = (
+        Ticket.objects
+        .filter(pk__in=ticket_ids)
+        .values_list('id', 'status', 'used_at', 'event__is_cancelled', 'event__datetime_passing')
+    )
+    return {row[0]: _reason(row[1:], now) for row in rows}
+
+
+def mark_used(ticket_id, now=None):
+    """
+    Атомарно paid -> used. Возвращает ADMITTED или причину отказа.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        if admissible(now).filter(pk=ticket_id).update(status='used', used_at=now):
+            rollups.move([ticket_id], 'paid', 'used')
+            return ADMITTED
+    return _reasons([ticket_id], now).get(ticket_id, NOT_FOUND)
+
+
+def scan(code, now=None):
+    ticket_id = parse_code(code)
+    if ticket_id is None:
+        return {'ok': False, 'result': BAD_SIGNATURE}
+    result = mark_used(ticket_id, now)
+    return {'ok': result == ADMITTED, 'result': result, 'ticket': ticket_id}
+
+
+def scan_many(codes, now=None):
+    """
+    Пачка кодов (например, очередь сканера после обрыва связи).
+    Обычно два запроса на всю пачку: выбрать допустимые и один UPDATE.
+    Ответ — в том же порядке, что и codes.
+    """
+    now = now or timezone.now()
+    ids = [parse_code(code) for code in codes]
+    valid = list(dict.fromkeys(pk for pk in ids if pk is not None))
+
+    results = {}
+    if valid:
+        candidates = list(admissible(now).filter(pk__in=valid).values_list('id', flat=True))
+        if candidates:
+            with transaction.atomic():
+                updated = admissible(now).filter(pk__in=candidates).update(status='used', used_at=now)
+                if updated == len(candidates):
+                    results.update({pk: ADMITTED for pk in candidates})
+                elif updated:
+                    # часть билетов параллельно отметил другой сканер:
+                    # наши — те, у которых used_at ровно наша отметка
+                    ours = Ticket.objects.filter(pk__in=candidates, status='used', used_at=now)
+                    results.update({pk: ADMITTED for pk in ours.values_list('id', flat=True)})
+                rollups.move([pk for pk in candidates if pk in results], 'paid', 'used')
+        rest = [pk for pk in valid if pk not in results]
+        if rest:
+            reasons = _reasons(rest, now)
+            results.update({pk: reasons.get(pk, NOT_FOUND) for pk in rest})
+
+    out = []
+    seen = set()
+    for pk in ids:
+        if pk is None:
+            out.append({'ok': False, 'result': BAD_SIGNATURE})
+            continue
+        result = results[pk]
+        if pk in seen and result == ADMITTED:
+            result = ALREADY_USED  # один и тот же билет дважды в пачке
+        seen.add(pk)
+        out.append({'ok': result == ADMITTED, 'result': result, 'ticket': pk})
+    return out
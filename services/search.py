@@ -0,0 +1,195 @@
+"""
+Полнотекстовый поиск по событиям вместо title__icontains.
+
+SQLite:   FTS5-таблица services_event_fts (unicode61 + префиксный индекс)
+          и services_event_fts_tri (trigram) как запасной вариант
+          для поиска по подстроке.
+Postgres: GIN-индексы по to_tsvector(...) и gin_trgm_ops
+          (создаются миграцией 0008_event_search).
+
+Таблицы FTS держим в синхроне через сигналы (services/signals.py),
+полная пересборка — manage.py rebuild_search_index.
+"""
+import re
+
+from django.db import connection
+
+FTS_TABLE = 'services_event_fts'
+FTS_TRIGRAM_TABLE = 'services_event_fts_tri'
+
+# конфиг для to_tsvector в Postgres (русский стеммер)
+PG_CONFIG = 'russian'
+
+# выражение должно совпадать с индексом event_search_gin из миграции,
+# иначе Postgres его не использует
+PG_VECTOR = (
+    f"setweight(to_tsvector('{PG_CONFIG}', coalesce(title, '')), 'A') || "
+    f"setweight(to_tsvector('{PG_CONFIG}', coalesce(organizer, '')), 'B') || "
+    f"setweight(to_tsvector('{PG_CONFIG}', coalesce(description, '')), 'C')"
+)
+
+# сколько id максимум возвращаем из поиска (дальше листать нет смысла)
+SEARCH_MAX_RESULTS = 1000
+
+# веса bm25: title, description, organizer
+BM25_WEIGHTS = (10.0, 1.0, 2.0)
+
+# Лёгкий "стеммер": отрезаем типичные окончания русского и казахского
+# и ищем по префиксу. Длинные окончания проверяются первыми.
+_SUFFIXES = sorted([
+    # русский
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ой', 'ей', 'ий', 'ый', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие',
+    'ов', 'ев', 'ах', 'ях', 'ам', 'ям', 'ом', 'ем', 'ью',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь',
+    # казахский (множественное число и падежи)
+    'лар', 'лер', 'дар', 'дер', 'тар', 'тер',
+    'ның', 'нің', 'дың', 'дің', 'тың', 'тің',
+    'нан', 'нен', 'дан', 'ден', 'тан', 'тен',
+    'ға', 'ге', 'қа', 'ке', 'да', 'де', 'та', 'те',
+], key=len, reverse=True)
+
+_MIN_STEM = 3
+
+
+def _tokens(query: str):
+    return re.findall(r'\w+', query.lower().replace('ё', 'е'))
+
+
+def _stem(word: str) -> str:
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= _MIN_STEM:
+            return word[:-len(suffix)]
+    return word
+
+
+def _event_row(event):
+    return [event.pk, event.title or '', event.description or '', event.organizer or '']
+
+
+def is_supported() -> bool:
+    return connection.vendor in ('sqlite', 'postgresql')
+
+
+# ===== Синхронизация индекса (только SQLite, в Postgres индекс сам) =====
+
+def index_event(event) -> None:
+    if connection.vendor != 'sqlite':
+        return
+    row = _event_row(event)
+    with connection.cursor() as cursor:
+        for table in (FTS_TABLE, FTS_TRIGRAM_TABLE):
+            cursor.execute(f'DELETE FROM {table} WHERE rowid = %s', [event.pk])
+            cursor.execute(
+                f'INSERT INTO {table} (rowid, title, description, organizer) VALUES (%s, %s, %s, %s)',
+                row,
+            )
+
+
+def remove_event(event_id: int) -> None:
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for table in (FTS_TABLE, FTS_TRIGRAM_TABLE):
+            cursor.execute(f'DELETE FROM {table} WHERE rowid = %s', [event_id])
+
+
+def rebuild_index() -> int:
+    """
+    Полная пересборка FTS-таблиц из services_event.
+    Возвращает количество проиндексированных событий.
+    """
+    if connection.vendor != 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*) FROM services_event')
+            return cursor.fetchone()[0]
+
+    with connection.cursor() as cursor:
+        for table in (FTS_TABLE, FTS_TRIGRAM_TABLE):
+            cursor.execute(f'DELETE FROM {table}')
+            cursor.execute(
+                f'INSERT INTO {table} (rowid, title, description, organizer) '
+                f'SELECT id, title, description, organizer FROM services_event'
+            )
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        cursor.execute(f'SELECT COUNT(*) FROM {FTS_TABLE}')
+        return cursor.fetchone()[0]
+
+
+# ===== Поиск =====
+
+def _sqlite_search(tokens, limit):
+    stems = [_stem(t) for t in tokens]
+    match = ' AND '.join(f'"{s}"*' for s in stems)
+    weights = ', '.join(str(w) for w in BM25_WEIGHTS)
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+            f'ORDER BY bm25({FTS_TABLE}, {weights}) LIMIT %s',
+            [match, limit],
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+        if ids:
+            return ids
+
+        # fallback: поиск по подстроке через trigram (нужно >= 3 символов)
+        grams = [t for t in tokens if len(t) >= 3]
+        if not grams:
+            return ids
+        match = ' AND '.join(f'"{t}"' for t in grams)
+        cursor.execute(
+            f'SELECT rowid FROM {FTS_TRIGRAM_TABLE} WHERE {FTS_TRIGRAM_TABLE} MATCH %s '
+            f'ORDER BY bm25({FTS_TRIGRAM_TABLE}, {weights}) LIMIT %s',
+            [match, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _pg_search(tokens, limit):
+    tsquery = ' & '.join(f'{_stem(t)}:*' for t in tokens)
+    vector = PG_VECTOR
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT id FROM services_event "
+            f"WHERE ({vector}) @@ to_tsquery('{PG_CONFIG}', %s) "
+            f"ORDER BY ts_rank({vector}, to_tsquery('{PG_CONFIG}', %s)) DESC, id "
+            f"LIMIT %s",
+            [tsquery, tsquery, limit],
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+        if ids:
+            return ids
+
+        # fallback: pg_trgm, индекс gin_trgm_ops покрывает ILIKE '%...%'
+        grams = [t for t in tokens if len(t) >= 3]
+        if not grams:
+            return ids
+        where = ' AND '.join(['(title ILIKE %s OR description ILIKE %s)'] * len(grams))
+        params = []
+        for t in grams:
+            params += [f'%{t}%', f'%{t}%']
+        cursor.execute(
+            f'SELECT id FROM services_event WHERE {where} ORDER BY datetime_passing, id LIMIT %s',
+            params + [limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def search_event_ids(query: str, limit: int = SEARCH_MAX_RESULTS):
+    """
+    Возвращает id событий по релевантности (лучшие первыми).
+    None — если бэкенд БД не поддерживается, тогда вызывающий код
+    делает старый icontains.
+    """
+    if not is_supported():
+        return None
+
+    tokens = _tokens(query)
+    if not tokens:
+        return []
+
+    if connection.vendor == 'sqlite':
+        return _sqlite_search(tokens, limit)
+    return _pg_search(tokens, limit)
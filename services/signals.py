@@ -0,0 +1,138 @@
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from accounts.models import User
+
+from . import search, autocomplete, catalog_cache, images, inventory, rollups, cohorts
+from .models import Event, Location, Ticket
+
+
+# ===== Поисковый индекс =====
+
+@receiver(post_save, sender=Event)
+def event_saved_update_search(sender, instance, **kwargs):
+    search.index_event(instance)
+
+
+@receiver(post_delete, sender=Event)
+def event_deleted_update_search(sender, instance, **kwargs):
+    search.remove_event(instance.pk)
+
+
+# ===== Подсказки в поиске =====
+
+@receiver(post_save, sender=Event)
+def event_saved_update_autocomplete(sender, instance, **kwargs):
+    autocomplete.update_event(instance)
+
+
+@receiver(post_delete, sender=Event)
+def event_deleted_update_autocomplete(sender, instance, **kwargs):
+    autocomplete.remove_event(instance.pk)
+
+
+@receiver(post_save, sender=Location)
+def location_saved_update_autocomplete(sender, instance, **kwargs):
+    autocomplete.update_location(instance)
+
+
+@receiver(post_delete, sender=Location)
+def location_deleted_update_autocomplete(sender, instance, **kwargs):
+    # у событий location стал NULL через UPDATE без сигналов — проще пересобрать
+    autocomplete.invalidate()
+
+
+# ===== Кэш каталога =====
+
+@receiver(post_save, sender=Event)
+@receiver(post_delete, sender=Event)
+def event_changed_invalidate_catalog(sender, instance, **kwargs):
+    catalog_cache.invalidate_event(instance.pk)
+
+
+@receiver(post_save, sender=Location)
+def location_saved_invalidate_catalog(sender, instance, **kwargs):
+    catalog_cache.invalidate_events(list(instance.events.values_list('id', flat=True)))
+
+
+@receiver(pre_delete, sender=Location)
+def location_deleted_invalidate_catalog(sender, instance, **kwargs):
+    # pre_delete: после удаления у событий уже location=NULL и их не найти
+    catalog_cache.invalidate_events(list(instance.events.values_list('id', flat=True)))
+
+
+# ===== Уменьшенные картинки =====
+
+@receiver(post_save, sender=Event)
+def event_saved_build_images(sender, instance, **kwargs):
+    images.schedule_variants(instance)
+
+
+# ===== Остатки билетов =====
+
+@receiver(post_save, sender=Event)
+def event_saved_sync_inventory(sender, instance, created, **kwargs):
+    if created:
+        inventory.ensure_inventory(instance)
+    else:
+        inventory.sync_total(instance)
+
+
+@receiver(post_save, sender=Location)
+def location_saved_sync_inventory(sender, instance, **kwargs):
+    inventory.sync_location(instance, instance.capacity)
+
+
+@receiver(pre_delete, sender=Location)
+def location_deleted_sync_inventory(sender, instance, **kwargs):
+    inventory.sync_location(instance, None)
+
+
+@receiver(post_save, sender=Ticket)
+def ticket_saved_sync_inventory(sender, instance, created, update_fields=None, **kwargs):
+    # покупка уже списала место сама (inventory.reserve) — здесь только
+    # смена статуса через save(), например в админке. Обработчик объявлен
+    # раньше ticket_saved_update_rollup: тот обновляет _loaded_status
+    if created or (update_fields is not None and 'status' not in update_fields):
+        return
+    old = getattr(instance, '_loaded_status', None)
+    was_sold = old in inventory.SOLD_STATUSES
+    is_sold = instance.status in inventory.SOLD_STATUSES
+    if old is None or was_sold == is_sold:
+        return
+    if is_sold:
+        inventory.add_sold(instance.event_id)
+    else:
+        inventory.release(instance.event_id)
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted_sync_inventory(sender, instance, **kwargs):
+    # билеты уйдут каскадом без сигналов Ticket — места возвращаем заранее
+    inventory.forget(Ticket.objects.filter(user_id=instance.pk))
+
+
+# ===== Сводка продаж и когорты покупателей =====
+
+@receiver(post_save, sender=Ticket)
+def ticket_saved_update_rollup(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        rollups.record_sale([instance])
+        cohorts.record_sale([instance])
+    elif update_fields is None or 'status' in update_fields:
+        old = getattr(instance, '_loaded_status', None)
+        if old is not None and old != instance.status:
+            rollups.move([instance.pk], old, instance.status)
+            cohorts.move([instance.pk], old, instance.status)
+    instance._loaded_status = instance.status
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted_update_rollup(sender, instance, **kwargs):
+    # билеты пользователя удалятся каскадом — вычитаем их из сводки заранее
+    rollups.forget_user(instance.pk)
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted_update_cohorts(sender, instance, **kwargs):
+    cohorts.forget_user(instance.pk)
@@ -0,0 +1,135 @@
+"""
+Векторная статистика для админ-аналитики (NumPy).
+
+Данные берутся одним запросом и раскладываются по колонкам-массивам,
+дальше — только операции над массивами, без цикла по строкам в Python:
+
+  - rollup_columns(qs) — строки дневной сводки DailySales: event_id,
+    day (дни от 1970-01-01, int64), status (код int8), tickets, revenue.
+    Строка сводки — группа одинаковых билетов, поэтому там, где важно
+    число билетов (перцентили цены), строки берутся с весом tickets;
+  - by_event() — выручка/билеты по событиям (np.unique + bincount);
+  - abc() — ABC-классы по накопленной доле выручки (cumsum);
+  - pareto() — кривая Парето: доля выручки у топ-x% событий;
+  - percentiles() — перцентили (с весами) цены проданного билета;
+  - iqr_outliers() — выбросы по правилу Тьюки (Q1 - k·IQR, Q3 + k·IQR).
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+from .models import Ticket
+
+STATUS_CODES = {code: i for i, (code, _) in enumerate(Ticket.STATUS_CHOICES)}
+
+ABC_A = 0.8
+ABC_B = 0.95
+
+
+@dataclass
+class Columns:
+    event_id: np.ndarray
+    day: np.ndarray
+    status: np.ndarray
+    tickets: np.ndarray
+    revenue: np.ndarray
+
+    def __len__(self):
+        return len(self.event_id)
+
+    def where(self, mask):
+        return Columns(*(getattr(self, name)[mask] for name in self.__dataclass_fields__))
+
+    def with_status(self, *statuses):
+        return self.where(np.isin(self.status, [STATUS_CODES[s] for s in statuses]))
+
+
+def rollup_columns(qs):
+    """
+    QuerySet DailySales -> Columns. Один запрос, строки сразу в массивы.
+    """
+    rows = list(qs.values_list('event_id', 'date', 'status', 'tickets', 'revenue').order_by())
+    if not rows:
+        empty = np.empty(0, dtype=np.int64)
+        return Columns(empty, empty, np.empty(0, dtype=np.int8), empty, empty)
+
+    event_id, day, status, tickets, revenue = zip(*rows)
+    return Columns(
+        event_id=np.asarray(event_id, dtype=np.int64),
+        day=np.asarray(day, dtype='datetime64[D]').astype(np.int64),
+        status=np.fromiter((STATUS_CODES[s] for s in status), dtype=np.int8, count=len(rows)),
+        tickets=np.asarray(tickets, dtype=np.int64),
+        revenue=np.asarray(revenue, dtype=np.int64),
+    )
+
+
+def by_event(cols):
+    """
+    -> (event_ids, tickets, revenue), отсортировано по выручке, затем по
+    билетам (по убыванию) — как order_by('-revenue', '-tickets').
+    """
+    ids, inverse = np.unique(cols.event_id, return_inverse=True)
+    tickets = np.bincount(inverse, weights=cols.tickets, minlength=len(ids)).astype(np.int64)
+    revenue = np.bincount(inverse, weights=cols.revenue, minlength=len(ids)).astype(np.int64)
+    order = np.lexsort((-tickets, -revenue))
+    return ids[order], tickets[order], revenue[order]
+
+
+def abc(revenue, a=ABC_A, b=ABC_B):
+    """
+    revenue по убыванию -> (накопленная доля 0..1, классы 'A' / 'B' / 'C').
+    """
+    total = revenue.sum() or 1
+    share = np.cumsum(revenue) / total
+    classes = np.where(share <= a, 'A', np.where(share <= b, 'B', 'C'))
+    return share, classes
+
+
+def pareto(revenue, points=(0.1, 0.2, 0.5)):
+    """
+    revenue по убыванию -> {доля событий: доля выручки у этих топ-событий}
+    и доля событий, которые дают 80% выручки.
+    """
+    n = len(revenue)
+    if not n or not revenue.sum():
+        return {'top': {}, 'events_for_80': None}
+    events_share = np.arange(1, n + 1) / n
+    revenue_share = np.cumsum(revenue) / revenue.sum()
+    top = np.interp(points, np.concatenate(([0.0], events_share)), np.concatenate(([0.0], revenue_share)))
+    events_for_80 = events_share[np.searchsorted(revenue_share, ABC_A - 1e-9)]
+    return {
+        'top': {int(p * 100): round(float(s) * 100, 1) for p, s in zip(points, top)},
+        'events_for_80': round(float(events_for_80) * 100, 1),
+    }
+
+
+def percentiles(values, weights=None, q=(5, 25, 50, 75, 95)):
+    """
+    Перцентили values (с весами — как если бы каждое значение повторялось
+    weights раз). -> {q: значение}.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return {}
+    if weights is None:
+        return dict(zip(q, np.percentile(values, q).round(1).tolist()))
+
+    weights = np.asarray(weights, dtype=np.float64)
+    order = np.argsort(values, kind='stable')
+    values, weights = values[order], weights[order]
+    cum = np.cumsum(weights)
+    # ближайший ранг: первое значение, на котором накоплено >= q% веса
+    idx = np.searchsorted(cum, np.asarray(q) / 100 * cum[-1], side='left')
+    return dict(zip(q, values[np.minimum(idx, len(values) - 1)].round(1).tolist()))
+
+
+def iqr_outliers(values, k=1.5):
+    """
+    -> (маска выбросов, (нижняя граница, верхняя граница)).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) < 4:
+        return np.zeros(len(values), dtype=bool), (None, None)
+    q1, q3 = np.percentile(values, [25, 75])
+    low, high = q1 - k * (q3 - q1), q3 + k * (q3 - q1)
+    return (values < low) | (values > high), (round(float(low), 1), round(float(high), 1))
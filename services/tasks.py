@@ -0,0 +1,62 @@
+"""
+Запуск фоновых задач. Режим выбирается настройкой TASKS_BACKEND:
+
+  'rq'     — очередь django-rq (нужен Redis, воркер: manage.py rqworker default)
+  'thread' — пул потоков внутри веб-процесса (по умолчанию, без Redis)
+  'sync'   — выполнить сразу, в этом же потоке (тесты, отладка)
+
+Задачи должны быть обычными функциями уровня модуля и принимать
+простые аргументы (id, строки) — так их может выполнить и rq-воркер.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'TASKS_THREADS', 4),
+            thread_name_prefix='citytickets-task',
+        )
+    return _executor
+
+
+def _run_in_thread(func, args, kwargs):
+    try:
+        return func(*args, **kwargs)
+    except Exception:
+        logger.exception('Background task %s failed', getattr(func, '__name__', func))
+        raise
+    finally:
+        # у потока своё подключение к БД — закрываем, чтобы не копились
+        connection.close()
+
+
+def run_in_background(func, *args, **kwargs):
+    backend = getattr(settings, 'TASKS_BACKEND', 'thread')
+
+    if backend == 'sync':
+        return func(*args, **kwargs)
+
+    if backend == 'rq':
+        import django_rq
+        queue = django_rq.get_queue(getattr(settings, 'TASKS_QUEUE', 'default'))
+        return queue.enqueue(func, *args, **kwargs)
+
+    return _get_executor().submit(_run_in_thread, func, args, kwargs)
+
+
+def run_after_commit(func, *args, **kwargs):
+    """
+    То же самое, но только после успешного коммита текущей транзакции —
+    чтобы воркер не прочитал данные, которых ещё нет.
+    """
+    transaction.on_commit(lambda: run_in_background(func, *args, **kwargs))
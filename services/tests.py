@@ -1,3 +1,338 @@
-from django.test import TestCase
+import tempfile
+from datetime import timedelta
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from accounts.models import User
+
+from . import cohorts, gate, idempotency, inventory, refunds, rollups, scanning, tokens
+from .models import (
+    CartItem, CohortCell, DailySales, Event, EventInventory, Location,
+    OutboundEmail, Ticket, TicketScan,
+)
+from .purchases import EventUnavailable, checkout_cart, purchase_ticket
+
+# без collectstatic и с задачами в том же потоке (после коммита)
+TEST_SETTINGS = dict(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    TASKS_BACKEND='sync',
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    STORAGES={
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    },
+)
+
+
+def make_user(n=1, **extra):
+    return User.objects.create_user(
+        phone_number=f'+7999000{n:04d}', email=f'user{n}@citytickets.local', password='x', **extra,
+    )
+
+
+def make_event(starts_in=timedelta(days=10), **extra):
+    fields = dict(
+        title='Концерт', description='d', price=1000, duration=60,
+        datetime_passing=timezone.now() + starts_in, organizer='o',
+    )
+    fields.update(extra)
+    return Event.objects.create(**fields)
+
+
+def sold(event):
+    return EventInventory.objects.get(pk=event.pk).sold
+
+
+def rollup_rows():
+    return sorted(
+        DailySales.objects.filter(tickets__gt=0).values_list('date', 'event_id', 'status', 'tickets', 'revenue')
+    )
+
+
+def cohort_cells():
+    return sorted(
+        CohortCell.objects.filter(buyers__gt=0).values_list('cohort', 'offset', 'buyers', 'tickets', 'revenue')
+    )
+
+
+@override_settings(**TEST_SETTINGS)
+class InventoryTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+
+    def test_no_oversell_past_limit(self):
+        event = make_event(ticket_limit=3)
+        bought = sold_out = 0
+        for _ in range(5):
+            try:
+                purchase_ticket(event, self.user)
+                bought += 1
+            except inventory.SoldOut:
+                sold_out += 1
+
+        self.assertEqual((bought, sold_out), (3, 2))
+        self.assertEqual(Ticket.objects.filter(event=event).count(), 3)
+        self.assertEqual(sold(event), 3)
+        self.assertEqual(inventory.available(event), 0)
+
+    def test_location_capacity_is_the_default_limit(self):
+        event = make_event(location=Location.objects.create(name='Зал', capacity=1))
+        purchase_ticket(event, self.user)
+        with self.assertRaises(inventory.SoldOut):
+            purchase_ticket(event, self.user)
+
+    def test_cart_checkout_is_all_or_nothing(self):
+        small = make_event(ticket_limit=2)
+        big = make_event(ticket_limit=10)
+        CartItem.objects.create(user=self.user, event=big, quantity=3)
+        CartItem.objects.create(user=self.user, event=small, quantity=3)
+
+        with self.assertRaises(inventory.SoldOut):
+            checkout_cart(self.user)
+
+        self.assertFalse(Ticket.objects.exists())
+        self.assertEqual((sold(small), sold(big)), (0, 0))
+        self.assertEqual(CartItem.objects.filter(user=self.user).count(), 2)
+
+    def test_cancelled_or_past_event_is_not_sold(self):
+        event = make_event()
+        purchase_ticket(event, self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            event.cancel()
+
+        with self.assertRaises(EventUnavailable):
+            purchase_ticket(event, self.user)
+        self.assertFalse(Ticket.objects.filter(event=event, status='paid').exists())
+        self.assertEqual(sold(event), 0)
+
+        with self.assertRaises(EventUnavailable):
+            purchase_ticket(make_event(starts_in=-timedelta(hours=1)), self.user)
+
+    def test_admin_edits_and_rebuild_keep_sold_in_sync(self):
+        event = make_event(ticket_limit=5)
+        first, second = purchase_ticket(event, self.user), purchase_ticket(event, self.user)
+
+        ticket = Ticket.objects.get(pk=first.pk)
+        ticket.status = 'refunded'
+        ticket.save()
+        self.assertEqual(sold(event), 1)
+
+        ticket = Ticket.objects.get(pk=first.pk)
+        ticket.status = 'paid'
+        ticket.save()
+        self.assertEqual(sold(event), 2)
+
+        inventory.forget(Ticket.objects.filter(pk=second.pk))
+        Ticket.objects.filter(pk=second.pk).delete()
+        self.assertEqual(sold(event), 1)
+
+        EventInventory.objects.filter(pk=event.pk).update(sold=4, total=None)
+        inventory.rebuild([event.pk])
+        inv = EventInventory.objects.get(pk=event.pk)
+        self.assertEqual((inv.sold, inv.total), (1, 5))
+
+
+@override_settings(**TEST_SETTINGS)
+class PaymentReplayTests(TestCase):
+    card = {'card_number': '4111 1111 1111 1111', 'expiry_date': '12/30', 'cvv': '123'}
+
+    def setUp(self):
+        self.user = make_user()
+        self.client.force_login(self.user)
+
+    def pay(self, event, key):
+        return self.client.post(f'/payment/?event={event.pk}', {**self.card, idempotency.FORM_FIELD: key})
+
+    def test_same_key_buys_one_ticket_and_sends_one_email(self):
+        event = make_event()
+        key = idempotency.new_key()
+
+        for _ in range(3):
+            response = self.pay(event, key)
+            self.assertRedirects(response, '/my-tickets/', fetch_redirect_response=False)
+
+        self.assertEqual(Ticket.objects.filter(event=event).count(), 1)
+        self.assertEqual(OutboundEmail.objects.filter(to_email=self.user.email).count(), 1)
+        self.assertEqual(sold(event), 1)
+
+        self.pay(event, idempotency.new_key())
+        self.assertEqual(Ticket.objects.filter(event=event).count(), 2)
+
+    def test_cancelled_event_shows_an_error(self):
+        event = make_event()
+        Event.objects.filter(pk=event.pk).update(is_cancelled=True)
+
+        response = self.pay(event, idempotency.new_key())
+
+        self.assertContains(response, 'Событие отменено')
+        self.assertFalse(Ticket.objects.exists())
+
+
+@override_settings(**TEST_SETTINGS)
+class ScanTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.event = make_event()
+        self.ticket = purchase_ticket(self.event, self.user)
+        self.code = tokens.build_url(self.ticket.pk, self.event.pk)
+
+    def test_second_scan_is_already_used(self):
+        first = scanning.scan(self.code)
+        second = scanning.scan(self.code)
+
+        self.assertEqual((first['ok'], first['result']), (True, scanning.ADMITTED))
+        self.assertEqual((second['ok'], second['result']), (False, scanning.ALREADY_USED))
+        self.assertEqual(Ticket.objects.get(pk=self.ticket.pk).status, 'used')
+
+    def test_refused_tickets_report_the_reason(self):
+        Ticket.objects.filter(pk=self.ticket.pk).update(status='refreq')
+        self.assertEqual(scanning.scan(self.code)['result'], scanning.REFUND_REQUESTED)
+
+        Ticket.objects.filter(pk=self.ticket.pk).update(status='paid')
+        Event.objects.filter(pk=self.event.pk).update(is_cancelled=True)
+        self.assertEqual(scanning.scan(self.code)['result'], scanning.EVENT_CANCELLED)
+
+    def test_bad_signature(self):
+        # меняем символ в id билета (его закрывает серверный HMAC)
+        token = self.code.rsplit('/', 1)[1]
+        forged = self.code[:-len(token)] + token[:3] + ('A' if token[3] != 'A' else 'B') + token[4:]
+        self.assertEqual(scanning.scan(forged)['result'], scanning.BAD_SIGNATURE)
+        self.assertEqual(Ticket.objects.get(pk=self.ticket.pk).status, 'paid')
+
+
+@override_settings(**TEST_SETTINGS)
+class ReconcileTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.event = make_event()
+        self.tickets = [purchase_ticket(self.event, self.user) for _ in range(2)]
+        # двери открылись час назад, событие началось 10 минут назад
+        Event.objects.filter(pk=self.event.pk).update(datetime_passing=timezone.now() - timedelta(minutes=10))
+        self.event.refresh_from_db()
+        self.at = timezone.now() - timedelta(hours=1)
+
+    def scan(self, ticket, at):
+        return {'code': tokens.make_token(ticket.pk, ticket.event_id), 'scanned_at': at.isoformat()}
+
+    def test_first_pass_wins_and_later_ones_are_duplicates(self):
+        ticket = self.tickets[0]
+        result = gate.reconcile(self.event, 'gate-1', [
+            self.scan(ticket, self.at + timedelta(minutes=5)),
+            self.scan(ticket, self.at),
+        ])
+        self.assertEqual(result['admitted'], 1)
+        self.assertEqual([c['result'] for c in result['conflicts']], ['duplicate'])
+        self.assertEqual(Ticket.objects.get(pk=ticket.pk).used_at, self.at)
+
+        other = gate.reconcile(self.event, 'gate-2', [self.scan(ticket, self.at + timedelta(minutes=1))])
+        self.assertEqual(other['admitted'], 0)
+        self.assertEqual(other['conflicts'][0]['result'], 'duplicate')
+
+        # повторная загрузка того же лога ничего не меняет
+        scans = TicketScan.objects.count()
+        again = gate.reconcile(self.event, 'gate-1', [self.scan(ticket, self.at)])
+        self.assertEqual((again['admitted'], TicketScan.objects.count()), (0, scans))
+
+    def test_ticket_of_another_event_is_not_admitted(self):
+        other_event = make_event()
+        stranger = purchase_ticket(other_event, self.user)
+
+        result = gate.reconcile(self.event, 'gate-1', [self.scan(stranger, self.at)])
+
+        self.assertEqual(result['admitted'], 0)
+        self.assertEqual(result['conflicts'][0]['result'], 'wrong_event')
+        self.assertEqual(Ticket.objects.get(pk=stranger.pk).status, 'paid')
+
+    def test_unsigned_future_and_late_scans(self):
+        ticket = self.tickets[1]
+        result = gate.reconcile(self.event, 'gate-1', [
+            {'ticket': ticket.pk, 'scanned_at': self.at.isoformat()},
+            self.scan(ticket, timezone.now() + timedelta(hours=1)),
+            self.scan(ticket, timezone.now() - timedelta(minutes=5)),
+        ])
+
+        self.assertEqual((result['admitted'], result['invalid']), (0, 2))
+        self.assertEqual(result['conflicts'][0]['result'], 'event_over')
+        self.assertEqual(Ticket.objects.get(pk=ticket.pk).status, 'paid')
+
+
+@override_settings(**TEST_SETTINGS)
+class RollupConsistencyTests(TestCase):
+    """
+    Инкрементальные сводки (DailySales, когорты) после каждой операции
+    совпадают с пересчётом с нуля.
+    """
+
+    def setUp(self):
+        self.users = [make_user(n) for n in range(1, 4)]
+        self.events = [make_event(price=100 * n) for n in range(1, 4)]
+        for user in self.users:
+            for event in self.events:
+                purchase_ticket(event, user)
+        CartItem.objects.create(user=self.users[0], event=self.events[0], quantity=2)
+        checkout_cart(self.users[0])
+
+    def assertRollupsMatchRebuild(self):
+        daily, cells = rollup_rows(), cohort_cells()
+        rollups.rebuild()
+        cohorts.rebuild()
+        self.assertEqual(daily, rollup_rows())
+        self.assertEqual(cells, cohort_cells())
+
+    def test_purchases(self):
+        self.assertRollupsMatchRebuild()
+
+    def test_scan_refund_and_cancel(self):
+        ticket = Ticket.objects.filter(event=self.events[0]).first()
+        scanning.scan(tokens.build_url(ticket.pk, ticket.event_id))
+        requested = list(Ticket.objects.filter(event=self.events[1], user=self.users[1]).values_list('id', flat=True))
+        Ticket.objects.filter(pk__in=requested).update(status='refreq')
+        rollups.move(requested, 'paid', 'refreq')
+        cohorts.move(requested, 'paid', 'refreq')
+
+        refunds.refund_event(self.events[1].pk, self.events[1].title)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.events[2].cancel()
+
+        self.assertFalse(Ticket.objects.filter(event__in=self.events[1:], status='paid').exists())
+        self.assertRollupsMatchRebuild()
+
+    def test_refund_action_keeps_used_tickets(self):
+        ticket = Ticket.objects.filter(event=self.events[0]).first()
+        scanning.scan(tokens.build_url(ticket.pk, ticket.event_id))
+
+        result = refunds.refund_event(self.events[0].pk, self.events[0].title, statuses=refunds.REFUNDABLE)
+
+        self.assertEqual(Ticket.objects.get(pk=ticket.pk).status, 'used')
+        self.assertEqual(result.tickets, Ticket.objects.filter(event=self.events[0]).count() - 1)
+        self.assertEqual(sold(self.events[0]), 1)
+        self.assertRollupsMatchRebuild()
+
+    def test_admin_status_edit_and_user_delete(self):
+        ticket = Ticket.objects.filter(user=self.users[2]).first()
+        ticket.status = 'refunded'
+        ticket.save()
+        self.users[1].delete()
+
+        self.assertRollupsMatchRebuild()
+
+
+@override_settings(**TEST_SETTINGS)
+class EventsApiTests(TestCase):
+    def test_city_filter_ignores_case_for_cyrillic(self):
+        event = make_event(location=Location.objects.create(name='Дворец', city='Алматы'))
+        make_event(location=Location.objects.create(name='Арена', city='Астана'))
+
+        for city in ('алматы', 'АЛМАТЫ', ' Алматы '):
+            response = self.client.get('/api/events/', {'city': city})
+            self.assertEqual([e['id'] for e in response.json()['results']], [event.pk], city)
+
+
+class TokenTests(TestCase):
+    @override_settings(SITE_URL='https://CityTickets.kz/App/')
+    def test_url_keeps_site_path_case(self):
+        url = tokens.build_url(42, 7)
+
+        self.assertTrue(url.startswith('HTTPS://CITYTICKETS.KZ/App/T/'))
+        self.assertEqual(scanning.parse_code(url), 42)
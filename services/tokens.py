@@ -0,0 +1,95 @@
+"""
+Короткий токен билета для QR.
+
+    байты:  [версия: 2][id билета: 4, big-endian][HMAC-SHA256[:10]][метка входа: 5]
+    текст:  base32 без '=' — ровно 32 символа A-Z2-7
+
+HMAC — ключом из SECRET_KEY, его проверяет только сервер. Метка входа —
+HMAC-SHA256 тех же 5 байт ключом события (event_key): этот ключ уходит в
+манифест офлайн-сканеров (services/gate.py) и годится только для
+билетов одного события, а сервер метку не принимает вместо HMAC. Токены
+версии 1 (24 символа, без метки) уже напечатаны и принимаются онлайн.
+
+Ссылка в QR — SITE_URL + /T/<токен>, схема и хост в верхнем регистре
+(к регистру они нечувствительны), путь SITE_URL — как в настройках.
+Если в пути нет строчных букв, все символы строки входят в
+алфавитно-цифровой режим QR (0-9 A-Z $%*+-./: и пробел), поэтому код
+получается в разы меньше и плотнее, чем с signing.dumps() в байтовом
+режиме, быстрее рисуется и читается с экрана.
+
+Старые ссылки /tickets/verify/<id>/<signing-токен>/ продолжают работать.
+"""
+import base64
+import hmac
+import re
+import struct
+from urllib.parse import urlsplit, urlunsplit
+
+from django.conf import settings
+from django.utils.crypto import salted_hmac
+
+TOKEN_VERSION = 2
+COMPACT_SALT = 'citytickets-qr-compact-v1'
+GATE_SALT = 'citytickets-gate-event-v1'
+MAC_BYTES = 10
+GATE_MAC_BYTES = 5
+TOKEN_LENGTH = 32
+TOKEN_LENGTHS = (24, 32)  # версия 1, версия 2
+
+TOKEN_RE = re.compile(r'^(?:[A-Z2-7]{24}|[A-Z2-7]{32})$')
+
+_HEADER = struct.Struct('>BI')
+
+
+def _mac(body, secret=None):
+    return salted_hmac(COMPACT_SALT, body, secret, algorithm='sha256').digest()[:MAC_BYTES]
+
+
+def _secrets():
+    return [settings.SECRET_KEY, *getattr(settings, 'SECRET_KEY_FALLBACKS', [])]
+
+
+def event_key(event_id, secret=None) -> bytes:
+    """
+    Ключ меток входа одного события: HMAC от id события ключом из SECRET_KEY.
+    """
+    return salted_hmac(GATE_SALT, f'event:{event_id}', secret, algorithm='sha256').digest()
+
+
+def gate_mac(body, key):
+    return hmac.new(key, body, 'sha256').digest()[:GATE_MAC_BYTES]
+
+
+def make_token(ticket_id: int, event_id: int) -> str:
+    body = _HEADER.pack(TOKEN_VERSION, ticket_id)
+    return base64.b32encode(body + _mac(body) + gate_mac(body, event_key(event_id))).decode('ascii')
+
+
+def read_token(token):
+    """
+    -> ticket_id или None. Регистр не важен (сканеры иногда отдают строчные).
+    """
+    token = (token or '').strip().upper()
+    if not TOKEN_RE.match(token):
+        return None
+    raw = base64.b32decode(token)
+    body, mac = raw[:_HEADER.size], raw[_HEADER.size:_HEADER.size + MAC_BYTES]
+
+    version, ticket_id = _HEADER.unpack(body)
+    if version != {24: 1, 32: 2}[len(token)]:
+        return None
+
+    # метку входа не смотрим: подтверждает токен только HMAC сервера
+    if any(hmac.compare_digest(mac, _mac(body, secret)) for secret in _secrets()):
+        return ticket_id
+    return None
+
+
+def _site_base():
+    parts = urlsplit(getattr(settings, 'SITE_URL', '').rstrip('/'))
+    # путь может быть чувствителен к регистру (префикс приложения за прокси)
+    return urlunsplit((parts.scheme.upper(), parts.netloc.upper(), parts.path, '', ''))
+
+
+def build_url(ticket_id: int, event_id: int) -> str:
+    return f'{_site_base()}/T/{make_token(ticket_id, event_id)}'
@@ -4,24 +4,40 @@ from . import views
 urlpatterns = [
     path('', views.index, name='home'),
     path('events/', views.events_list, name='events'),
+    path('events/autocomplete/', views.events_autocomplete, name='events_autocomplete'),
     path('events/<int:event_id>/', views.event_details, name='event_details'),
 
+    path('api/events/', views.api_events, name='api_events'),
+    path('api/events/<int:event_id>/', views.api_event_detail, name='api_event_detail'),
+
     path('payment/', views.PaymentView.as_view(), name='payment'),
     path('my-tickets/', views.get_my_tickets, name='my_tickets'),
+    path('tickets/pdf/', views.tickets_pdf_bundle, name='tickets_pdf_bundle'),
     path('tickets/pdf/<int:ticket_id>/', views.ticket_pdf, name='ticket_pdf'),
 
     path('favorites/', views.favorites_list, name='favorites'),
     path('favorites/toggle/<int:event_id>/', views.toggle_favorite, name='toggle_favorite'),
 
     path('cart/', views.cart_view, name='cart'),
+    path('cart/checkout/', views.CartCheckoutView.as_view(), name='cart_checkout'),
     path('cart/add/<int:event_id>/', views.add_to_cart, name='add_to_cart'),
     path('cart/remove/<int:item_id>/', views.cart_remove, name='cart_remove'),
 
     path('analytics/', views.admin_analytics, name='admin-analytics'),
     path('analytics/export/csv/', views.admin_analytics_export_csv, name='admin_analytics_export_csv'),
+    path('analytics/exports/', views.export_jobs, name='export_jobs'),
+    path('analytics/exports/<int:job_id>/download/', views.export_job_download, name='export_job_download'),
 
     path('tickets/<int:ticket_id>/refund-now/', views.refund_now, name='refund_now'),
 
     path("tickets/<int:ticket_id>/qr.png/", views.ticket_qr_png, name="ticket_qr_png"),
     path("tickets/verify/<int:ticket_id>/<str:token>/", views.verify_ticket, name="verify_ticket"),
+    # короткая ссылка из QR — без слэша в конце, чтобы не было лишнего редиректа
+    path("T/<str:token>", views.verify_ticket_compact, name="verify_ticket_compact"),
+    path("T/<str:token>/", views.verify_ticket_compact),
+
+    path('api/scan/', views.api_scan, name='api_scan'),
+    path('api/scan/batch/', views.api_scan_batch, name='api_scan_batch'),
+    path('api/scan/manifest/<int:event_id>/', views.api_scan_manifest, name='api_scan_manifest'),
+    path('api/scan/upload/', views.api_scan_upload, name='api_scan_upload'),
 ]
@@ -1,4 +1,6 @@
+import base64
 import qrcode
+from datetime import datetime
 from io import BytesIO
 from django.core.files import File
 from PIL import Image
@@ -29,3 +31,28 @@ def generate_qr_code(data: str) -> ContentFile:
     не ломался.
     """
     return ContentFile(generate_qr_png(data), name="qr.png")
+
+
+# ===== Keyset-курсор для каталога =====
+# Курсор = (datetime_passing, id) последнего события на странице,
+# упакованный в urlsafe base64, чтобы его можно было класть в ?cursor=
+
+def encode_cursor(dt, pk) -> str:
+    raw = f"{dt.isoformat()}|{pk}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str):
+    """
+    Возвращает (datetime, id) или None, если курсор битый.
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8')
+        dt_raw, pk_raw = raw.rsplit('|', 1)
+        dt = datetime.fromisoformat(dt_raw)
+        return dt, int(pk_raw)
+    except (ValueError, UnicodeDecodeError):
+        return None
@@ -4,47 +4,54 @@ from django.core.mail import EmailMultiAlternatives
 from django.db import transaction, IntegrityError
 from django.shortcuts import render, get_object_or_404, redirect
 from django.template.loader import render_to_string
+from django.utils.dateparse import parse_date
 from django.utils.html import strip_tags
 from django.views import View
 
 from .forms import PaymentForm
-from .models import Event, Ticket, Favorite, CartItem
+from .models import Event, Ticket, Favorite, CartItem, Location, ExportJob, city_key
 from django.contrib.auth import get_user_model
 User = get_user_model()
 
 
 from io import BytesIO
 from django.http import HttpResponse
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.utils import ImageReader
 from django.utils.timezone import localtime
 from django.utils import timezone
 
 import logging
 
 from django.views.decorators.http import require_POST
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, HttpResponseNotModified, Http404, JsonResponse, StreamingHttpResponse, FileResponse
 from django.utils.timezone import localtime
 
 from django.contrib.admin.views.decorators import staff_member_required
 from django.db.models import Sum, Count
 from django.db.models.functions import TruncDate
 
-from datetime import timedelta
+from datetime import datetime, timedelta
 from django.contrib.admin.views.decorators import staff_member_required
-from django.db.models import Sum, Count, Avg, Q, F
+from django.db.models import Sum, Count, Avg, Q, F, Max
 
 import csv
+import hashlib
+import json
+import os
 from django.contrib import messages
 
 from django.conf import settings
 
-from django.core.mail import send_mail
 
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import require_http_methods, require_GET, condition
+from django.utils.cache import patch_cache_control
+from django.urls import reverse
+from django.core.files.storage import default_storage
 
-from .utils import generate_qr_png
+from .utils import encode_cursor, decode_cursor
+from . import search, autocomplete, catalog_cache, inventory, idempotency, qr, mail, scanning, gate, tokens, rollups, analytics, exports, cohorts
+from .pdf import build_ticket_pdf, tickets_pdf
+from .refunds import send_refund_email
+from .purchases import purchase_ticket, checkout_cart, send_tickets_email, CartEmpty, EventUnavailable
 
 from django.core import signing
 
@@ -57,126 +64,228 @@ QR_SALT = "citytickets-qr-v1"   # должна совпадать с models.py
 REFUND_LOCK_HOURS = 2  # запрет возврата за N часов до начала
 
 
-def build_ticket_pdf(ticket):
+# ===== Главная =====
+def index(request):
+    return render(request, 'services/home.html')
+
+
+# ===== Список событий =====
+EVENTS_MAX_PAGE_SIZE = 100
+
+
+def _events_page_size(request):
+    default = getattr(settings, 'EVENTS_PAGE_SIZE', 24)
+    try:
+        size = int(request.GET.get('limit', default))
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, EVENTS_MAX_PAGE_SIZE))
+
+
+def _events_page(events_qs, cursor, page_size):
     """
-    Генерит PDF по объекту Ticket и возвращает байты.
+    Keyset-пагинация по (datetime_passing, id): без OFFSET,
+    поэтому скорость не зависит от того, насколько далеко пролистали.
+    Возвращает (список событий, next_cursor или None).
     """
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer, pagesize=A4)
-    width, height = A4
-
-    y = height - 50
-
-    # Заголовок
-    c.setFont("Helvetica-Bold", 20)
-    c.drawString(50, y, "CityTickets — Электронный билет")
-    y -= 40
-
-    c.setFont("Helvetica", 12)
-    c.drawString(50, y, f"Билет № {ticket.id}")
-    y -= 20
-
-    user_label = ticket.user.email or ticket.user.phone_number or str(ticket.user_id)
-    c.drawString(50, y, f"Покупатель: {user_label}")
-    y -= 20
-
-    # Дата/время
-    dt = localtime(ticket.event.datetime_passing)
-    c.drawString(50, y, f"Событие: {ticket.event.title}")
-    y -= 20
-    c.drawString(50, y, f"Дата: {dt.strftime('%d.%m.%Y')}")
-    y -= 20
-    c.drawString(50, y, f"Время: {dt.strftime('%H:%M')}")
-    y -= 20
-
-    # Локация
-    if ticket.event.location:
-        loc = ticket.event.location
-        loc_parts = [loc.name]
-        if loc.city:
-            loc_parts.append(loc.city)
-        if loc.address:
-            loc_parts.append(loc.address)
-        loc_str = ", ".join(loc_parts)
-        c.drawString(50, y, f"Место: {loc_str}")
-        y -= 20
-
-    c.drawString(50, y, f"Цена: {ticket.price} ₸")
-    y -= 40
-
-    # QR-код, если есть
-    if ticket.qr_code:
-        try:
-            verify_url = _ticket_verify_url(ticket.id)
-            qr_bytes = generate_qr_png(verify_url)
-            qr = ImageReader(BytesIO(qr_bytes))
-    
-            qr_size = 200
-            c.drawImage(
-                qr,
-                width - qr_size - 50,
-                height - qr_size - 80,
-                qr_size,
-                qr_size
-            )
-        except Exception:
-            pass
-
-    c.showPage()
-    c.save()
-
-    pdf = buffer.getvalue()
-    buffer.close()
-    return pdf
-
-
-# helper для письма
-def send_refund_email(ticket):
-    user = ticket.user
-    if not user.email:
-        return
-
-    subject = f'Возврат оформлен — билет №{ticket.id}'
-    text = (
-        f"Здравствуйте!\n\n"
-        f"Мы оформили возврат по билету №{ticket.id}.\n"
-        f"Событие: {ticket.event.title}\n"
-        f"Сумма: {ticket.price} ₸\n"
-        f"Статус: Возвращён\n\n"
-        f"CityTickets"
-    )
+    events_qs = events_qs.select_related('location').order_by('datetime_passing', 'id')
 
-    send_mail(
-        subject,
-        text,
-        getattr(settings, 'DEFAULT_FROM_EMAIL', 'no-reply@citytickets.local'),
-        [user.email],
-        fail_silently=False
-    )
+    position = decode_cursor(cursor)
+    if position:
+        dt, pk = position
+        events_qs = events_qs.filter(
+            Q(datetime_passing__gt=dt) |
+            Q(datetime_passing=dt, id__gt=pk)
+        )
 
+    # берём на одно больше, чтобы понять, есть ли следующая страница
+    events = list(events_qs[:page_size + 1])
+    next_cursor = None
+    if len(events) > page_size:
+        events = events[:page_size]
+        last = events[-1]
+        next_cursor = encode_cursor(last.datetime_passing, last.pk)
 
+    return events, next_cursor
 
 
-# ===== Главная =====
-def index(request):
-    return render(request, 'services/home.html')
+def _ranked_events_page(events_qs, ranked_ids, cursor, page_size):
+    """
+    Страница результатов поиска в порядке релевантности.
+    Курсор здесь — просто смещение в списке найденных id
+    (их не больше search.SEARCH_MAX_RESULTS).
+    """
+    try:
+        offset = max(0, int(cursor or 0))
+    except ValueError:
+        offset = 0
 
+    # остальные фильтры (категория и т.п.) применяем к найденным id одним запросом
+    allowed = set(events_qs.filter(id__in=ranked_ids).values_list('id', flat=True))
+    ids = [pk for pk in ranked_ids if pk in allowed]
+
+    page_ids = ids[offset:offset + page_size]
+    by_id = Event.objects.select_related('location').in_bulk(page_ids)
+    events = [by_id[pk] for pk in page_ids if pk in by_id]
+
+    next_offset = offset + page_size
+    next_cursor = str(next_offset) if next_offset < len(ids) else None
+    return events, next_cursor
+
+
+def _get_date(request, name):
+    try:
+        return parse_date(request.GET.get(name, '').strip())
+    except ValueError:
+        return None
+
+
+def _day_start(d):
+    return timezone.make_aware(datetime.combine(d, datetime.min.time()))
+
+
+def _filtered_events(request):
+    """
+    Общие фильтры каталога — ими пользуются и events_list, и /api/events/.
+    Возвращает (events_qs, ranked_ids). Если был полнотекстовый поиск,
+    ranked_ids — найденные id по релевантности, иначе None.
+    """
+    memo = getattr(request, '_filtered_events', None)
+    if memo is not None:
+        return memo
 
-# ===== Список событий =====
-def events_list(request):
     q = request.GET.get('q', '').strip()
     category = request.GET.get('category', '').strip()
+    city = request.GET.get('city', '').strip()
 
-    events_qs = Event.objects.all().order_by('datetime_passing')
+    events_qs = Event.objects.all()
 
-    if q:
+    if category:
+        events_qs = events_qs.filter(category=category)
+
+    if city:
+        events_qs = events_qs.filter(location__city_key=city_key(city))
+
+    # date=YYYY-MM-DD — один день; date_from / date_to — диапазон (включительно)
+    day = _get_date(request, 'date')
+    date_from = _get_date(request, 'date_from')
+    date_to = _get_date(request, 'date_to')
+    if day:
+        date_from = date_to = day
+    if date_from:
+        events_qs = events_qs.filter(datetime_passing__gte=_day_start(date_from))
+    if date_to:
+        events_qs = events_qs.filter(datetime_passing__lt=_day_start(date_to + timedelta(days=1)))
+
+    ranked_ids = search.search_event_ids(q) if q else None
+
+    if q and ranked_ids is None:
         events_qs = events_qs.filter(
             Q(title__icontains=q) |
             Q(description__icontains=q)
         )
 
-    if category:
-        events_qs = events_qs.filter(category=category)
+    request._filtered_events = (events_qs, ranked_ids)
+    return events_qs, ranked_ids
+
+
+def _paginated_events(request, events_qs, ranked_ids):
+    cursor = request.GET.get('cursor', '').strip()
+    page_size = _events_page_size(request)
+
+    if ranked_ids is not None:
+        return _ranked_events_page(events_qs, ranked_ids, cursor, page_size)
+    return _events_page(events_qs, cursor, page_size)
+
+
+# ===== Условный GET (ETag / Last-Modified) =====
+# Состояние считаем одним агрегатом, 304 отдаётся декоратором condition()
+# ещё до вызова вьюхи — без шаблонов и сериализации.
+# Поменяли шаблоны карточек/формат API — увеличиваем версию.
+CATALOG_ETAG_VERSION = 2
+
+
+def _catalog_state(request):
+    state = getattr(request, '_catalog_state', None)
+    if state is not None:
+        return state
+
+    events_qs, ranked_ids = _filtered_events(request)
+    if ranked_ids is not None:
+        events_qs = events_qs.filter(id__in=ranked_ids)
+
+    events = events_qs.aggregate(last=Max('updated_at'), count=Count('id'), max_id=Max('id'))
+    locations = Location.objects.aggregate(last=Max('updated_at'), count=Count('id'))
+
+    last_modified = max([d for d in (events['last'], locations['last']) if d], default=None)
+    raw = '|'.join(str(x) for x in (
+        CATALOG_ETAG_VERSION,
+        request.get_full_path(),
+        events['count'], events['max_id'], events['last'] and events['last'].isoformat(),
+        locations['count'], locations['last'] and locations['last'].isoformat(),
+    ))
+
+    state = (hashlib.sha1(raw.encode('utf-8')).hexdigest(), last_modified)
+    request._catalog_state = state
+    return state
+
+
+def _event_state(request, event_id):
+    state = getattr(request, '_event_state', None)
+    if state is not None:
+        return state
+
+    row = (
+        Event.objects.filter(pk=event_id)
+        .values_list('updated_at', 'location__updated_at')
+        .first()
+    )
+    if row is None:
+        state = (None, None)  # 404 отдаст сама вьюха
+    else:
+        last_modified = max(d for d in row if d)
+        raw = '|'.join(str(x) for x in (
+            CATALOG_ETAG_VERSION, request.get_full_path(), event_id, *row,
+        ))
+        state = (hashlib.sha1(raw.encode('utf-8')).hexdigest(), last_modified)
+
+    request._event_state = state
+    return state
+
+
+# HTML-страницы для вошедших персональные (избранное, корзина) — для них не кэшируем
+
+def _catalog_page_etag(request, *args, **kwargs):
+    if request.user.is_authenticated:
+        return None
+    return _catalog_state(request)[0]
+
+
+def _catalog_page_last_modified(request, *args, **kwargs):
+    if request.user.is_authenticated:
+        return None
+    return _catalog_state(request)[1]
+
+
+def _event_page_etag(request, event_id):
+    if request.user.is_authenticated:
+        return None
+    return _event_state(request, event_id)[0]
+
+
+def _event_page_last_modified(request, event_id):
+    if request.user.is_authenticated:
+        return None
+    return _event_state(request, event_id)[1]
+
+
+@condition(etag_func=_catalog_page_etag, last_modified_func=_catalog_page_last_modified)
+def events_list(request):
+    q = request.GET.get('q', '').strip()
+    category = request.GET.get('category', '').strip()
+
+    events_qs, ranked_ids = _filtered_events(request)
+    events, next_cursor = _paginated_events(request, events_qs, ranked_ids)
 
     favorite_ids = set()
     if request.user.is_authenticated:
@@ -184,25 +293,131 @@ def events_list(request):
             Favorite.objects.filter(user=request.user).values_list('event_id', flat=True)
         )
 
-    return render(
-        request,
-        'services/events.html',
-        {
-            'events': events_qs,
-            'search_query': q,
-            'selected_category': category,
-            'favorite_ids': favorite_ids,
-        }
-    )
+    context = {
+        'events': events,
+        'cards': catalog_cache.render_cards(events),
+        'search_query': q,
+        'selected_category': category,
+        'favorite_ids': favorite_ids,
+        'next_cursor': next_cursor,
+    }
+
+    # "Показать ещё": отдаём только карточки + курсор следующей страницы
+    if request.GET.get('format') == 'json':
+        html = render_to_string('services/_event_cards.html', context, request=request)
+        return JsonResponse({
+            'html': html,
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None,
+        })
+
+    return render(request, 'services/events.html', context)
+
+
+def events_autocomplete(request):
+    """
+    Подсказки для строки поиска (название / организатор / площадка).
+    Берутся из индекса в памяти, в БД не ходим.
+    """
+    q = request.GET.get('q', '').strip()
+    try:
+        limit = max(1, min(int(request.GET.get('limit', 8)), 20))
+    except ValueError:
+        limit = 8
+
+    return JsonResponse({
+        'query': q,
+        'results': autocomplete.suggest(q, limit) if q else [],
+    })
 
 
 # ===== Детали события =====
+@condition(etag_func=_event_page_etag, last_modified_func=_event_page_last_modified)
 def event_details(request, event_id):
-    event = get_object_or_404(Event, pk=event_id)
-    return render(request, 'services/detail.html', {'event': event})
+    is_authenticated = request.user.is_authenticated
+
+    # если фрагмент в кэше — в БД не ходим вообще
+    event_html = catalog_cache.get_detail(event_id, is_authenticated)
+    if event_html is None:
+        event = get_object_or_404(Event.objects.select_related('location'), pk=event_id)
+        event_html = catalog_cache.render_detail(event, is_authenticated)
+
+    return render(request, 'services/detail.html', {'event_html': event_html})
+
+
+# ===== JSON API событий (только чтение) =====
+
+def _event_json(event):
+    loc = event.location
+    return {
+        'id': event.pk,
+        'title': event.title,
+        'description': event.description,
+        'category': event.category,
+        'price': event.price,
+        'duration': event.duration,
+        'age_limit': event.age_limit,
+        'organizer': event.organizer,
+        'datetime_passing': event.datetime_passing.isoformat(),
+        'is_cancelled': event.is_cancelled,
+        'image': event.image.url if event.image else None,
+        'image_variants': [
+            {
+                'width': v['width'],
+                'webp': default_storage.url(v['webp']),
+                'jpeg': default_storage.url(v['jpeg']),
+            }
+            for v in (event.image_variants or {}).get('sizes', [])
+        ],
+        'location': {
+            'id': loc.pk,
+            'name': loc.name,
+            'city': loc.city,
+            'address': loc.address,
+        } if loc else None,
+        'url': reverse('event_details', args=[event.pk]),
+    }
+
+
+def _api_response(data):
+    response = JsonResponse(data, json_dumps_params={'ensure_ascii': False})
+    # CDN может хранить ответ, но обязан перепроверять по ETag
+    patch_cache_control(response, public=True, no_cache=True)
+    return response
+
+
+@require_GET
+@condition(
+    etag_func=lambda request: _catalog_state(request)[0],
+    last_modified_func=lambda request: _catalog_state(request)[1],
+)
+def api_events(request):
+    events_qs, ranked_ids = _filtered_events(request)
+    events, next_cursor = _paginated_events(request, events_qs, ranked_ids)
+
+    return _api_response({
+        'results': [_event_json(e) for e in events],
+        'next_cursor': next_cursor,
+    })
+
+
+@require_GET
+@condition(
+    etag_func=lambda request, event_id: _event_state(request, event_id)[0],
+    last_modified_func=lambda request, event_id: _event_state(request, event_id)[1],
+)
+def api_event_detail(request, event_id):
+    event = get_object_or_404(Event.objects.select_related('location'), pk=event_id)
+    return _api_response(_event_json(event))
 
 
 # ===== Оплата =====
+def _unavailable_error(event):
+    if event.is_cancelled:
+        return 'Событие отменено, билеты на него не продаются'
+    return 'Нельзя купить билет на событие, которое уже прошло'
+
+
 class PaymentView(View):
     login_url = 'home'
 
@@ -217,19 +432,30 @@ class PaymentView(View):
         if not event:
             return redirect('events')
 
-        # ✅ запрет покупки прошедшего
-        if event.datetime_passing <= timezone.now():
+        # ✅ запрет покупки прошедшего и отменённого
+        if event.is_cancelled or event.datetime_passing <= timezone.now():
+            return render(request, 'services/payment.html', {
+                'form': PaymentForm(),
+                'total_price': event.price,
+                'event': event,
+                'idempotency_key': idempotency.new_key(),
+                'error': _unavailable_error(event),
+            })
+
+        if inventory.available(event) == 0:
             return render(request, 'services/payment.html', {
                 'form': PaymentForm(),
                 'total_price': event.price,
                 'event': event,
-                'error': 'Нельзя купить билет на событие, которое уже прошло',
+                'idempotency_key': idempotency.new_key(),
+                'error': 'Билеты на это событие закончились',
             })
 
         return render(request, 'services/payment.html', {
             'form': PaymentForm(),
             'total_price': event.price,
             'event': event,
+            'idempotency_key': idempotency.new_key(),
         })
 
     def post(self, request):
@@ -237,13 +463,17 @@ class PaymentView(View):
         if not event:
             return redirect('events')
 
-        # ✅ запрет покупки прошедшего (обязательно в POST тоже)
-        if event.datetime_passing <= timezone.now():
+        # повторная отправка той же формы не должна купить второй билет
+        idempotency_key = idempotency.get_key(request) or idempotency.new_key()
+
+        # ✅ запрет покупки прошедшего и отменённого (обязательно в POST тоже)
+        if event.is_cancelled or event.datetime_passing <= timezone.now():
             return render(request, 'services/payment.html', {
                 'form': PaymentForm(request.POST or None),
                 'total_price': event.price,
                 'event': event,
-                'error': 'Нельзя купить билет на событие, которое уже прошло',
+                'idempotency_key': idempotency_key,
+                'error': _unavailable_error(event),
             })
 
         form = PaymentForm(request.POST)
@@ -252,69 +482,105 @@ class PaymentView(View):
                 'form': form,
                 'total_price': event.price,
                 'event': event,
+                'idempotency_key': idempotency_key,
                 'error': 'Проверьте данные карты',
             })
 
         user = request.user
 
-        # ✅ создаём билет
-        ticket = Ticket.objects.create(
-            event=event,
-            user=user,
-            price=event.price,
-        )
+        # ✅ создаём билет (атомарно списываем остаток)
+        created = []
+
+        def buy():
+            created.append(purchase_ticket(event, user))
+            return {'ticket_ids': [created[0].pk]}
 
-        # на всякий: QR гарантируем (если где-то save не сработал)
         try:
-            if not ticket.qr_code:
-                ticket.ensure_qr(force=False)
-                ticket.save(update_fields=["qr_code"])
-        except Exception:
-            logger.exception("QR generation failed")
+            _, replayed = idempotency.run_once(user, idempotency_key, buy)
+        except EventUnavailable:
+            # событие отменили / оно началось, пока заполняли форму
+            event.refresh_from_db(fields=['is_cancelled', 'datetime_passing'])
+            return render(request, 'services/payment.html', {
+                'form': form,
+                'total_price': event.price,
+                'event': event,
+                'idempotency_key': idempotency_key,
+                'error': _unavailable_error(event),
+            })
+        except inventory.SoldOut:
+            return render(request, 'services/payment.html', {
+                'form': form,
+                'total_price': event.price,
+                'event': event,
+                'idempotency_key': idempotency_key,
+                'error': 'Билеты на это событие закончились',
+            })
 
-        # ===== письмо с билетом =====
+        if replayed:
+            # дубль (двойной клик / ретрай) — билет уже куплен, письмо уже ушло
+            return redirect('my_tickets')
+
+        ticket = created[0]
+
+        # ===== письмо с билетом (в очередь, SMTP — в фоне) =====
         if user.email:
-            subject = f'Ваш билет №{ticket.id} — {event.title}'
-            purchase_time = timezone.now()
+            try:
+                send_tickets_email(user, [ticket])
+            except Exception:
+                logger.exception("Email queue failed")
+
+        return redirect('my_tickets')
+
+
+# ===== Оплата всей корзины =====
+class CartCheckoutView(LoginRequiredMixin, View):
+    login_url = 'home'
+
+    def _cart_total(self, request):
+        items = CartItem.objects.filter(user=request.user).select_related('event')
+        return sum(item.event.price * item.quantity for item in items)
+
+    def get(self, request):
+        total = self._cart_total(request)
+        if not total and not CartItem.objects.filter(user=request.user).exists():
+            return redirect('cart')
+
+        return render(request, 'services/payment.html', {
+            'form': PaymentForm(),
+            'total_price': total,
+            'idempotency_key': idempotency.new_key(),
+        })
+
+    def post(self, request):
+        idempotency_key = idempotency.get_key(request) or idempotency.new_key()
 
-            html_content = render_to_string('services/ticket-email.html', {
-                'tickets': [ticket],
-                'user': user,
-                'purchase_time': purchase_time,
+        form = PaymentForm(request.POST)
+        if not form.is_valid():
+            return render(request, 'services/payment.html', {
+                'form': form,
+                'total_price': self._cart_total(request),
+                'error': 'Проверьте данные карты',
+                'idempotency_key': idempotency_key,
             })
-            text_content = strip_tags(html_content)
-
-            email = EmailMultiAlternatives(
-                subject=subject,
-                body=text_content,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                to=[user.email],
-            )
-            email.attach_alternative(html_content, "text/html")
-
-            # ✅ QR прикрепляем БЕЗ .path (на Render часто ломает)
-            if ticket.qr_code:
-                try:
-                    ticket.qr_code.open("rb")
-                    email.attach(
-                        f"qr_ticket_{ticket.id}.png",
-                        ticket.qr_code.read(),
-                        "image/png"
-                    )
-                    ticket.qr_code.close()
-                except Exception:
-                    logger.exception("Attach QR failed")
 
-            try:
-                # timeout берём из settings если есть
-                connection = get_connection(timeout=getattr(settings, "EMAIL_TIMEOUT", 10))
-                email.connection = connection
-                email.send(fail_silently=False)
-                print(f'EMAIL SENT ticket {ticket.id} -> {user.email}')
-            except Exception as e:
-                print(f'EMAIL ERROR ticket {ticket.id}: {e}')
-                logger.exception("Email send failed")
+        def checkout():
+            return {'ticket_ids': [t.pk for t in checkout_cart(request.user)]}
 
+        try:
+            result, replayed = idempotency.run_once(request.user, idempotency_key, checkout)
+        except CartEmpty:
+            return redirect('cart')
+        except EventUnavailable as e:
+            messages.error(request, f'Нельзя купить билет на «{e.event.title}»: событие прошло или отменено.')
+            return redirect('cart')
+        except inventory.SoldOut:
+            messages.error(request, 'На одно из событий в корзине не хватает билетов.')
+            return redirect('cart')
+
+        if replayed:
+            return redirect('my_tickets')
+
+        messages.success(request, f'Оплата прошла. Куплено билетов: {len(result["ticket_ids"])}. Письмо придёт на почту.')
         return redirect('my_tickets')
 
 
@@ -360,7 +626,11 @@ def ticket_pdf(request, ticket_id):
     """
     Пользователь скачивает PDF только для СВОЕГО билета.
     """
-    ticket = get_object_or_404(Ticket, pk=ticket_id, user=request.user)
+    ticket = get_object_or_404(
+        Ticket.objects.select_related('event', 'event__location', 'user'),
+        pk=ticket_id,
+        user=request.user,
+    )
 
     pdf_bytes = build_ticket_pdf(ticket)
 
@@ -370,6 +640,41 @@ def ticket_pdf(request, ticket_id):
     return response
 
 
+PDF_BUNDLE_MAX_TICKETS = 100
+
+
+@login_required
+def tickets_pdf_bundle(request):
+    """
+    Один PDF (страница на билет) для нескольких своих билетов.
+    ?ids=1,2,3 — выбранные билеты; ?event=<id> — все билеты на событие;
+    без параметров — все действующие (оплачен / возврат запрошен).
+    """
+    tickets = (
+        Ticket.objects
+        .filter(user=request.user)
+        .select_related('event', 'event__location', 'user')
+        .order_by('event__datetime_passing', 'id')
+    )
+
+    ids = [int(x) for x in request.GET.get('ids', '').split(',') if x.strip().isdigit()]
+    event_id = request.GET.get('event', '')
+    if ids:
+        tickets = tickets.filter(pk__in=ids)
+    elif event_id.isdigit():
+        tickets = tickets.filter(event_id=int(event_id))
+    else:
+        tickets = tickets.filter(status__in=('paid', 'refreq'))
+
+    tickets = list(tickets[:PDF_BUNDLE_MAX_TICKETS])
+    if not tickets:
+        raise Http404
+
+    response = HttpResponse(tickets_pdf(tickets), content_type='application/pdf')
+    response['Content-Disposition'] = 'attachment; filename="tickets.pdf"'
+    return response
+
+
 # ===== ИЗБРАННОЕ =====
 
 @login_required(login_url='home')
@@ -454,277 +759,106 @@ def cart_remove(request, item_id):
 
 @staff_member_required(login_url='home')
 def admin_analytics(request):
-    # ----------------------------
-    # 0) Параметры
-    # ----------------------------
-    period = request.GET.get('period', '30')  # all | 7 | 30 | 90
-    mode = request.GET.get('mode', 'gross')   # gross | net
-
-    base_qs = Ticket.objects.select_related('event', 'user').all()
-
-    # ----------------------------
-    # 1) Периоды + сравнение с предыдущим периодом
-    # ----------------------------
-    if period != 'all':
-        days = int(period)
-        since = timezone.now() - timedelta(days=days)
-
-        qs = base_qs.filter(created_at__gte=since)
-
-        prev_since = since - timedelta(days=days)
-        prev_qs = base_qs.filter(created_at__gte=prev_since, created_at__lt=since)
-    else:
-        qs = base_qs
-        prev_qs = None
-
-    # ✅ Gross / Net:
-    # gross: считаем всё (как было)
-    # net: выручка и продажи считаются только по paid (refund не входит)
-    qs_for_kpi = qs.filter(status='paid') if mode == 'net' else qs
-    prev_for_kpi = None
-    if prev_qs is not None:
-        prev_for_kpi = prev_qs.filter(status='paid') if mode == 'net' else prev_qs
-
-    def kpi(q):
-        return {
-            'tickets': q.count(),
-            'revenue': q.aggregate(s=Sum('price'))['s'] or 0
-        }
-
-    cur = kpi(qs_for_kpi)
-    prev = kpi(prev_for_kpi) if prev_for_kpi is not None else None
-
-    def pct(cur_v, prev_v):
-        if prev_v is None:
-            return None
-        if prev_v == 0:
-            return None if cur_v == 0 else 100.0
-        return round((cur_v - prev_v) * 100 / prev_v, 1)
-
-    growth = {
-        'tickets_pct': pct(cur['tickets'], prev['tickets'] if prev else None),
-        'revenue_pct': pct(cur['revenue'], prev['revenue'] if prev else None),
-    }
-
-    total_tickets = cur['tickets']
-    total_revenue = cur['revenue']
-
-    # ----------------------------
-    # 2) Воронка + продуктовые метрики
-    # ----------------------------
-    total_users = User.objects.count()
-
-    # buyers и repeat считаем по "paid", иначе refunded будет считаться покупкой
-    qs_paid = qs.filter(status='paid')
-    buyers = qs_paid.values('user_id').distinct().count()
-    repeat_buyers = (
-        qs_paid.values('user_id')
-              .annotate(c=Count('id'))
-              .filter(c__gte=2)
-              .count()
-    )
-
-    avg_ticket_price = qs_paid.aggregate(a=Avg('price'))['a'] or 0
-    arppu = (float(qs_paid.aggregate(s=Sum('price'))['s'] or 0) / buyers) if buyers else 0
-    repeat_rate = (repeat_buyers * 100 / buyers) if buyers else 0
-
-    funnel = {
-        'total_users': total_users,
-        'buyers': buyers,
-        'tickets': total_tickets,
-        'repeat_buyers': repeat_buyers,
-        'repeat_rate': round(repeat_rate, 1),
-        'avg_ticket_price': round(float(avg_ticket_price), 1) if avg_ticket_price else 0,
-        'arppu': round(float(arppu), 1) if arppu else 0,
-    }
-
-    # ----------------------------
-    # 3) Качество (refund/used) — считаем по qs (по периоду), независимо от mode
-    # ----------------------------
-    refunded_count = qs.filter(status='refunded').count()
-    used_count = qs.filter(status='used').count()
-
-    denom = qs.count() or 0  # чтобы проценты были адекватны по "факту"
-    refund_rate = (refunded_count * 100 / denom) if denom else 0
-    used_rate = (used_count * 100 / denom) if denom else 0
-
-    quality = {
-        'refunded_count': refunded_count,
-        'used_count': used_count,
-        'refund_rate': round(refund_rate, 1),
-        'used_rate': round(used_rate, 1),
-    }
-
-    # ----------------------------
-    # 4) Продажи по событиям/категориям/последние покупки
-    # ----------------------------
-    # Для таблиц продаж логичнее показывать "paid" (иначе refunded будет портить картину)
-    sales_qs = qs_paid if mode == 'net' else qs
-
-    sales_by_event = (
-        sales_qs.values('event__id', 'event__title')
-                .annotate(tickets=Count('id'), revenue=Sum('price'))
-                .order_by('-tickets', '-revenue')
-    )
-    top_events = list(sales_by_event[:5])
-
-    sales_by_category_raw = (
-        sales_qs.values('event__category')
-                .annotate(tickets=Count('id'), revenue=Sum('price'))
-                .order_by('-tickets', '-revenue')
-    )
-
-    category_map = dict(Event.CATEGORY_CHOICES)
-    sales_by_category = [
-        {
-            'code': row['event__category'],
-            'name': category_map.get(row['event__category'], row['event__category']),
-            'tickets': row['tickets'],
-            'revenue': row['revenue'],
-        }
-        for row in sales_by_category_raw
-    ]
-
-    recent_purchases = qs.order_by('-created_at')[:50]
-
-    # ----------------------------
-    # 5) График (по дням) — тоже по sales_qs, чтобы net реально был net
-    # ----------------------------
-    series = (
-        sales_qs.annotate(d=TruncDate('created_at'))
-                .values('d')
-                .annotate(revenue=Sum('price'), tickets=Count('id'))
-                .order_by('d')
-    )
-    chart_labels = [str(x['d']) for x in series]
-    chart_revenue = [float(x['revenue'] or 0) for x in series]
-    chart_tickets = [int(x['tickets'] or 0) for x in series]
-
-    # ----------------------------
-    # 6) ABC-анализ (по выручке) — тоже по sales_qs
-    # ----------------------------
-    sales_list = list(
-        sales_qs.values('event__id', 'event__title')
-                .annotate(revenue=Sum('price'), tickets=Count('id'))
-                .order_by('-revenue', '-tickets')
-    )
-
-    total_rev = sum((x['revenue'] or 0) for x in sales_list) or 1
-    cum = 0
-    abc_rows = []
-    for row in sales_list:
-        cum += (row['revenue'] or 0)
-        share = cum / total_rev
-
-        if share <= 0.8:
-            cls = 'A'
-        elif share <= 0.95:
-            cls = 'B'
-        else:
-            cls = 'C'
-
-        abc_rows.append({
-            **row,
-            'abc': cls,
-            'cum_share': round(share * 100, 1),
-        })
-
-    abc_summary = {
-        'A': sum(1 for r in abc_rows if r['abc'] == 'A'),
-        'B': sum(1 for r in abc_rows if r['abc'] == 'B'),
-        'C': sum(1 for r in abc_rows if r['abc'] == 'C'),
-    }
-
-    # ----------------------------
-    # 7) Алерты/мониторинг
-    # ----------------------------
-    upcoming_no_sales = (
-        Event.objects.filter(datetime_passing__gte=timezone.now())
-             .annotate(sold=Count('ticket'))
-             .filter(sold=0)
-             .order_by('datetime_passing')[:10]
-    )
-
-    avg_price_all = Event.objects.aggregate(a=Avg('price'))['a'] or 0
-    price_alerts = []
-    if avg_price_all:
-        low = avg_price_all * 0.5
-        high = avg_price_all * 2.0
-        price_alerts = Event.objects.filter(Q(price__lte=low) | Q(price__gte=high)).order_by('-price')[:10]
-
-    refunds_by_event = (
-        qs.filter(status='refunded')
-          .values('event__id', 'event__title')
-          .annotate(refunds=Count('id'))
-          .order_by('-refunds')[:10]
+    # period: all | 7 | 30 | 90, mode: gross | net; ?refresh=1 — пересчитать сейчас
+    period, mode = analytics.normalize(
+        request.GET.get('period', '30'),
+        request.GET.get('mode', 'gross'),
     )
+    dashboard = analytics.get_dashboard(period, mode, force=request.GET.get('refresh') == '1')
+    if dashboard is None:
+        # первый расчёт ещё идёт в другом запросе — не считаем его второй раз
+        return render(request, 'services/admin_analytics_computing.html', {'period': period, 'mode': mode})
 
     return render(request, 'services/admin_analytics.html', {
         'period': period,
         'mode': mode,
+        **dashboard.data,
 
-        'total_tickets': total_tickets,
-        'total_revenue': total_revenue,
-        'growth': growth,
-
-        'funnel': funnel,
-        'quality': quality,
-
-        'top_events': top_events,
-        'sales_by_event': sales_by_event,
-        'sales_by_category': sales_by_category,
-        'recent_purchases': recent_purchases,
-
-        'chart_labels': chart_labels,
-        'chart_revenue': chart_revenue,
-        'chart_tickets': chart_tickets,
-
-        'abc_rows': abc_rows[:50],
-        'abc_summary': abc_summary,
-
-        'upcoming_no_sales': upcoming_no_sales,
-        'price_alerts': price_alerts,
-        'refunds_by_event': refunds_by_event,
+        'computed_at': dashboard.computed_at,
+        'data_age': dashboard.age,
+        'data_stale': dashboard.stale,
     })
 
 
 @staff_member_required(login_url='home')
 def admin_analytics_export_csv(request):
-    # экспорт учитывает те же параметры (period/mode)
-    period = request.GET.get('period', '30')  # all | 7 | 30 | 90
-    mode = request.GET.get('mode', 'gross')  # gross | net
-
-    base_qs = Ticket.objects.select_related('event', 'user').order_by('-created_at')
+    # экспорт учитывает те же параметры (period/mode); ?gzip=1 — файл .csv.gz
+    period, mode = analytics.normalize(
+        request.GET.get('period', '30'),
+        request.GET.get('mode', 'gross'),
+    )
+    compress = request.GET.get('gzip') == '1'
 
-    if period != 'all':
-        days = int(period)
-        since = timezone.now() - timedelta(days=days)
-        qs = base_qs.filter(created_at__gte=since)
-    else:
-        qs = base_qs
+    filename = f'tickets_{timezone.now().date()}_{period}_{mode}.csv'
+    if compress:
+        filename += '.gz'
 
-    if mode == 'net':
-        qs = qs.filter(status='paid')
+    # строки уходят клиенту по мере чтения курсора (services/exports.py)
+    response = StreamingHttpResponse(
+        exports.stream_tickets_csv(period, mode, gzip=compress),
+        content_type='application/gzip' if compress else 'text/csv; charset=utf-8',
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
 
-    response = HttpResponse(content_type='text/csv; charset=utf-8')
-    response['Content-Disposition'] = f'attachment; filename="tickets_{timezone.now().date()}_{period}_{mode}.csv"'
-    response.write('\ufeff')  # Excel UTF-8
 
-    writer = csv.writer(response)
-    writer.writerow(['Дата', 'Пользователь email', 'Телефон', 'Событие', 'Цена', 'Статус'])
 
-    for t in qs:
-        writer.writerow([
-            t.created_at.strftime('%Y-%m-%d %H:%M'),
-            getattr(t.user, 'email', ''),
-            getattr(t.user, 'phone_number', ''),
-            t.event.title,
-            t.price,
-            getattr(t, 'status', ''),
-        ])
+@staff_member_required(login_url='home')
+@require_http_methods(['GET', 'POST'])
+def export_jobs(request):
+    # большие выгрузки — в фоне (services/exports.py), здесь запуск и список
+    if request.method == 'POST' and request.POST.get('retry', '').isdigit():
+        # упавшую или устаревшую выгрузку — заново с теми же параметрами
+        old = get_object_or_404(ExportJob, pk=request.POST['retry'], status__in=('failed', 'expired'))
+        job = exports.start_job(old.kind, old.format, old.params, user=request.user)
+        messages.success(request, f'Выгрузка #{job.pk} поставлена в очередь.')
+        return redirect('export_jobs')
+
+    if request.method == 'POST':
+        kind = request.POST.get('kind')
+        fmt = request.POST.get('format', 'csv')
+        if fmt not in dict(ExportJob.FORMAT_CHOICES):
+            fmt = 'csv'
+
+        if kind == 'attendees':
+            event_id = request.POST.get('event', '')
+            if not event_id.isdigit() or not Event.objects.filter(pk=event_id).exists():
+                messages.error(request, 'Укажите существующее событие.')
+                return redirect('export_jobs')
+            params = {'event': int(event_id)}
+        else:
+            kind = 'tickets'
+            period, mode = analytics.normalize(request.POST.get('period', '30'), request.POST.get('mode', 'gross'))
+            params = {'period': period, 'mode': mode}
+
+        job = exports.start_job(kind, fmt, params, user=request.user)
+        messages.success(request, f'Выгрузка #{job.pk} поставлена в очередь.')
+        return redirect('export_jobs')
+
+    # задачи, потерянные при рестарте воркера, не висят "в очереди" вечно
+    exports.recover_stale()
+    jobs = list(ExportJob.objects.select_related('requested_by')[:50])
+    return render(request, 'services/export_jobs.html', {
+        'jobs': jobs,
+        'running': any(j.status in ('queued', 'running') for j in jobs),
+        'keep_days': getattr(settings, 'EXPORT_KEEP_DAYS', 7),
+        'events': Event.objects.order_by('-datetime_passing').only('id', 'title', 'datetime_passing')[:200],
+        'period': request.GET.get('period', '30'),
+        'mode': request.GET.get('mode', 'gross'),
+    })
 
-    return response
 
+@staff_member_required(login_url='home')
+def export_job_download(request, job_id):
+    job = get_object_or_404(ExportJob, pk=job_id, status='done')
+    if not job.file:
+        raise Http404
+    return FileResponse(
+        job.file.open('rb'),
+        as_attachment=True,
+        filename=os.path.basename(job.file.name),
+        content_type='application/gzip',
+    )
 
 
 # мгновенный возврат
@@ -758,9 +892,23 @@ def refund_now(request, ticket_id):
         messages.error(request, f'Возврат недоступен: меньше чем за {REFUND_LOCK_HOURS} часа(ов) до начала события.')
         return redirect('my_tickets')
 
+    with transaction.atomic():
+        updated = (
+            Ticket.objects
+            .filter(pk=ticket.pk, status='paid')
+            .update(status='refunded', refunded_at=now)
+        )
+        if updated:
+            inventory.release(ticket.event_id, 1)
+            rollups.move([ticket.pk], 'paid', 'refunded')
+            cohorts.move([ticket.pk], 'paid', 'refunded')
+
+    if not updated:
+        messages.error(request, 'Возврат недоступен: билет уже не в статусе "Оплачен".')
+        return redirect('my_tickets')
+
     ticket.status = 'refunded'
     ticket.refunded_at = now
-    ticket.save(update_fields=['status', 'refunded_at'])
 
     try:
         send_refund_email(ticket)
@@ -772,24 +920,27 @@ def refund_now(request, ticket_id):
 
 
 
-def _ticket_verify_url(ticket_id: int) -> str:
-    base = getattr(settings, "SITE_URL", "").rstrip("/")
-    token = signing.dumps({"ticket_id": ticket_id}, salt=QR_SALT)
-    return f"{base}/tickets/verify/{ticket_id}/{token}/"
-
-
 @login_required
 def ticket_qr_png(request, ticket_id):
     """
-    PNG QR на лету (без /media).
-    QR содержит ссылку на verify с токеном.
+    PNG QR (без /media): рисуется при первом запросе и берётся из кэша.
+    QR содержит ссылку на verify с токеном. Для одного билета и версии
+    токена картинка не меняется — браузер держит её у себя год.
     """
-    ticket = get_object_or_404(Ticket, pk=ticket_id, user=request.user)
+    if not Ticket.objects.filter(pk=ticket_id, user=request.user).exists():
+        raise Http404
 
-    url = _ticket_verify_url(ticket.id)
-    png_bytes = generate_qr_png(url)
+    etag = qr.etag(ticket_id)
+    cache_control = f"private, max-age={qr.QR_MAX_AGE}, immutable"
 
-    return HttpResponse(png_bytes, content_type="image/png")
+    if etag in request.headers.get("If-None-Match", ""):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(qr.ticket_qr_png(ticket_id), content_type="image/png")
+
+    response["ETag"] = etag
+    response["Cache-Control"] = cache_control
+    return response
 
 
 @require_http_methods(["GET", "POST"])
@@ -811,6 +962,26 @@ def verify_ticket(request, ticket_id, token):
             "can_mark_used": False,
         })
 
+    return _verify_ticket_response(request, ticket_id)
+
+
+@require_http_methods(["GET", "POST"])
+def verify_ticket_compact(request, token):
+    """
+    Короткая ссылка из QR: /T/<токен> (services/tokens.py).
+    """
+    ticket_id = tokens.read_token(token)
+    if ticket_id is None:
+        return render(request, "services/verify_ticket.html", {
+            "ok": False,
+            "reason": "QR-код недействителен (ошибка подписи).",
+            "ticket": None,
+            "can_mark_used": False,
+        })
+    return _verify_ticket_response(request, ticket_id)
+
+
+def _verify_ticket_response(request, ticket_id):
     # 2) достаём билет
     ticket = get_object_or_404(Ticket.objects.select_related("event", "user"), pk=ticket_id)
     now = timezone.now()
@@ -825,9 +996,16 @@ def verify_ticket(request, ticket_id, token):
     elif ticket.status == "cancelled":
         ok = False
         reason = "Билет отменён."
+    elif ticket.status == "refreq":
+        ok = False
+        reason = "По билету запрошен возврат."
     elif ticket.used_at or ticket.status == "used":
         ok = False
         reason = "Билет уже использован."
+    elif ticket.event.is_cancelled:
+        # билеты переводятся в cancelled в фоне — пока идёт, смотрим на событие
+        ok = False
+        reason = "Событие отменено."
     elif ticket.event.datetime_passing <= now:
         ok = False
         reason = "Событие уже прошло."
@@ -840,11 +1018,14 @@ def verify_ticket(request, ticket_id, token):
             return HttpResponse("Forbidden", status=403)
 
         if ok:
-            ticket.status = "used"
-            ticket.used_at = now
-            ticket.save(update_fields=["status", "used_at"])
+            # условный UPDATE paid -> used: второй контролёр с тем же билетом не пройдёт
+            if scanning.mark_used(ticket.pk, now) == scanning.ADMITTED:
+                ticket.status = "used"
+                ticket.used_at = now
+                reason = "Билет отмечен как использованный ✅"
+            else:
+                reason = "Билет уже использован."
             ok = False
-            reason = "Билет отмечен как использованный ✅"
 
     return render(request, "services/verify_ticket.html", {
         "ticket": ticket,
@@ -852,4 +1033,87 @@ def verify_ticket(request, ticket_id, token):
         "reason": reason,
         "can_mark_used": can_mark_used,
         "now": now,
-    })
\ No newline at end of file
+    })
+
+
+# ===== Сканеры на входе (JSON) =====
+
+SCAN_BATCH_MAX = 500
+
+
+def _scan_payload(request):
+    if not (request.user.is_authenticated and request.user.is_staff):
+        return None, JsonResponse({'error': 'forbidden'}, status=403)
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        return None, JsonResponse({'error': 'bad json'}, status=400)
+    if not isinstance(data, dict):
+        return None, JsonResponse({'error': 'json object expected'}, status=400)
+    return data, None
+
+
+@require_POST
+def api_scan(request):
+    """
+    {"code": "<ссылка из QR или токен>"} -> {"ok", "result", "ticket"}
+    """
+    data, error = _scan_payload(request)
+    if error:
+        return error
+    return JsonResponse(scanning.scan(str(data.get('code', ''))))
+
+
+@require_POST
+def api_scan_batch(request):
+    """
+    {"codes": [...]} -> {"results": [...]} в том же порядке.
+    """
+    data, error = _scan_payload(request)
+    if error:
+        return error
+    codes = data.get('codes')
+    if not isinstance(codes, list) or len(codes) > SCAN_BATCH_MAX:
+        return JsonResponse({'error': f'codes: list of up to {SCAN_BATCH_MAX}'}, status=400)
+    return JsonResponse({'results': scanning.scan_many([str(c) for c in codes])})
+
+
+# ===== Офлайн-режим сканеров =====
+
+SCAN_UPLOAD_MAX = 50000
+
+
+@require_GET
+def api_scan_manifest(request, event_id):
+    """
+    Манифест события для офлайн-проверки (services/gate.py).
+    """
+    if not (request.user.is_authenticated and request.user.is_staff):
+        return JsonResponse({'error': 'forbidden'}, status=403)
+    event = get_object_or_404(Event, pk=event_id)
+    response = JsonResponse(gate.build_manifest(event))
+    patch_cache_control(response, private=True, no_store=True)
+    return response
+
+
+@require_POST
+def api_scan_upload(request):
+    """
+    {"event": 12, "device": "gate-3", "scans": [{"code": "...", "scanned_at": "ISO"}, ...]}
+    -> итоги сверки и список конфликтов (двойной вход, недействительный билет).
+    event — id события из манифеста, по которому работал сканер.
+    """
+    data, error = _scan_payload(request)
+    if error:
+        return error
+    event_id = data.get('event')
+    device = str(data.get('device') or '').strip()[:64]
+    scans = data.get('scans')
+    if (
+        not str(event_id).isdigit() or int(event_id) > gate.MAX_ID or not device
+        or not isinstance(scans, list) or len(scans) > SCAN_UPLOAD_MAX
+    ):
+        return JsonResponse({'error': f'event, device and scans (up to {SCAN_UPLOAD_MAX}) required'}, status=400)
+    event = get_object_or_404(Event, pk=int(event_id))
+    return JsonResponse(gate.reconcile(event, device, scans))
+